@@ -20,7 +20,7 @@ os.environ['LANG'] = 'C'
 
 sys.path.insert(0, '..')
 from zeroinstall.injector import qdom, background, namespaces
-from zeroinstall.injector import iface_cache, download, distro, model, handler, reader, trust
+from zeroinstall.injector import iface_cache, download, distro, model, handler, trust
 from zeroinstall import support, cmd
 from zeroinstall.support import basedir, tasks
 
@@ -201,19 +201,18 @@ class BaseTest(unittest.TestCase):
 		iface_cache.get_interface(url)
 
 		if isinstance(contents, qdom.Element):
-			feed = model.ZeroInstallFeed(contents)
+			xml = qdom.to_UTF8(contents)
 		else:
-			feed = reader.load_feed(contents)
+			with open(contents, 'rb') as stream:
+				xml = stream.read()
 
-		iface_cache._feeds[url] = feed
-
-		xml = qdom.to_UTF8(feed.feed_element)
 		upstream_dir = basedir.save_cache_path(namespaces.config_site, 'interfaces')
 		cached = os.path.join(upstream_dir, model.escape(url))
 		with open(cached, 'wb') as stream:
 			stream.write(xml)
+		basedir.invalidate(cached)
 
-		return feed
+		return iface_cache.get_feed(url, force = True)
 
 	def run_0install(self, args):
 		old_stdout = sys.stdout
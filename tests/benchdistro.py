@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""Microbenchmark for distro.try_cleanup_distro_version and distro.cleanup_many.
+
+Usage: benchdistro.py [RPM-LISTING]
+
+RPM-LISTING should be the output of:
+  rpm -qa --qf='%{NAME}\t%{VERSION}-%{RELEASE}\t%{ARCH}\n'
+If not given, a synthetic 5000-line listing in the same style is used."""
+
+from __future__ import print_function
+
+import sys, os, re, random, timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from zeroinstall.injector import distro
+
+def synthetic_listing(n = 5000):
+	rng = random.Random(42)
+	releases = ['1.fc38', '2.fc38', '3.fc38', '1.el9', '0.rc2.fc38', '4.git20230301.fc38']
+	arches = ['x86_64', 'noarch', 'i686']
+	lines = []
+	for i in range(n):
+		version = '.'.join(str(rng.randint(0, 20)) for _ in range(rng.randint(1, 3)))
+		if rng.random() < 0.05:
+			version = '%d:%s' % (rng.randint(1, 3), version)
+		if rng.random() < 0.05:
+			version += '~rc%d' % rng.randint(1, 4)
+		lines.append('package%d\t%s-%s\t%s' % (i, version, rng.choice(releases), rng.choice(arches)))
+	return lines
+
+def uncached_cleanup(version):
+	"""The original implementation, for comparison."""
+	if ':' in version:
+		version = version.split(':')[1]
+	version = version.replace('_', '-')
+	if '~' in version:
+		version, suffix = version.split('~', 1)
+		if suffix.startswith('pre'):
+			suffix = suffix[3:]
+		suffix = '-pre' + (uncached_cleanup(suffix) or '')
+	else:
+		suffix = ''
+	match = re.match(distro._version_regexp, version)
+	if match:
+		major, version, revision = match.groups()
+		if major is not None:
+			version = major[:-1].rstrip('.') + '.' + version
+		if revision is not None:
+			version = '%s-%s' % (version, revision[2:])
+		return version + suffix
+	return None
+
+def main():
+	if len(sys.argv) > 1:
+		with open(sys.argv[1]) as stream:
+			lines = stream.read().splitlines()
+	else:
+		lines = synthetic_listing()
+	versions = [line.split('\t')[1] for line in lines]
+
+	assert [uncached_cleanup(v) for v in versions] == list(distro.cleanup_many(versions))
+
+	def cold():
+		distro.try_cleanup_distro_version.cache_clear()
+		for v in versions:
+			distro.try_cleanup_distro_version(v)
+
+	def warm():
+		for v in versions:
+			distro.try_cleanup_distro_version(v)
+
+	tests = [
+		('original', lambda: [uncached_cleanup(v) for v in versions]),
+		('memoized (cold)', cold),
+		('memoized (warm)', warm),
+		('cleanup_many (warm)', lambda: list(distro.cleanup_many(versions))),
+	]
+
+	print("%d versions" % len(versions))
+	for name, fn in tests:
+		best = min(timeit.repeat(fn, number = 1, repeat = 10))
+		print("%-22s %8.2f ms" % (name, best * 1000))
+
+if __name__ == '__main__':
+	main()
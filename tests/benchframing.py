@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""Benchmark the slave's message framing over a pipe, comparing the previous
+implementation (two writes per message; reads joined with +=) with
+support.write_all and support.read_bytes.
+
+Usage: benchframing.py
+
+Reports messages/sec and MB/sec for many small messages and for a few large
+ones (like a big get-package-impls or populate-cache-explorer reply)."""
+
+from __future__ import print_function
+
+import sys, os, threading, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from zeroinstall import support, logger, _
+
+def old_read_bytes(fd, nbytes):
+	data = b''
+	while nbytes:
+		got = os.read(fd, nbytes)
+		if not got:
+			raise Exception("Unexpected end-of-stream")
+		data += got
+		nbytes -= len(got)
+	logger.debug(_("Message received: %r"), data)
+	return data
+
+def old_send(fd, data):
+	os.write(fd, ('%08x' % len(data)).encode('ascii'))
+	os.write(fd, data)
+
+def old_recv(fd):
+	return old_read_bytes(fd, int(old_read_bytes(fd, 8), 16))
+
+def new_send(fd, data):
+	support.write_all(fd, [('%08x' % len(data)).encode('ascii'), data])
+
+def new_recv(fd):
+	return support.read_bytes(fd, int(support.read_bytes(fd, 8), 16))
+
+def run(send, recv, message, count):
+	r, w = os.pipe()
+	def writer():
+		for i in range(count):
+			send(w, message)
+	thread = threading.Thread(target = writer)
+	start = time.time()
+	thread.start()
+	for i in range(count):
+		assert len(recv(r)) == len(message)
+	thread.join()
+	elapsed = time.time() - start
+	os.close(r)
+	os.close(w)
+	return elapsed
+
+def main():
+	cases = [
+		('small', b'["return","1",["ok",null]]' * 8, 50000),
+		('large', b'x' * (8 * 1024 * 1024), 10),
+	]
+	for name, message, count in cases:
+		for impl, send, recv in [('previous', old_send, old_recv), ('framed', new_send, new_recv)]:
+			elapsed = min(run(send, recv, message, count) for _ in range(3))
+			print("%-6s %-9s %10.0f msg/s %8.1f MB/s" % (name, impl, count / elapsed,
+									 len(message) * count / elapsed / 1024 / 1024))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""Benchmark qdom.parse against the previous implementation on a large (about 10 MB) feed.
+
+Usage: benchqdom.py [FEED]
+
+If FEED isn't given, a synthetic feed with many implementations and long descriptions is used."""
+
+from __future__ import print_function
+
+import sys, os, timeit
+from io import BytesIO
+from xml.parsers import expat
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from zeroinstall.injector import qdom
+
+class OldHandler(object):
+	"""The previous QSAXhandler (without version filtering), for comparison."""
+	def __init__(self):
+		self.stack = []
+
+	def startElementNS(self, fullname, attrs):
+		split = fullname.split(' ', 1)
+		if len(split) == 2:
+			self.stack.append(qdom.Element(split[0], split[1], attrs))
+		else:
+			self.stack.append(qdom.Element(None, fullname, attrs))
+		self.contents = ''
+
+	def characters(self, data):
+		self.contents += data
+
+	def endElementNS(self, name):
+		contents = self.contents.strip()
+		self.stack[-1].content = contents
+		self.contents = ''
+		new = self.stack.pop()
+		if self.stack:
+			self.stack[-1].childNodes.append(new)
+		else:
+			self.doc = new
+
+def old_parse(source):
+	handler = OldHandler()
+	parser = expat.ParserCreate(namespace_separator = ' ')
+	parser.StartElementHandler = handler.startElementNS
+	parser.EndElementHandler = handler.endElementNS
+	parser.CharacterDataHandler = handler.characters
+	parser.ParseFile(source)
+	return handler.doc
+
+def synthetic_feed(size = 10 * 1024 * 1024):
+	out = [b'<?xml version="1.0" ?>\n'
+	       b'<interface xmlns="http://zero-install.sourceforge.net/2004/injector/interface" '
+	       b'xmlns:compile="http://zero-install.sourceforge.net/2006/namespaces/0compile">\n'
+	       b'<name>Big</name><summary>a big feed</summary>\n']
+	description = b'<description>\n' + b'A long description &amp; some more text.\n' * 2000 + b'</description>\n'
+	total = sum(map(len, out))
+	i = 0
+	while total < size:
+		if i % 100 == 0:
+			chunk = description
+		else:
+			chunk = (b'<group arch="Linux-x86_64" license="OSI Approved :: GNU GPL">'
+				 b'<requires interface="http://example.com/lib%d.xml"><version before="2"/></requires>'
+				 b'<implementation id="sha1new=%040d" version="1.%d" released="2013-01-01" compile:min-version="0.1">'
+				 b'<manifest-digest sha256new="%064d"/>'
+				 b'<archive href="http://example.com/big-1.%d.tar.bz2" size="%d"/>'
+				 b'</implementation></group>\n') % (i % 50, i, i, i, i, i)
+		out.append(chunk)
+		total += len(chunk)
+		i += 1
+	out.append(b'</interface>\n')
+	return b''.join(out)
+
+def main():
+	if len(sys.argv) > 1:
+		with open(sys.argv[1], 'rb') as stream:
+			data = stream.read()
+	else:
+		data = synthetic_feed()
+
+	old = old_parse(BytesIO(data))
+	new = qdom.parse(BytesIO(data))
+	assert str(old) == str(new)
+
+	print("%.1f MB" % (len(data) / 1024.0 / 1024))
+	for name, fn in [('previous parser', lambda: old_parse(BytesIO(data))),
+			 ('qdom.parse', lambda: qdom.parse(BytesIO(data)))]:
+		best = min(timeit.repeat(fn, number = 1, repeat = 3))
+		print("%-16s %8.1f ms" % (name, best * 1000))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""Benchmark parsing, sorting and range-testing 100k versions, comparing the list form from
+versions.parse_version with the compact tuples from versions.parse_compact_version.
+The versions are drawn from a pool of 2000 distinct strings, as many versions repeat
+(e.g. the same dependency version across many feeds)."""
+
+from __future__ import print_function
+
+import sys, os, random, timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from zeroinstall.injector import versions
+
+def random_versions(n = 100000):
+	rng = random.Random(42)
+	mods = ['', '-pre1', '-rc2', '-post', '-1', '-2']
+	pool = ['.'.join(str(rng.randint(0, 30)) for _ in range(rng.randint(1, 4))) + rng.choice(mods)
+		for _ in range(n // 50)]
+	return [rng.choice(pool) for _ in range(n)]
+
+def main():
+	strings = random_versions()
+
+	lists = [versions.parse_version(s) for s in strings]
+	tuples = [versions.parse_compact_version(s) for s in strings]
+	assert [versions.format_version(v) for v in sorted(lists)] == \
+	       [versions.format_version(v) for v in sorted(tuples)]
+
+	in_range = versions.parse_version_expression('1.0..!5 | 7 | 10.2..')
+
+	def parse_compact():
+		versions.parse_compact_version.cache_clear()
+		return [versions.parse_compact_version(s) for s in strings]
+
+	tests = [
+		('parse (list)', lambda: [versions.parse_version(s) for s in strings]),
+		('parse (compact, cold)', parse_compact),
+		('parse (compact, warm)', lambda: [versions.parse_compact_version(s) for s in strings]),
+		('sort (list)', lambda: sorted(lists)),
+		('sort (compact)', lambda: sorted(tuples)),
+		('range test (list)', lambda: [in_range(v) for v in lists]),
+		('range test (compact)', lambda: [in_range(v) for v in tuples]),
+	]
+
+	print("%d versions" % len(strings))
+	for name, fn in tests:
+		best = min(timeit.repeat(fn, number = 1, repeat = 5))
+		print("%-24s %8.1f ms" % (name, best * 1000))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+from basetest import BaseTest
+import sys, os, shutil
+import unittest
+
+sys.path.insert(0, '..')
+from zeroinstall.support import basedir
+
+class TestBasedir(BaseTest):
+	def testCache(self):
+		self.assertEqual(None, basedir.load_first_cache('0install.net', 'interfaces', 'a'))
+
+		ifaces = basedir.save_cache_path('0install.net', 'interfaces')
+		self.assertEqual(os.path.join(self.cache_home, '0install.net', 'interfaces'), ifaces)
+		self.assertEqual(None, basedir.load_first_cache('0install.net', 'interfaces', 'a'))
+
+		# Without a cached_listings block, changes are noticed at once
+		path = os.path.join(ifaces, 'a')
+		with open(path, 'w') as stream:
+			stream.write('a')
+		self.assertEqual(path, basedir.load_first_cache('0install.net', 'interfaces', 'a'))
+		os.unlink(path)
+		self.assertEqual(None, basedir.load_first_cache('0install.net', 'interfaces', 'a'))
+
+		with basedir.cached_listings():
+			# Inside one, new files aren't noticed until we invalidate the cache
+			self.assertEqual(None, basedir.load_first_cache('0install.net', 'interfaces', 'a'))
+			with open(path, 'w') as stream:
+				stream.write('a')
+			with basedir.cached_listings():
+				self.assertEqual(None, basedir.load_first_cache('0install.net', 'interfaces', 'a'))
+			self.assertEqual(None, basedir.load_first_cache('0install.net', 'interfaces', 'a'))
+			basedir.invalidate(path)
+			self.assertEqual(path, basedir.load_first_cache('0install.net', 'interfaces', 'a'))
+			self.assertEqual([ifaces], list(basedir.load_cache_paths('0install.net', 'interfaces')))
+
+			# Deleted directories are recreated after invalidating
+			shutil.rmtree(os.path.join(self.cache_home, '0install.net'))
+			basedir.invalidate()
+			self.assertEqual(None, basedir.load_first_cache('0install.net', 'interfaces', 'a'))
+			self.assertEqual(ifaces, basedir.save_cache_path('0install.net', 'interfaces'))
+			assert os.path.isdir(ifaces)
+			self.assertEqual([ifaces], list(basedir.load_cache_paths('0install.net', 'interfaces')))
+
+		# Nothing is cached after the block
+		shutil.rmtree(ifaces)
+		self.assertEqual(ifaces, basedir.save_cache_path('0install.net', 'interfaces'))
+		assert os.path.isdir(ifaces)
+
+	def testThreads(self):
+		# Each thread has its own blocks
+		import threading
+		ifaces = basedir.save_cache_path('0install.net', 'interfaces')
+		path = os.path.join(ifaces, 'a')
+		with basedir.cached_listings():
+			self.assertEqual(None, basedir.load_first_cache('0install.net', 'interfaces', 'a'))
+			with open(path, 'w') as stream:
+				stream.write('a')
+			results = []
+			thread = threading.Thread(target = lambda: results.append(basedir.load_first_cache('0install.net', 'interfaces', 'a')))
+			thread.start()
+			thread.join()
+			self.assertEqual([path], results)
+			self.assertEqual(None, basedir.load_first_cache('0install.net', 'interfaces', 'a'))
+
+	def testMissingDir(self):
+		# Missing directories aren't cached, so files created in them are found at once
+		with basedir.cached_listings():
+			self.assertEqual(None, basedir.load_first_data('0install.net', 'icons', 'a.png'))
+			icons = os.path.join(self.data_home, '0install.net', 'icons')
+			os.makedirs(icons)
+			with open(os.path.join(icons, 'a.png'), 'w') as stream:
+				stream.write('a')
+			self.assertEqual(os.path.join(icons, 'a.png'), basedir.load_first_data('0install.net', 'icons', 'a.png'))
+
+	def testConfig(self):
+		self.assertEqual(None, basedir.load_first_config('0install.net', 'injector', 'global'))
+		path = os.path.join(basedir.save_config_path('0install.net', 'injector'), 'global')
+		with open(path, 'w') as stream:
+			stream.write('[global]\n')
+		basedir.invalidate(path)
+		self.assertEqual(path, basedir.load_first_config('0install.net', 'injector', 'global'))
+		self.assertEqual([path], list(basedir.load_config_paths('0install.net', 'injector', 'global')))
+
+if __name__ == '__main__':
+	unittest.main()
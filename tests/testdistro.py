@@ -1,12 +1,14 @@
 #!/usr/bin/env python
+import basetest
 from basetest import BaseTest, empty_feed
-import sys, os, tempfile, imp
+import sys, os, tempfile, imp, subprocess
 from io import BytesIO
 import unittest
 
 sys.path.insert(0, '..')
 from zeroinstall.injector import distro, model, qdom
-from zeroinstall.support import basedir
+from zeroinstall import support
+from zeroinstall.support import basedir, tasks
 
 def parse_impls(impls):
 	xml = """<?xml version="1.0" ?>
@@ -54,6 +56,40 @@ class TestDistro(BaseTest):
 		finally:
 			src.close()
 
+	def testCandidateCache(self):
+		src = tempfile.NamedTemporaryFile(mode = 'wt')
+		try:
+			cache = distro.CandidateCache('test-candidates', src.name)
+			self.assertEqual(None, cache.get_candidates('gimp'))
+			self.assertEqual(False, cache.get_candidates('gimp', default = False))
+			cache.put_candidates('gimp', [{'version': '2.6.8-2', 'arch': 'x86_64', 'size': 100}])
+			cache.put_candidates('python-nonexistent', None)
+
+			cache = distro.CandidateCache('test-candidates', src.name)
+			self.assertEqual([{'version': '2.6.8-2', 'arch': 'x86_64', 'size': 100}], cache.get_candidates('gimp'))
+			self.assertEqual(None, cache.get_candidates('python-nonexistent', default = False))
+
+			# Expired
+			cache = distro.CandidateCache('test-candidates', src.name, max_age = 60)
+			self.assertEqual('2.6.8-2', cache.get_candidates('gimp')[0]['version'])
+			cache.cached_for['created'] -= 61
+			self.assertEqual(None, cache.get_candidates('gimp'))
+
+			# Source changed
+			cache = distro.CandidateCache('test-candidates', src.name)
+			cache.put_candidates('gimp', [])
+			src.write("updated")
+			src.flush()
+			self.assertEqual(False, cache.get_candidates('gimp', default = False))
+
+			# Time limit only
+			cache = distro.CandidateCache('test-candidates-2', None)
+			cache.put_candidates('gimp', [])
+			cache = distro.CandidateCache('test-candidates-2', None)
+			self.assertEqual([], cache.get_candidates('gimp'))
+		finally:
+			src.close()
+
 	def make_factory(self, distro):
 		def factory(id, only_if_missing = False, installed = True):
 			assert not only_if_missing
@@ -148,6 +184,187 @@ class TestDistro(BaseTest):
 		self.assertEqual('0.41-2', impl.get_version())
 		self.assertEqual(distro.host_machine, impl.machine)
 
+	def testIndexedScan(self):
+		pkgdir = tempfile.mkdtemp()
+		try:
+			os.mkdir(os.path.join(pkgdir, 'infozip-5.52-i486-2'))
+			slack = distro.SlackDistribution(pkgdir)
+			self.assertEqual([('5.52-2', 'i486')], slack.versions['infozip'])
+
+			# A new process reuses the index while the directory is unchanged
+			cache_file = os.path.join(slack.cache_dir, slack.cache_leaf)
+			with open(cache_file, 'at') as stream:
+				stream.write('fake\t1.0\t*\n')
+			os.unlink(cache_file + '.bin')
+			slack = distro.SlackDistribution(pkgdir)
+			self.assertEqual([('1.0', '*')], slack.versions['fake'])
+
+			# Installing a package changes the directory, so the index is rebuilt
+			os.mkdir(os.path.join(pkgdir, 'infozip-6.0-x86_64-1'))
+			os.utime(pkgdir, (0, 0))
+			slack = distro.SlackDistribution(pkgdir)
+			self.assertEqual(None, slack.versions.get('fake', None))
+			self.assertEqual([('5.52-2', 'i486'), ('6.0-1', 'x86_64')], sorted(slack.versions['infozip']))
+
+			# Gentoo entries are indexed under every leafname they could match
+			category_dir = os.path.join(pkgdir, 'media-fonts')
+			for leaf in ['font-adobe-100dpi-1.0.3', 'font-adobe-75dpi-1.0.3']:
+				os.makedirs(os.path.join(category_dir, leaf))
+				with open(os.path.join(category_dir, leaf, 'PF'), 'wt') as stream:
+					stream.write(leaf + '\n')
+				with open(os.path.join(category_dir, leaf, 'CHOST'), 'wt') as stream:
+					stream.write('x86_64-pc-linux-gnu\n')
+			index = distro.GentooCategoryIndex(category_dir)
+			self.assertEqual(1, len(index.get_versions('font-adobe-100dpi')))
+			self.assertEqual(2, len(index.get_versions('font-adobe')))
+			self.assertEqual([], index.get_versions('font'))
+		finally:
+			import shutil
+			shutil.rmtree(pkgdir)
+
+	def testBinaryCache(self):
+		pkgdir = tempfile.mkdtemp()
+		try:
+			names = ['lib%d' % i for i in range(50)] + ['zip', 'a']
+			for name in names:
+				os.mkdir(os.path.join(pkgdir, '%s-1.%d-x86_64-1' % (name, len(name))))
+			os.mkdir(os.path.join(pkgdir, 'zip-2.0-i486-1'))
+
+			slack = distro.SlackDistribution(pkgdir)
+			self.assertTrue(isinstance(slack.versions, distro.MappedVersionIndex))
+			for name in names:
+				self.assertTrue(name in slack.versions)
+			self.assertEqual([('1.1-1', 'x86_64')], slack.versions['a'])
+			self.assertEqual([('1.4-1', 'x86_64')], slack.versions.get('lib7'))
+			self.assertEqual([('1.3-1', 'x86_64'), ('2.0-1', 'i486')], sorted(slack.versions['zip']))
+			self.assertEqual(None, slack.versions.get('lib'))
+			self.assertEqual([], slack.versions.get('zzz', []))
+			self.assertRaises(KeyError, lambda: slack.versions['0'])
+
+			factory = self.make_factory(slack)
+			slack.get_package_info('zip', factory)
+			self.assertEqual(2, len(self.feed.implementations))
+
+			# Replacing the file unmaps the old copy first, but lookups still work
+			index = slack.versions
+			slack._write_binary_cache({'a': [('1.1-1', 'x86_64')]})
+			self.assertEqual(bytes, type(index._map))
+			self.assertEqual([('1.4-1', 'x86_64')], index['lib7'])
+
+			# If the binary cache couldn't be replaced after the text cache changed, we don't use it
+			bin_file = os.path.join(slack.cache_dir, slack.cache_leaf + '.bin')
+			os.utime(bin_file, (0, 0))
+			slack = distro.SlackDistribution(pkgdir)
+			self.assertEqual(dict, type(slack.versions))
+			self.assertEqual([('1.4-1', 'x86_64')], slack.versions['lib7'])
+
+			# A corrupted binary cache falls back to the text version (and gets replaced)
+			with open(bin_file, 'wb') as stream:
+				stream.write(b'corrupted')
+			slack = distro.SlackDistribution(pkgdir)
+			self.assertEqual(dict, type(slack.versions))
+			self.assertEqual([('1.4-1', 'x86_64')], slack.versions['lib7'])
+			slack = distro.SlackDistribution(pkgdir)
+			self.assertEqual([('1.4-1', 'x86_64')], slack.versions['lib7'])
+			self.assertTrue(isinstance(slack.versions, distro.MappedVersionIndex))
+		finally:
+			import shutil
+			shutil.rmtree(pkgdir)
+
+	def testRPM(self):
+		rpmdir = os.path.join(os.path.dirname(__file__), 'rpm')
+		os.environ['PATH'] = rpmdir + ':' + self.old_path
+		old_lc_all = os.environ.get('LC_ALL', None)
+		os.environ['LC_ALL'] = 'de_DE.UTF-8'		# (rpm's messages must not be translated)
+		status = tempfile.NamedTemporaryFile(mode = 'wt')
+		try:
+			# First time, we list everything
+			rpm = distro.RPMDistribution(status.name)
+			factory = self.make_factory(rpm)
+			rpm.get_package_info('yast2-update', factory)
+			rpm.get_package_info('gimp', factory)
+			self.assertEqual(['package:rpm:yast2-update:2.15.23-21:i586'], list(self.feed.implementations))
+
+			asked_file = os.path.join(rpm.cache_dir, rpm.cache_leaf + '.asked')
+			with open(asked_file) as stream:
+				self.assertEqual(['gimp', 'yast2-update'], sorted(stream.read().split()))
+
+			# (e.g. another process asked too)
+			with open(asked_file, 'at') as stream:
+				stream.write('gimp\n')
+
+			# After a change, we only query the packages we've been asked about
+			status.write('changed')
+			status.flush()
+			rpm = distro.RPMDistribution(status.name)
+			self.assertEqual([('2.15.23-21', 'i586')], rpm.versions['yast2-update'])
+			self.assertEqual(None, rpm.versions.get('yast2-mail', None))
+			with open(asked_file) as stream:
+				self.assertEqual('gimp\nyast2-update\n', stream.read())
+
+			# New packages are queried on demand and remembered
+			self.feed = model.ZeroInstallFeed(empty_feed, local_path = '/empty.xml')
+			factory = self.make_factory(rpm)
+			rpm.get_package_info('yast2-mail', factory)
+			self.assertEqual(['package:rpm:yast2-mail:2.15.23-2:*'], list(self.feed.implementations))
+
+			# Package names from feeds are never taken as rpm options
+			rpm.get_package_info('--eval=%{lua:os.exit(1)}', factory)
+			rpm.get_package_info('-a', factory)
+			self.assertEqual(['package:rpm:yast2-mail:2.15.23-2:*'], list(self.feed.implementations))
+
+			os.environ['PATH'] = self.old_path		# (no more calls to rpm needed)
+			rpm = distro.RPMDistribution(status.name)
+			self.assertEqual([('2.15.23-2', '*')], rpm._get_versions('yast2-mail'))
+			self.assertEqual([], rpm._get_versions('gimp'))
+
+			# Full rescans can still be forced
+			os.environ['PATH'] = rpmdir + ':' + self.old_path
+			status.write('changed again')
+			status.flush()
+			class FullRPM(distro.RPMDistribution):
+				incremental = False
+			rpm = FullRPM(status.name)
+			self.assertEqual([('2.15.23-2', '*')], rpm.versions['yast2-mail'])
+			self.assertEqual([('2.15.23-21', 'i586')], rpm.versions['yast2-update'])
+		finally:
+			status.close()
+			if old_lc_all is None:
+				del os.environ['LC_ALL']
+			else:
+				os.environ['LC_ALL'] = old_lc_all
+
+	def testRPMPrefetch(self):
+		rpmdir = os.path.join(os.path.dirname(__file__), 'rpm')
+		os.environ['PATH'] = rpmdir + ':' + self.old_path
+		status = tempfile.NamedTemporaryFile(mode = 'wt')
+		try:
+			rpm = distro.RPMDistribution(status.name)
+			rpm.get_package_info('gimp', self.make_factory(rpm))
+			assert rpm.is_uptodate()
+
+			status.write('changed')
+			status.flush()
+			assert not rpm.is_uptodate()
+			rpm = distro.RPMDistribution(status.name)
+			calls = []
+			real_query = rpm._query_rpm
+			rpm._query_rpm = lambda packages: calls.append(packages) or real_query(packages)
+
+			# All the new packages are queried together
+			packages = ['yast2-mail', 'yast2-update', 'gimp', 'inkscape']
+			rpm.prefetch(packages + ['yast2-mail'])
+			self.assertEqual([['inkscape', 'yast2-mail', 'yast2-update']], calls)
+
+			factory = self.make_factory(rpm)
+			for package in packages:
+				rpm.get_package_info(package, factory)
+			self.assertEqual(1, len(calls))
+			self.assertEqual(['package:rpm:yast2-mail:2.15.23-2:*', 'package:rpm:yast2-update:2.15.23-21:i586'],
+					 sorted(self.feed.implementations))
+		finally:
+			status.close()
+
 	def testMacPorts(self):
 		pkgdir = os.path.join(os.path.dirname(__file__), 'macports')
 		os.environ['PATH'] = pkgdir + ':' + self.old_path
@@ -160,6 +377,101 @@ class TestDistro(BaseTest):
 		self.assertEqual('1.0-0', impl.get_version())
 		self.assertEqual(None, impl.machine)
 
+	def testDebian(self):
+		dpkgdir = os.path.join(os.path.dirname(__file__), 'dpkg')
+		deb = distro.DebianDistribution(os.path.join(dpkgdir, 'status'))
+		deb._packagekit = basetest.DummyPackageKit()
+		assert deb.dpkg_index is not None
+
+		# Answers come from the index, without running dpkg-query
+		os.environ['PATH'] = self.old_path
+		self.assertEqual('3.4.2-10\t*', deb._get_dpkg_info('python-bittorrent'))
+		self.assertEqual('0.3.1-1\ti386', deb._get_dpkg_info('libxcomposite-dev'))
+		self.assertEqual('0.3.1-1\ti386', deb._get_dpkg_info('libxcomposite-dev:i386'))
+		self.assertEqual('7-pre3-2.1.1-3\tx86_64', deb._get_dpkg_info('openjdk-7-jre'))
+		self.assertEqual('-', deb._get_dpkg_info('gimp'))		# Config files only
+		self.assertEqual('-', deb._get_dpkg_info('python-nonexistent'))
+
+		# The index is persisted for the next process
+		deb = distro.DebianDistribution(os.path.join(dpkgdir, 'status'))
+		deb._packagekit = basetest.DummyPackageKit()
+		self.assertEqual('3.4.2-10', deb.dpkg_index.cache['python-bittorrent'].split('\t')[0])
+
+		# Candidates found by an earlier process are used without running apt-cache again
+		deb.apt_candidates.put_candidates('python-bittorrent', {'version': '3.4.2-11.1', 'arch': '*', 'size': 53142})
+		deb = distro.DebianDistribution(os.path.join(dpkgdir, 'status'))
+		deb._packagekit = basetest.DummyPackageKit()
+		factory = self.make_factory(deb)
+		deb.get_package_info('python-bittorrent', factory)
+		self.assertEqual(['package:deb:python-bittorrent:3.4.2-10:*', 'package:deb:python-bittorrent:3.4.2-11.1:*'],
+				sorted(self.feed.implementations))
+		self.assertEqual(53142, self.feed.implementations['package:deb:python-bittorrent:3.4.2-11.1:*'].download_sources[0].size)
+
+		# Without the index, we get the same results from dpkg-query
+		os.environ['PATH'] = dpkgdir + ':' + self.old_path
+		distro.DebianDistribution.use_status_index = False
+		try:
+			deb = distro.DebianDistribution(os.path.join(dpkgdir, 'status'))
+			assert deb.dpkg_index is None
+			self.assertEqual('3.4.2-10\t*', deb._get_dpkg_info('python-bittorrent'))
+			self.assertEqual('7-pre3-2.1.1-3\tx86_64', deb._get_dpkg_info('openjdk-7-jre'))
+			self.assertEqual('-', deb._get_dpkg_info('gimp'))
+		finally:
+			distro.DebianDistribution.use_status_index = True
+
+	def testAptCacheShow(self):
+		dpkgdir = os.path.join(os.path.dirname(__file__), 'dpkg')
+		child = subprocess.Popen([os.path.join(dpkgdir, 'apt-cache'), 'show', '--no-all-versions', '--', 'gimp', 'python-bittorrent'],
+				stdout = subprocess.PIPE, universal_newlines = True)
+		out, _ = child.communicate()
+		results = distro._parse_apt_cache_show(out)
+		self.assertEqual(None, results.get('gimp', None))
+		bt = results['python-bittorrent']
+		self.assertEqual({'version': '3.4.2-11.1', 'arch': '*', 'size': 53142}, bt)
+		assert results['python-bittorrent:all'] is bt
+
+	def testFetchAptCandidates(self):
+		# A fake apt-cache which knows about every package except "missing-*"
+		bindir = tempfile.mkdtemp()
+		log = os.path.join(bindir, 'log')
+		with open(os.path.join(bindir, 'apt-cache'), 'wt') as stream:
+			stream.write("""#!/bin/sh
+shift 3
+echo "$#" >> '%s'
+for package in "$@"; do
+	case "$package" in
+		missing-*) ;;
+		*) printf 'Package: %%s\\nVersion: 1:1.0-1ubuntu1\\nArchitecture: amd64\\nSize: 100\\n\\n' "$package";;
+	esac
+done
+""" % log)
+		os.chmod(os.path.join(bindir, 'apt-cache'), 0o755)
+		os.environ['PATH'] = bindir + ':' + self.old_path
+
+		dpkgdir = os.path.join(os.path.dirname(__file__), 'dpkg')
+		deb = distro.DebianDistribution(os.path.join(dpkgdir, 'status'))
+		deb.apt_candidates.put_candidates('known', {'version': '2', 'arch': '*', 'size': 1})
+
+		names = ['pkg%d' % i for i in range(230)] + ['missing-1', 'known']
+		tasks.wait_for_blocker(deb._fetch_apt_candidates(names))
+
+		# 231 unknown packages, in batches of at most 100
+		with open(log) as stream:
+			self.assertEqual(['100', '100', '31'], stream.read().split())
+
+		expected = {'version': '1.0-1', 'arch': 'x86_64', 'size': 100}
+		self.assertEqual(expected, deb.apt_cache['pkg0'])
+		self.assertEqual(expected, deb.apt_cache['pkg229'])
+		self.assertEqual(None, deb.apt_cache['missing-1'])
+		self.assertEqual({'version': '2', 'arch': '*', 'size': 1}, deb.apt_cache['known'])
+
+		# The results were merged into the shared cache
+		os.environ['PATH'] = self.old_path
+		deb = distro.DebianDistribution(os.path.join(dpkgdir, 'status'))
+		self.assertEqual(expected, deb.apt_candidates.get_candidates('pkg150'))
+		self.assertEqual(None, deb.apt_candidates.get_candidates('missing-1', default = False))
+		support.ro_rmtree(bindir)
+
 	def testCleanVersion(self):
 		self.assertEqual('0.3.1-1', distro.try_cleanup_distro_version('1:0.3.1-1'))
 		self.assertEqual('0.3.1-1', distro.try_cleanup_distro_version('0.3.1-1ubuntu0'))
@@ -172,6 +484,31 @@ class TestDistro(BaseTest):
 		self.assertEqual('7-pre3-2.1.1-pre1-1', distro.try_cleanup_distro_version('7~u3-2.1.1~pre1-1ubuntu2'))
 		self.assertEqual(None, distro.try_cleanup_distro_version('cvs'))
 
+		self.assertEqual(['0.3.1-1', None, '0.3.1-1', '6.17'],
+				 list(distro.cleanup_many(['1:0.3.1-1', 'cvs', '1:0.3.1-1', '6b17'])))
+
+	def testMemoize(self):
+		calls = []
+		@support.memoize(4)
+		def double(x):
+			calls.append(x)
+			return x * 2
+		self.assertEqual(2, double(1))
+		self.assertEqual(4, double(2))
+		self.assertEqual(2, double(1))
+		self.assertEqual([1, 2], calls)
+
+		# Old results are eventually discarded
+		for x in range(10, 20):
+			double(x)
+		del calls[:]
+		self.assertEqual(2, double(1))
+		self.assertEqual([1], calls)
+
+		double.cache_clear()
+		self.assertEqual(4, double(2))
+		self.assertEqual([1, 2], calls)
+
 	def testPortable(self):
 		# Overrides all XDG_* variables
 		os.environ['ZEROINSTALL_PORTABLE_BASE'] = '/portable'
@@ -107,5 +107,48 @@ class TestGPG(BaseTest):
 		self.assertEqual('Thomas Leonard <tal197@users.sourceforge.net>',
 				key.name)
 
+	def testKeyInfoCache(self):
+		calls = []
+		real_run_gpg = gpg._run_gpg
+		def run_gpg(args, **kwargs):
+			calls.append(args)
+			return real_run_gpg(args, **kwargs)
+		gpg._run_gpg = run_gpg
+		try:
+			keys = gpg.load_keys([THOMAS_FINGERPRINT, 'AAAA'])
+			self.assertEqual('(unknown)', keys['AAAA'].name)
+			self.assertEqual(1, len(calls))
+
+			# Cached
+			self.assertEqual(keys[THOMAS_FINGERPRINT].name, gpg.load_key(THOMAS_FINGERPRINT).name)
+			sig = gpg.ValidSig([THOMAS_FINGERPRINT, None, '0'])
+			uids = [item[9] for item in sig.get_details() if item[0] == 'uid']
+			self.assertEqual([keys[THOMAS_FINGERPRINT].name], uids)
+			self.assertEqual(1, len(calls))
+
+			# Fingerprints are matched without regard to case
+			self.assertEqual(keys[THOMAS_FINGERPRINT].name, gpg.load_key(THOMAS_FINGERPRINT.lower()).name)
+			self.assertEqual(1, len(calls))
+
+			# Only the new key is looked up
+			gpg.load_keys([THOMAS_FINGERPRINT, 'BBBB'])
+			self.assertEqual(2, len(calls))
+			assert THOMAS_FINGERPRINT not in calls[1]
+
+			# Unknown keys are checked again, as they may have been imported by another process
+			gpg.load_keys(['BBBB'])
+			self.assertEqual(3, len(calls))
+
+			# Changes to the keyring invalidate the cache
+			with tempfile.TemporaryFile(mode = 'w+b') as stream:
+				stream.write(thomas_key)
+				stream.seek(0)
+				gpg.import_key(stream)
+			calls = []
+			gpg.load_keys([THOMAS_FINGERPRINT])
+			self.assertEqual(1, len(calls))
+		finally:
+			gpg._run_gpg = real_run_gpg
+
 if __name__ == '__main__':
 	unittest.main()
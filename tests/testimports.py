@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+from basetest import BaseTest
+import sys, os, subprocess, json
+import unittest
+
+sys.path.insert(0, '..')
+
+mydir = os.path.dirname(os.path.abspath(__file__))
+
+# Modules the slave shouldn't need just to reply to a ping.
+# We check these rather than timing the start-up, because timings depend on
+# the machine and its load; each of these costs real time when imported.
+unwanted = ['gettext', 'optparse', 'subprocess', 'xml.parsers.expat',
+	'zeroinstall.injector.distro', 'zeroinstall.injector.gpg', 'zeroinstall.injector.download',
+	'zeroinstall.injector.qdom', 'zeroinstall.injector.model', 'zeroinstall.injector.trust']
+
+ping_slave = """
+import os, sys, json
+from zeroinstall.cmd import slave
+slave.handle_invoke(None, None, '1', ['ping'])
+os.write(1, json.dumps(sorted(sys.modules)).encode('utf-8'))
+"""
+
+use_translation = """
+import os, sys, json
+from zeroinstall import translation
+loaded = 'gettext' in sys.modules
+message = translation.ngettext('one key', 'keys', 2)
+os.write(1, json.dumps([loaded, message, 'gettext' in sys.modules]).encode('utf-8'))
+"""
+
+class TestImports(BaseTest):
+	def run_python(self, code):
+		child = subprocess.Popen([sys.executable, '-c', code],
+				env = dict(os.environ, PYTHONPATH = os.path.dirname(mydir)),
+				stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+		stdout, stderr = child.communicate()
+		assert child.returncode == 0, stderr
+		return stdout
+
+	def testSlavePing(self):
+		stdout = self.run_python(ping_slave)
+		length, rest = stdout.split(b'\n', 1)
+		reply, modules = rest[:int(length)], rest[int(length):]
+		self.assertEqual(['return', '1', ['ok', None]], json.loads(reply.decode('utf-8')))
+		loaded = set(json.loads(modules.decode('utf-8')))
+		self.assertEqual([], [m for m in unwanted if m in loaded])
+
+	def testLazyTranslation(self):
+		# The translations are only loaded when used
+		self.assertEqual([False, 'keys', True], json.loads(self.run_python(use_translation).decode('utf-8')))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -51,6 +51,33 @@ class TestModel(BaseTest):
 		assert main_feed.get_metadata('a', 'a') == []
 		assert e.getAttribute('foo') == 'bar'
 
+	def testFromStream(self):
+		xml = b'''<?xml version="1.0"?>
+		<interface xmlns="http://zero-install.sourceforge.net/2004/injector/interface" uri="http://example.com/foo.xml">
+		  <name>Foo</name>
+		  <summary>old summary</summary>
+		  <summary xml:lang="fr">en francais</summary>
+		  <description>Foo</description>
+		  <needs-terminal/>
+		  <group><implementation id="sha1=1" version="1"/></group>
+		  <ns:extra xmlns:ns="http://example.com/ns"/>
+		</interface>'''
+		whole = model.ZeroInstallFeed(qdom.parse(BytesIO(xml)))
+		streamed = model.ZeroInstallFeed.from_stream(qdom.iterparse(BytesIO(xml), chunk_size = 10))
+		for feed in [whole, streamed]:
+			self.assertEqual('http://example.com/foo.xml', feed.url)
+			self.assertEqual('Foo', feed.get_name())
+			self.assertEqual({'en': 'old summary', 'fr': 'en francais'}, feed.summaries)
+			self.assertEqual(1, len(feed.get_metadata(model.XMLNS_IFACE, 'needs-terminal')))
+			self.assertEqual(1, len(feed.get_metadata('http://example.com/ns', 'extra')))
+		self.assertEqual(1, len(whole.get_metadata(model.XMLNS_IFACE, 'group')))
+		self.assertEqual([], streamed.get_metadata(model.XMLNS_IFACE, 'group'))
+		self.assertEqual([], streamed.feed_element.childNodes)
+
+		# Problems with the header are detected before reading the rest
+		bad = xml.replace(b'uri=', b'min-injector-version="1000" uri=').replace(b'</interface>', b'')
+		self.assertRaises(model.InvalidInterface, lambda: model.ZeroInstallFeed.from_stream(qdom.iterparse(BytesIO(bad))))
+
 	def testVersions(self):
 		def pv(v):
 			parsed = model.parse_version(v)
@@ -99,5 +126,56 @@ class TestModel(BaseTest):
 
 		assert pv('2-post999') < pv('3-pre1')
 
+	def testCompactVersions(self):
+		from zeroinstall.injector import versions
+		strings = ['1.0-pre99', '1.0', '0.9.9', '1.0-pre1', '2.1.9-pre-1', '1.0-0', '1.0-rc1',
+			   '10', '1-rc2.0-pre-post', '1.0-post', '2.1.9-pre', '1']
+		by_list = sorted(strings, key = model.parse_version)
+		by_tuple = sorted(strings, key = versions.parse_compact_version)
+		self.assertEqual(by_list, by_tuple)
+
+		cv = versions.parse_compact_version('1-rc2.0-pre-post')
+		self.assertEqual(((1,), -1, (2, 0), -2, (), 1), cv)
+		assert cv is versions.parse_compact_version('1-rc2.0-pre-post')
+		self.assertEqual('1-rc2.0-pre-post', model.format_version(cv))
+		self.assertEqual(cv, versions.compact_version(model.parse_version('1-rc2.0-pre-post')))
+		self.assertEqual({cv}, {cv, versions.parse_compact_version('1-rc2.0-pre-post')})
+		self.assertRaises(model.SafeException, versions.parse_compact_version, '1..2')
+
+		# Ranges accept either form
+		test = versions.parse_version_expression('1.0..!2 | 3 | !7')
+		for v in ['0.9', '1.0', '1.5', '2', '3', '7']:
+			self.assertEqual(test(model.parse_version(v)), test(versions.parse_compact_version(v)))
+		self.assertTrue(test(versions.parse_compact_version('1.5')))
+		self.assertFalse(versions.parse_version_range('1.0..!2')(versions.parse_compact_version('2')))
+
+		# Neither form is converted for each test
+		real_compact_version = versions.compact_version
+		versions.compact_version = lambda v: 1 / 0
+		try:
+			self.assertTrue(test(model.parse_version('1.5')))
+			self.assertFalse(test(model.parse_version('7')))
+		finally:
+			versions.compact_version = real_compact_version
+
+	def testVersionRanges(self):
+		from zeroinstall.injector import versions
+		def check(expr, matching, not_matching):
+			test = versions.parse_version_expression(expr)
+			for v in matching:
+				assert test(model.parse_version(v)), (expr, v)
+			for v in not_matching:
+				assert not test(model.parse_version(v)), (expr, v)
+		check('2', ['2'], ['1', '2.0', '2.1', '2-pre1'])
+		check('!2', ['1', '2.1'], ['2'])
+		check('1.0..!2', ['1.0', '1.9', '2-pre1'], ['0.9', '2', '3'])
+		check('..!2', ['0', '1.9'], ['2'])
+		check('2..', ['2', '10'], ['1.9', '2-rc1'])
+		check('..!1 | 3 | 5..', ['0.9', '3', '7'], ['1', '2', '4'])
+
+		self.assertTrue(versions.parse_version_range(' 1.0..!2 '.strip())(model.parse_version('1.5')))
+		self.assertRaises(model.SafeException, versions.parse_version_range, '1..2')
+		self.assertRaises(model.SafeException, versions.parse_version_expression, '1..!2 | foo')
+
 if __name__ == '__main__':
 	unittest.main()
@@ -3,6 +3,7 @@ from basetest import BaseTest
 import sys
 from io import BytesIO
 import unittest
+from xml.parsers import expat
 
 sys.path.insert(0, '..')
 
@@ -25,6 +26,13 @@ class TestQDom(BaseTest):
 		assert root.content == 'Hi'
 		assert root.childNodes == []
 
+		# Text split across several chunks (entities, CDATA), and text after a child
+		root = parseString('<?xml version="1.0"?><root>' +
+			'<a> x &amp; y <![CDATA[<z>]]> </a><b>before<c/>after</b></root>')
+		assert root.childNodes[0].content == 'x & y <z>'
+		assert root.childNodes[1].content == 'after'
+		assert root.childNodes[1].childNodes[0].content == ''
+
 	def testNS(self):
 		root = parseString('<?xml version="1.0"?>' +
 			'<x:root xmlns:x="http://myns.com/foo"/>')
@@ -44,6 +52,13 @@ class TestQDom(BaseTest):
 		assert root.attrs.get('http://myns.com/foo foo') == 'bar'
 		assert root.attrs.get('bar') == 'baz'
 
+		root = parseString('<?xml version="1.0"?>' +
+			'<root><a x="1"/><a x="2"/></root>')
+		a1, a2 = root.childNodes
+		assert a1.name is a2.name
+		assert a1.attrs == {'x': '1'}
+		assert a2.attrs == {'x': '2'}
+
 	def testNested(self):
 		root = parseString('<?xml version="1.0"?><root>' +
 			'<name>Bob</name><age>3</age></root>')
@@ -67,5 +82,52 @@ class TestQDom(BaseTest):
 			'<sub x="2">hi</sub><empty/></root>')
 		assert 'root' in str(root)
 
+	def testFreeze(self):
+		import marshal
+		root = parseString('<?xml version="1.0"?><root xmlns="http://x"><sub x="2">hi</sub><empty/></root>')
+		frozen = qdom.freeze(root)
+		copy = qdom.thaw(marshal.loads(marshal.dumps(frozen)))
+		self.assertEqual(str(root), str(copy))
+		self.assertEqual('http://x', copy.childNodes[0].uri)
+		self.assertEqual('2', copy.childNodes[0].getAttribute('x'))
+		self.assertEqual('hi', copy.childNodes[0].content)
+
+	def testIterparse(self):
+		xml = ('<?xml version="1.0"?><root a="1">' +
+			'<x>one</x><y><z>two</z></y>' +
+			'<old if-0install-version="..!1.0"/>' +
+			'<x>' + 'three ' * 100 + '</x></root>').encode('utf-8')
+		for chunk_size in [1, 7, 1000]:
+			items = list(qdom.iterparse(BytesIO(xml), filter_for_version = True, chunk_size = chunk_size))
+			root = items[0]
+			self.assertEqual('root', root.name)
+			self.assertEqual({'a': '1'}, root.attrs)
+			self.assertEqual([], root.childNodes)
+			self.assertEqual(['x', 'y', 'x'], [child.name for child in items[1:]])
+			self.assertEqual('two', items[2].childNodes[0].content)
+			self.assertEqual(600, len(items[3].content) + 1)
+
+		root, = qdom.iterparse(BytesIO(b'<root/>'))
+		self.assertEqual('root', root.name)
+
+		try:
+			list(qdom.iterparse(BytesIO(b'<root><x/>')))
+			assert 0
+		except expat.ExpatError:
+			pass
+
+	def testFilterForVersion(self):
+		xml = ('<?xml version="1.0"?><root>' +
+			'<a if-0install-version="..!1.0"/>' +
+			'<b if-0install-version="1.0.. | 0.1"/>' +
+			'<c if-0install-version="..!1.0 | !0.1"/>' +
+			'<d if-0install-version="..!1.0"/>' +
+			'<e/></root>')
+		root = qdom.parse(BytesIO(xml.encode('utf-8')), filter_for_version = True)
+		self.assertEqual(['b', 'c', 'e'], [child.name for child in root.childNodes])
+
+		root = parseString(xml)
+		self.assertEqual(['a', 'b', 'c', 'd', 'e'], [child.name for child in root.childNodes])
+
 if __name__ == '__main__':
 	unittest.main()
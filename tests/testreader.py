@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+from basetest import BaseTest
+import sys, os, tempfile, shutil
+import unittest
+
+sys.path.insert(0, '..')
+from zeroinstall.injector import reader, model, iface_cache, namespaces
+from zeroinstall.support import basedir
+
+feed_xml = b"""<?xml version="1.0" ?>
+<interface xmlns="http://zero-install.sourceforge.net/2004/injector/interface">
+  <name>Lazy</name>
+  <summary>a lazy feed</summary>
+  <summary xml:lang="de">ein faules Feed</summary>
+  <needs-terminal/>
+  <group><implementation id="sha1=1" version="1"/></group>
+</interface>
+"""
+
+class TestReader(BaseTest):
+	def setUp(self):
+		BaseTest.setUp(self)
+		self.tmpdir = tempfile.mkdtemp()
+		self.path = os.path.join(self.tmpdir, 'lazy.xml')
+		with open(self.path, 'wb') as stream:
+			stream.write(feed_xml)
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpdir)
+		BaseTest.tearDown(self)
+
+	def testLazy(self):
+		feed = reader.load_feed(self.path, local = True, lazy = True)
+		self.assertEqual('Lazy', feed.get_name())
+		self.assertEqual(self.path, feed.url)
+		self.assertEqual({'en': 'a lazy feed', 'de': 'ein faules Feed'}, feed.summaries)
+		self.assertEqual(int(os.stat(self.path).st_mtime), feed.last_modified)
+
+		# The second time, the header comes from the sidecar without parsing the XML
+		with open(self.path, 'rb') as stream:
+			original = stream.read()
+		with open(self.path, 'wb') as stream:
+			stream.write(original.replace(b'<name>Lazy</name>', b'<name>LAZY</name>'))
+		os.utime(self.path, (feed.last_modified, feed.last_modified))
+		feed = reader.load_feed(self.path, local = True, lazy = True)
+		self.assertEqual('Lazy', feed.get_name())		# (same size and mtime, so we used the sidecar)
+		self.assertEqual('a lazy feed', feed.summary)
+		assert not feed._loaded
+
+		# Other attributes trigger a full load (from the parse cache, since the file looks unchanged)
+		self.assertEqual(1, len(feed.get_metadata(model.XMLNS_IFACE, 'needs-terminal')))
+		assert feed._loaded
+		self.assertEqual('Lazy', feed.get_name())
+		self.assertEqual({}, feed.implementations)
+		self.assertEqual(int(os.stat(self.path).st_mtime), feed.last_modified)
+		self.assertRaises(AttributeError, lambda: feed.descriptions)
+
+		# Changes to the file are noticed
+		with open(self.path, 'wb') as stream:
+			stream.write(original.replace(b'<name>Lazy</name>', b'<name>Lazier</name>'))
+		feed = reader.load_feed(self.path, local = True, lazy = True)
+		self.assertEqual('Lazier', feed.get_name())
+
+	def testLazyErrors(self):
+		feed = reader.load_feed(self.path, local = True, lazy = True)
+		feed = reader.load_feed(self.path, local = True, lazy = True)		# (header from the sidecar)
+		assert not feed._loaded
+
+		# Unknown attributes don't load the feed
+		assert not hasattr(feed, 'no_such_attribute')
+		assert not hasattr(feed, '_private')
+		assert not feed._loaded
+
+		# A failed load is reported every time, and leaves the header intact
+		os.unlink(self.path)
+		for i in range(2):
+			self.assertRaises(reader.MissingLocalFeed, lambda: feed.metadata)
+			assert not feed._loaded
+			self.assertEqual('Lazy', feed.get_name())
+
+	def testParseCache(self):
+		def load():
+			feed = reader.load_feed(self.path, local = True, lazy = True)
+			feed.get_metadata(model.XMLNS_IFACE, 'needs-terminal')
+			return feed
+		mtime = os.stat(self.path).st_mtime
+
+		feed = load()
+		self.assertEqual('Lazy', feed.get_name())
+		self.assertEqual({}, feed.implementations)
+		self.assertEqual('ein faules Feed', feed.summaries['de'])
+
+		# Same size and mtime; the cached tree is used
+		with open(self.path, 'wb') as stream:
+			stream.write(feed_xml.replace(b'<needs-terminal/>', b'<needs-terminax/>'))
+		os.utime(self.path, (mtime, mtime))
+		feed = load()
+		self.assertEqual(1, len(feed.get_metadata(model.XMLNS_IFACE, 'needs-terminal')))
+		self.assertEqual('ein faules Feed', feed.summaries['de'])
+
+		# Normal loads use it too, and get the whole tree
+		feed = reader.load_feed(self.path, local = True)
+		self.assertEqual(1, len(feed.get_metadata(model.XMLNS_IFACE, 'needs-terminal')))
+		self.assertEqual(1, len(feed.get_metadata(model.XMLNS_IFACE, 'group')))
+
+		# A different mtime invalidates it
+		os.utime(self.path, (mtime + 10, mtime + 10))
+		feed = load()
+		self.assertEqual(0, len(feed.get_metadata(model.XMLNS_IFACE, 'needs-terminal')))
+
+		# A corrupted cache is ignored
+		cache_dir = os.path.join(self.cache_home, '0install.net', 'injector', 'parsed-feeds')
+		for leaf in os.listdir(cache_dir):
+			with open(os.path.join(cache_dir, leaf), 'wb') as stream:
+				stream.write(b'junk')
+		header_dir = os.path.join(self.cache_home, '0install.net', 'injector', 'feed-headers')
+		shutil.rmtree(header_dir)
+		feed = load()
+		self.assertEqual(0, len(feed.get_metadata(model.XMLNS_IFACE, 'needs-terminal')))
+		self.assertEqual('Lazy', feed.get_name())
+
+	def testPruneCaches(self):
+		cache_dirs = [os.path.join(self.cache_home, '0install.net', 'injector', leaf) for leaf in ['parsed-feeds', 'feed-headers']]
+		def entries():
+			return sorted(leaf for cache_dir in cache_dirs for leaf in os.listdir(cache_dir) if not leaf.startswith('.'))
+
+		paths = []
+		for i in range(3):
+			path = os.path.join(self.tmpdir, 'feed%d.xml' % i)
+			shutil.copy(self.path, path)
+			reader.load_feed(path, local = True, lazy = True)
+			paths.append(path)
+		self.assertEqual(6, len(entries()))
+
+		# Entries for deleted feeds are removed
+		reader.forget_feed(paths[0])
+		os.unlink(paths[0])
+		os.unlink(paths[1])
+		self.assertEqual(4, len(entries()))
+		reader.prune_feed_caches()
+		self.assertEqual(2, len(entries()))
+
+		# The remaining entries are still used
+		reader.load_feed(paths[2], local = True, lazy = True).metadata
+		kept = entries()
+		reader.prune_feed_caches()
+		self.assertEqual(kept, entries())
+
+		# Pruning happens automatically once a day, when writing a new entry
+		stamp = os.path.join(cache_dirs[0], '.last-pruned')
+		assert os.path.exists(stamp)
+		os.unlink(paths[2])
+		reader.load_feed(self.path, local = True)
+		self.assertEqual(2 + 1, len(entries()))		# (not yet)
+		os.utime(stamp, (0, 0))
+		os.utime(self.path, (1000, 1000))
+		reader.load_feed(self.path, local = True)
+		self.assertEqual(1, len(entries()))
+		assert os.stat(stamp).st_mtime > 0
+
+	def testLoadFeed(self):
+		# By default, we keep the whole document
+		feed = reader.load_feed(self.path, local = True)
+		self.assertEqual('Lazy', feed.get_name())
+		self.assertEqual(1, len(feed.get_metadata(model.XMLNS_IFACE, 'group')))
+		self.assertEqual(['name', 'summary', 'summary', 'needs-terminal', 'group'],
+				 [child.name for child in feed.feed_element.childNodes])
+
+		# Streaming discards the implementations
+		feed = reader.load_feed(self.path, local = True, streaming = True)
+		self.assertEqual('Lazy', feed.get_name())
+		self.assertEqual(1, len(feed.get_metadata(model.XMLNS_IFACE, 'needs-terminal')))
+		self.assertEqual([], feed.get_metadata(model.XMLNS_IFACE, 'group'))
+		self.assertEqual([], feed.feed_element.childNodes)
+
+		for streaming in [False, True]:
+			self.assertRaises(reader.MissingLocalFeed, reader.load_feed, os.path.join(self.tmpdir, 'missing.xml'), True, streaming = streaming)
+			with open(self.path, 'wb') as stream:
+				stream.write(feed_xml[:-20])
+			self.assertRaises(model.InvalidInterface, reader.load_feed, self.path, True, streaming = streaming)
+
+	def testErrors(self):
+		self.assertRaises(reader.MissingLocalFeed, reader.load_feed, os.path.join(self.tmpdir, 'missing.xml'), True, True)
+
+		with open(self.path, 'wb') as stream:
+			stream.write(feed_xml.replace(b'<name>Lazy</name>', b''))
+		self.assertRaises(model.InvalidInterface, reader.load_feed, self.path, True, True)
+
+		with open(self.path, 'wb') as stream:
+			stream.write(feed_xml[:-20])
+		self.assertRaises(model.InvalidInterface, reader.load_feed, self.path, True, True)
+
+	def testIfaceCache(self):
+		cache = iface_cache.IfaceCache()
+		feed = cache.get_feed(self.path)
+		assert isinstance(feed, reader.LazyZeroInstallFeed)
+		self.assertEqual('Lazy', feed.get_name())
+		assert cache.get_feed(self.path) is feed
+
+	def testIfaceCacheLimits(self):
+		paths = []
+		for i in range(4):
+			path = os.path.join(self.tmpdir, 'feed%d.xml' % i)
+			shutil.copy(self.path, path)
+			reader.load_feed(path, local = True, lazy = True)	# (write the header sidecar)
+			paths.append(path)
+
+		cache = iface_cache.IfaceCache(max_entries = 2)
+		cache.pin([paths[0]])
+		feeds = [cache.get_feed(path) for path in paths]
+		self.assertEqual((0, 4, 2), (cache.hits, cache.misses, cache.evictions))
+		assert cache.get_feed(paths[0]) is feeds[0]		# pinned
+		assert cache.get_feed(paths[3]) is feeds[3]		# most-recently used
+		assert cache.get_feed(paths[1]) is not feeds[1]		# evicted
+		self.assertEqual((2, 5, 3), (cache.hits, cache.misses, cache.evictions))
+
+		# Hits don't need to check the limits
+		real_evict = iface_cache.IfaceCache._evict
+		iface_cache.IfaceCache._evict = lambda self: 1 / 0
+		try:
+			assert cache.get_feed(paths[0]) is feeds[0]
+		finally:
+			iface_cache.IfaceCache._evict = real_evict
+
+		# Loading a feed fully increases its estimated size
+		before = cache.total_bytes
+		feeds[0].get_metadata(model.XMLNS_IFACE, 'needs-terminal')
+		cache.get_feed(paths[0])
+		assert cache.total_bytes > before, (cache.total_bytes, before)
+
+		# Negative entries count too
+		cache.get_feed('http://example.com/missing.xml')
+		self.assertEqual(2, len(cache._feeds))
+
+		# Memory budget
+		size = iface_cache.estimate_size(feeds[0])
+		cache = iface_cache.IfaceCache(max_bytes = size * 2 + 100)
+		for path in paths:
+			cache.get_feed(path).get_metadata(model.XMLNS_IFACE, 'needs-terminal')
+			cache.get_feed(path)
+		self.assertEqual(2, len(cache._feeds))
+		self.assertEqual(size * 2, cache.total_bytes)
+
+		# Interfaces
+		cache = iface_cache.IfaceCache(max_entries = 1)
+		iface = cache.get_interface('http://example.com/a')
+		assert cache.get_interface('http://example.com/a') is iface
+		cache.get_interface('http://example.com/b')
+		assert cache.get_interface('http://example.com/a') is not iface
+		self.assertEqual((1, 3, 2), (cache.hits, cache.misses, cache.evictions))
+
+	def testGetFeeds(self):
+		cache_dir = basedir.save_cache_path(namespaces.config_site, 'interfaces')
+		urls = ['http://example.com/feed%d.xml' % i for i in range(5)]
+		for url in urls:
+			with open(os.path.join(cache_dir, model.escape(url)), 'wb') as stream:
+				stream.write(feed_xml.replace(b'<interface ', b'<interface uri="' + url.encode('utf-8') + b'" ')
+						     .replace(b'<name>Lazy', b'<name>' + url.encode('utf-8')))
+		missing = 'http://example.com/missing.xml'
+
+		paths = reader.find_cached_feeds(urls + [missing, self.path])
+		self.assertEqual(os.path.join(cache_dir, model.escape(urls[0])), paths[urls[0]])
+		self.assertEqual(None, paths[missing])
+		self.assertEqual(self.path, paths[self.path])
+
+		cache = iface_cache.IfaceCache()
+		first = cache.get_feed(urls[0])
+		feeds = cache.get_feeds([missing, self.path] + urls + [urls[1]])
+		self.assertEqual([None, 'Lazy'] + urls + [urls[1]], [feed and feed.get_name() for feed in feeds])
+		assert feeds[2] is first
+		assert cache.get_feed(urls[1]) is feeds[3]
+		assert cache.get_feeds([urls[1]], force = True)[0] is not feeds[3]
+
+		# Errors are raised after loading the other feeds
+		bad = 'http://example.com/bad.xml'
+		with open(os.path.join(cache_dir, model.escape(bad)), 'wb') as stream:
+			stream.write(b'<bad')
+		cache = iface_cache.IfaceCache()
+		try:
+			cache.get_feeds(urls + [bad])
+			assert 0
+		except model.InvalidInterface as ex:
+			self.assertEqual(bad, ex.feed_url)
+		self.assertEqual(len(urls), len(cache._feeds))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+from basetest import BaseTest
+import basetest
+import sys, os, threading, tempfile, socket, time, json
+import unittest
+
+sys.path.insert(0, '..')
+real_stdout = sys.stdout
+from zeroinstall.cmd import slave
+sys.stdout = real_stdout
+
+class TestSlave(BaseTest):
+	def setUp(self):
+		BaseTest.setUp(self)
+		self.replies = []
+		self.replied = threading.Condition()
+		def send_json(message):
+			with self.replied:
+				self.replies.append(message)
+				self.replied.notify_all()
+		self.real = (slave.send_json, slave.read_chunk, slave.do_get_package_impls)
+		slave.send_json = send_json
+		slave.read_chunk = lambda: b'<package-implementations/>'
+
+	def tearDown(self):
+		slave.send_json, slave.read_chunk, slave.do_get_package_impls = self.real
+		BaseTest.tearDown(self)
+
+	def wait_for_replies(self, n):
+		with self.replied:
+			while len(self.replies) < n:
+				self.replied.wait(5)
+		return [reply[1:] for reply in self.replies]
+
+	def testPipelined(self):
+		release = threading.Event()
+		def wait_for_network(config):
+			release.wait(5)
+		old_wait = slave.do_wait_for_network
+		slave.do_wait_for_network = wait_for_network
+		try:
+			slave.handle_invoke(self.config, None, '1', ['wait-for-network'])
+			slave.handle_invoke(self.config, None, '2', ['ping'])
+
+			# The ping is answered while we're still waiting for the network
+			self.assertEqual([['2', ['ok', None]]], self.wait_for_replies(1))
+
+			release.set()
+			self.assertEqual([['2', ['ok', None]],
+					  ['1', ['ok', None]]], self.wait_for_replies(2))
+			slave.network_worker.wait()
+		finally:
+			slave.do_wait_for_network = old_wait
+
+	def testInterleavedDistro(self):
+		# Requests using the distribution can be sent together, but they're all handled on the
+		# main thread, in order
+		calls = []
+		class FakeFeed:
+			implementations = {}
+		class FakeDistro:
+			def get_feed(self, url, package_impls):
+				calls.append(('get_feed', url, threading.current_thread().name))
+				return FakeFeed()
+			def fetch_candidates(self, package_impls):
+				calls.append(('fetch_candidates', package_impls[0][1]['package'], threading.current_thread().name))
+		old = (slave._distro, slave.reply_when_done)
+		slave._distro = FakeDistro()
+		slave.reply_when_done = lambda ticket, blocker: slave.send_json(["return", ticket, ["ok", []]])
+		slave.read_chunk = lambda: b'<feed><package-implementation package="gimp"/></feed>'
+		try:
+			slave.handle_invoke(self.config, None, '1', ['get-package-impls', 'http://example.com/1'])
+			slave.handle_invoke(self.config, None, '2', ['get-distro-candidates', 'http://example.com/1'])
+			slave.handle_invoke(self.config, None, '3', ['get-package-impls', 'http://example.com/2'])
+			slave.handle_invoke(self.config, None, '4', ['get-distro-candidates', 'http://example.com/2'])
+		finally:
+			slave._distro, slave.reply_when_done = old
+		main = threading.current_thread().name
+		self.assertEqual([('get_feed', 'http://example.com/1', main),
+				  ('fetch_candidates', 'gimp', main),
+				  ('get_feed', 'http://example.com/2', main),
+				  ('fetch_candidates', 'gimp', main)], calls)
+		self.assertEqual(['1', '2', '3', '4'], [reply[0] for reply in self.wait_for_replies(4)])
+
+	def testMessageListings(self):
+		from zeroinstall.support import basedir
+		icons = basedir.save_cache_path('0install.net', 'interface_icons')
+		found = []
+		def lookup(value):
+			found.append(basedir.load_first_cache('0install.net', 'interface_icons', 'icon.png'))
+		slave.pending_replies['1'] = lookup
+		slave.handle_message(self.config, None, ['return', '1', ['ok', None]])
+
+		# e.g. the master downloaded an icon for us; listings cached for the last message aren't used
+		with open(os.path.join(icons, 'icon.png'), 'w') as stream:
+			stream.write('png')
+		slave.pending_replies['2'] = lookup
+		slave.handle_message(self.config, None, ['return', '2', ['ok', None]])
+		self.assertEqual([None, os.path.join(icons, 'icon.png')], found)
+
+	def testNegotiateEncoding(self):
+		from zeroinstall.injector import qdom
+		from zeroinstall.support import msgpack_lite
+		r, w = os.pipe()
+		real_send_json = self.real[0]
+		old_stdout = slave.stdout
+		slave.send_json = real_send_json
+		slave.stdout = os.fdopen(w, 'wb')
+		def read_reply():
+			length = b''
+			while not length.endswith(b'\n'):
+				length += os.read(r, 1)
+			return os.read(r, int(length))
+		try:
+			slave.handle_invoke(self.config, None, '1', ['negotiate-encoding', ['cbor', 'msgpack', 'json']])
+			# The reply still uses JSON
+			self.assertEqual(b'["return", "1", ["ok", "msgpack"]]', read_reply())
+			self.assertEqual('msgpack', slave.encoding)
+
+			# A pre-parsed document can replace the XML chunk
+			slave.read_chunk = None
+			slave.do_get_package_impls = lambda config, options, args, xml: [args, xml.name, len(xml.childNodes)]
+			root = qdom.Element(None, 'feed', {})
+			root.childNodes.append(qdom.Element(None, 'package-implementation', {'package': 'gimp'}))
+			request = msgpack_lite.unpackb(msgpack_lite.packb(['get-package-impls', 'http://example.com/feed', root]))
+			slave.handle_invoke(self.config, None, '2', request)
+			self.assertEqual(['return', '2', ['ok', [['http://example.com/feed'], 'feed', 1]]],
+					 msgpack_lite.unpackb(read_reply()))
+
+			# Old masters don't negotiate; a master with no common encoding gets JSON
+			slave.handle_invoke(self.config, None, '3', ['negotiate-encoding', ['cbor']])
+			self.assertEqual(['return', '3', ['ok', 'json']], msgpack_lite.unpackb(read_reply()))
+			self.assertEqual('json', slave.encoding)
+		finally:
+			slave.encoding = 'json'
+			slave.stdout.close()
+			slave.stdout = old_stdout
+			os.close(r)
+
+	def testGetPackageImplsMany(self):
+		from zeroinstall.injector import distro
+		rpmdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rpm')
+		os.environ['PATH'] = rpmdir + ':' + os.environ['PATH']
+		status = tempfile.NamedTemporaryFile(mode = 'wt')
+		old_distro = slave._distro
+		try:
+			slave._distro = rpm = distro.RPMDistribution(status.name)
+			rpm._packagekit = basetest.DummyPackageKit()
+			prefetched = []
+			rpm.prefetch = prefetched.append
+
+			slave.read_chunk = lambda: (b'<feeds>'
+				b'<feed url="http://example.com/yast"><package-implementation package="yast2-mail"/>'
+				b'<package-implementation package="yast2-update"/></feed>'
+				b'<feed url="http://example.com/bad"><package-implementation/></feed>'
+				b'<feed url="http://example.com/none"/>'
+				b'</feeds>')
+			slave.handle_invoke(self.config, None, '1', ['get-package-impls-many'])
+			(ticket, (status_, reply)), = self.wait_for_replies(1)
+			self.assertEqual(('1', 'ok'), (ticket, status_))
+			self.assertEqual([['yast2-mail', 'yast2-update']], prefetched)
+
+			self.assertEqual(['http://example.com/bad', 'http://example.com/none', 'http://example.com/yast'], sorted(reply))
+			self.assertEqual('error', reply['http://example.com/bad'][0])
+			self.assertEqual(['ok', [[]]], reply['http://example.com/none'])
+			yast_status, (hosts, mail, update) = reply['http://example.com/yast']
+			self.assertEqual(('ok', []), (yast_status, hosts))
+			self.assertEqual(['package:rpm:yast2-mail:2.15.23-2:*'], [impl['id'] for impl in mail])
+			self.assertEqual(['package:rpm:yast2-update:2.15.23-21:i586'], [impl['id'] for impl in update])
+		finally:
+			slave._distro = old_distro
+			status.close()
+
+	def start_server(self, path):
+		"""Fork a process running slave.serve on path, and wait for the socket to appear.
+		@return: the server's pid"""
+		# (the real run() needs a main loop)
+		def run(config, options):
+			while True:
+				message = slave.recv_json()
+				if message is None: break
+				slave.handle_message(config, options, message)
+		old_run = slave.run
+		slave.run = run
+		slave.send_json, slave.read_chunk = self.real[:2]
+		# (in a separate process, so it doesn't inherit our ends of the connections)
+		server = os.fork()
+		if server == 0:
+			status = 1
+			try:
+				slave.serve(self.config, None, path, 1)
+				status = 0
+			finally:
+				os._exit(status)
+		slave.run = old_run
+		for i in range(100):
+			if os.path.exists(path): break
+			time.sleep(0.1)
+		return server
+
+	def connect(self, path):
+		conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		conn.connect(path)
+		stream = conn.makefile('rwb')
+		conn.close()
+		return stream
+
+	def call(self, stream, ticket, request, xml = None):
+		data = json.dumps(['invoke', ticket, request]).encode('utf-8')
+		stream.write(('%8x' % len(data)).encode('ascii') + data)
+		if xml is not None:
+			stream.write(('%8x' % len(xml)).encode('ascii') + xml)
+		stream.flush()
+		return json.loads(stream.read(int(stream.readline())).decode('utf-8'))
+
+	def stop_server(self, server):
+		for i in range(100):
+			pid, status = os.waitpid(server, os.WNOHANG)
+			if pid: break
+			time.sleep(0.1)
+		else:
+			os.kill(server, 9)
+			pid, status = os.waitpid(server, 0)
+		return pid, status
+
+	def testServe(self):
+		from zeroinstall.injector import distro
+		path = os.path.join(self.config_home, 'run', 'slave.sock')
+
+		old_distro = slave._distro
+		slave._distro = distro.Distribution()
+		server = self.start_server(path)
+		try:
+			self.assertEqual(0o700, os.stat(os.path.dirname(path)).st_mode & 0o777)
+
+			# Two masters at once
+			a = self.connect(path)
+			b = self.connect(path)
+			self.assertEqual(['return', '1', ['ok', None]], self.call(a, '1', ['ping']))
+			self.assertEqual(['return', '2', ['ok', None]], self.call(b, '2', ['ping']))
+			self.assertEqual(['return', '3', ['ok', None]], self.call(a, '3', ['ping']))
+			a.close()
+			b.close()
+
+			# Only one server per socket
+			try:
+				slave._listen(path)
+				assert 0
+			except slave.SafeException as ex:
+				assert 'already serving' in str(ex), ex
+
+			# Exits when idle
+			self.assertEqual((server, 0), self.stop_server(server))
+			server = None
+			assert not os.path.exists(path)
+		finally:
+			slave._distro = old_distro
+			if server:
+				os.kill(server, 9)
+				os.waitpid(server, 0)
+
+	def testServeRefreshesDistro(self):
+		from zeroinstall.injector import distro
+		path = os.path.join(self.config_home, 'run', 'slave.sock')
+		pkgdir = tempfile.mkdtemp()
+		os.mkdir(os.path.join(pkgdir, 'infozip-5.52-i486-2'))
+
+		def get_host_distribution():
+			if not distro._host_distribution:
+				distro._host_distribution = distro.SlackDistribution(pkgdir)
+				distro._host_distribution._packagekit = basetest.DummyPackageKit()
+			return distro._host_distribution
+		old = (slave._distro, distro._host_distribution, distro.get_host_distribution)
+		slave._distro = distro._host_distribution = None
+		distro.get_host_distribution = get_host_distribution
+		server = self.start_server(path)
+		try:
+			xml = b'<feed><package-implementation package="infozip"/></feed>'
+			def get_ids(ticket):
+				stream = self.connect(path)
+				reply = self.call(stream, ticket, ['get-package-impls', 'http://example.com/zip'], xml)
+				stream.close()
+				self.assertEqual(['return', ticket, 'ok'], reply[:2] + [reply[2][0]])
+				hosts, impls = reply[2][1]
+				return sorted(impl['id'] for impl in impls)
+
+			self.assertEqual(['package:slack:infozip:5.52-2:i486'], get_ids('1'))
+
+			# A package is installed; the next connection sees it
+			os.mkdir(os.path.join(pkgdir, 'infozip-6.0-x86_64-1'))
+			os.utime(pkgdir, (0, 0))
+			self.assertEqual(['package:slack:infozip:5.52-2:i486', 'package:slack:infozip:6.0-1:x86_64'], get_ids('2'))
+
+			self.assertEqual((server, 0), self.stop_server(server))
+			server = None
+		finally:
+			slave._distro, distro._host_distribution, distro.get_host_distribution = old
+			if server:
+				os.kill(server, 9)
+				os.waitpid(server, 0)
+			import shutil
+			shutil.rmtree(pkgdir)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+from basetest import BaseTest
+import sys, os, threading
+import unittest
+
+sys.path.insert(0, '..')
+from zeroinstall import support
+from zeroinstall.support import msgpack_lite
+from zeroinstall.injector import qdom
+
+if sys.version_info[0] > 2:
+	from io import BytesIO
+else:
+	from StringIO import StringIO as BytesIO
+
+class TestSupport(BaseTest):
+	def testReadBytes(self):
+		r, w = os.pipe()
+		try:
+			os.write(w, b'hello world')
+			self.assertEqual(b'hello', support.read_bytes(r, 5))
+			self.assertEqual(b'', support.read_bytes(r, 0))
+			self.assertEqual(b' world', support.read_bytes(r, 6))
+			os.close(w)
+			w = None
+			self.assertEqual(None, support.read_bytes(r, 4, null_ok = True))
+		finally:
+			os.close(r)
+			if w is not None:
+				os.close(w)
+
+		r, w = os.pipe()
+		try:
+			os.write(w, b'abc')
+			os.close(w)
+			try:
+				support.read_bytes(r, 5, null_ok = True)
+				assert 0
+			except Exception as ex:
+				assert 'expecting 2 bytes more' in str(ex), ex
+		finally:
+			os.close(r)
+
+	def testWriteAll(self):
+		# Large enough to need several writes to the pipe
+		chunks = [b'10\n', b'x' * 300000, b'', b'end']
+		r, w = os.pipe()
+		received = []
+		reader = threading.Thread(target = lambda: received.append(support.read_bytes(r, 300006)))
+		reader.start()
+		try:
+			support.write_all(w, chunks)
+		finally:
+			os.close(w)
+			reader.join()
+			os.close(r)
+		self.assertEqual([b''.join(chunks)], received)
+
+	def testMsgpack(self):
+		values = [None, True, False, 0, 1, 127, 128, 65536, 2 ** 63, -1, -32, -33, -2 ** 63, 0.5,
+			  '', 'hello', u'caf\xe9', 'x' * 40, 'y' * 70000,
+			  [], ['invoke', '1', ['get-package-impls', 'http://example.com/feed']], list(range(20)),
+			  {}, {'id': 'package:rpm:foo:1.0:*', 'version': [[1, 0], 0], 'quick-test-mtime': 123}]
+		for value in values:
+			self.assertEqual(value, msgpack_lite.unpackb(msgpack_lite.packb(value)))
+		self.assertEqual([1, 2], msgpack_lite.unpackb(msgpack_lite.packb((1, 2))))
+		self.assertEqual(b'\x93\x01\xa1a\xc0', msgpack_lite.packb([1, 'a', None]))
+
+		# A spec-compliant encoder may use the 8-bit forms we don't write
+		self.assertEqual([255, -128, 'abc'], msgpack_lite.unpackb(b'\x93\xcc\xff\xd0\x80\xd9\x03abc'))
+
+		# (includes an unhashable map key and an element that isn't a 5-item array)
+		for bad in [b'', b'\x92\x01', b'\x01\x02', b'\xa5abc', b'\xc1', b'\x81\x90\x01', b'\xc7\x01\x01\x01']:
+			try:
+				msgpack_lite.unpackb(bad)
+				assert 0, bad
+			except msgpack_lite.DecodeError:
+				pass
+
+		root = qdom.parse(BytesIO(b'<feed xmlns="http://zero-install.sourceforge.net/2004/injector/interface">'
+				b'<package-implementation package="gimp" distributions="RPM"/><name>Gimp</name></feed>'))
+		args, element = msgpack_lite.unpackb(msgpack_lite.packb([['http://example.com/feed'], root]))
+		self.assertEqual(['http://example.com/feed'], args)
+		self.assertEqual(str(root), str(element))
+		self.assertEqual('gimp', element.childNodes[0].getAttribute('package'))
+
+if __name__ == '__main__':
+	unittest.main()
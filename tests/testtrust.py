@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 from basetest import BaseTest
-import sys
+import sys, os
 import unittest
 
 thomas_fingerprint = "92429807C9853C0744A68B9AAE07828059A53CC1"
@@ -22,6 +22,43 @@ class TestTrust(BaseTest):
 		self.assertRaises(SafeException, lambda: trust.domain_from_url('http://*/foo'))
 		self.assertRaises(SafeException, lambda: trust.domain_from_url(''))
 
+	def testLoad(self):
+		from zeroinstall.injector import qdom, namespaces
+		from zeroinstall.support import basedir
+		path = os.path.join(basedir.save_config_path(namespaces.config_site, namespaces.config_prog), 'trustdb.xml')
+		def write(domains):
+			with open(path, 'w') as stream:
+				stream.write('<?xml version="1.0" ?>\n<trusted-keys xmlns="http://zero-install.sourceforge.net/2007/injector/trust">\n' +
+					'<key fingerprint="%s">%s</key>\n' % (thomas_fingerprint, ''.join('<domain value="%s"/>' % d for d in domains)) +
+					'<key fingerprint="1234"><domain value="example.com"/></key>\n' +
+					'</trusted-keys>\n')
+			basedir.invalidate(path)
+
+		write(['0install.net', 'example.com'])
+		assert trust.trust_db.is_trusted(thomas_fingerprint, '0install.net')
+		assert not trust.trust_db.is_trusted(thomas_fingerprint, 'rox.sourceforge.net')
+		self.assertEqual(set(['0install.net', 'example.com']), trust.trust_db.get_trust_domains(thomas_fingerprint))
+		self.assertEqual(set([thomas_fingerprint, '1234']), trust.trust_db.get_keys_for_domain('example.com'))
+		self.assertEqual(set(), trust.trust_db.get_keys_for_domain('rox.sourceforge.net'))
+
+		# The file isn't parsed again unless it changes
+		parses = []
+		real_parse = qdom.parse
+		def counting_parse(source):
+			parses.append(source)
+			return real_parse(source)
+		qdom.parse = counting_parse
+		try:
+			assert trust.trust_db.is_trusted("1234", 'example.com')
+			self.assertEqual(0, len(parses))
+
+			write(['*'])
+			self.assertEqual(set(['*']), trust.trust_db.get_trust_domains(thomas_fingerprint))
+			self.assertEqual(set(['1234']), trust.trust_db.get_keys_for_domain('example.com'))
+			assert trust.trust_db.is_trusted(thomas_fingerprint, 'rox.sourceforge.net')
+			self.assertEqual(1, len(parses))
+		finally:
+			qdom.parse = real_parse
 
 if __name__ == '__main__':
 	unittest.main()
@@ -11,6 +11,7 @@ The Python implementation of the Zero Install injector is divided into five sub-
 @see: U{http://0install.net}
 
 @var _: a function for translating strings using the zero-install domain (for use internally by Zero Install)
+@var translation: the translations for the zero-install domain (loaded on first use; see L{get_translation})
 """
 
 version = '2.5-post'
@@ -22,21 +23,47 @@ logger = logging.getLogger('0install')
 # Configure some basic logging, if the caller hasn't already done so.
 logging.basicConfig()
 
-import gettext
-from os.path import dirname, join
-
-try:
-	localedir = None
-	translation = gettext.translation('zero-install', fallback = False)
-except:
-	localedir = join(dirname(dirname(__file__)), 'share', 'locale')
-	translation = gettext.translation('zero-install',
-				localedir = localedir,
-				fallback = True)
-try:
-	_ = translation.ugettext	# Python 2
-except AttributeError:
-	_ = translation.gettext		# Python 3
+localedir = None		# Set by get_translation if we're using the translations in share/locale
+_translation = None
+_translate = None
+
+def get_translation():
+	"""Load the translations for the zero-install domain, if not already loaded.
+	If they aren't installed in the default location, look in our own share/locale
+	directory (and set L{localedir}).
+	@rtype: gettext.NullTranslations
+	@since: 2.6"""
+	global localedir, _translation
+	if _translation is None:
+		import gettext
+		from os.path import dirname, join
+		try:
+			_translation = gettext.translation('zero-install', fallback = False)
+		except:
+			localedir = join(dirname(dirname(__file__)), 'share', 'locale')
+			_translation = gettext.translation('zero-install',
+						localedir = localedir,
+						fallback = True)
+	return _translation
+
+class _LazyTranslation(object):
+	"""Stands in for the translation object until it's needed. Looking up any
+	attribute (e.g. C{translation.ngettext}) loads the translations."""
+	def __getattr__(self, name):
+		return getattr(get_translation(), name)
+
+translation = _LazyTranslation()
+
+def _(message):
+	"""Translate message. The translations are only loaded when first needed, as
+	most runs (e.g. of the slave) never show any messages to the user.
+	@type message: str
+	@rtype: str"""
+	global _translate
+	if _translate is None:
+		loaded = get_translation()
+		_translate = getattr(loaded, 'ugettext', loaded.gettext)	# (ugettext on Python 2)
+	return _translate(message)
 
 class SafeException(Exception):
 	"""An exception that can be reported to the user without a stack trace.
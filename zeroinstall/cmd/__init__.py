@@ -9,7 +9,6 @@ from __future__ import print_function
 
 from zeroinstall import _, logger
 import os, sys
-from optparse import OptionParser
 import logging
 
 from zeroinstall import SafeException, DryRun
@@ -53,6 +52,8 @@ def main(command_args, config = None):
 	@type command_args: [str]
 	@type config: L{zeroinstall.injector.config.Config} | None
 	@arg command_args: array of arguments (e.g. C{sys.argv[1:]})"""
+	from optparse import OptionParser
+
 	_ensure_standard_fds()
 
 	if config is None:
@@ -7,15 +7,15 @@ The B{0install slave} command-line interface.
 
 from __future__ import print_function
 
-import sys, os, collections
+import sys, os, collections, threading
 
 from zeroinstall import _, logger, SafeException
 from zeroinstall.cmd import UsageError
-from zeroinstall.injector import model, qdom, download, gpg
-from zeroinstall.injector.distro import get_host_distribution
-from zeroinstall.support import tasks
+from zeroinstall.support import tasks, basedir, msgpack_lite
 from zeroinstall import support
 
+# Everything else is imported when needed, so that we can start answering the master quickly
+
 if sys.version_info[0] > 2:
 	from io import BytesIO
 else:
@@ -25,16 +25,20 @@ import json, sys
 
 syntax = ""
 
+IDLE_TIMEOUT = 300		# Default for --idle-timeout (seconds)
+
 _distro = None
 def get_distro():
 	global _distro
 	if _distro is None:
+		from zeroinstall.injector.distro import get_host_distribution
 		_distro = get_host_distribution()
 	return _distro
 
 if sys.version_info[0] > 2:
-	stdin = sys.stdin.buffer.raw
-	stdout = sys.stdout.buffer.raw
+	# (with -u or PYTHONUNBUFFERED, buffer is already the raw file)
+	stdin = getattr(sys.stdin.buffer, 'raw', sys.stdin.buffer)
+	stdout = getattr(sys.stdout.buffer, 'raw', sys.stdout.buffer)
 else:
 	stdin = sys.stdin
 	stdout = sys.stdout
@@ -52,6 +56,10 @@ def read_chunk():
 
 def add_options(parser):
 	parser.add_option("-o", "--offline", help=_("try to avoid using the network"), action='store_true')
+	parser.add_option("", "--serve", help=_("accept connections from masters on a Unix socket"), action='store_true')
+	parser.add_option("", "--socket", help=_("socket for --serve (default: in $XDG_RUNTIME_DIR)"), metavar='PATH')
+	parser.add_option("", "--idle-timeout", help=_("with --serve, exit after this many seconds with no connections"),
+			type='int', default=IDLE_TIMEOUT, metavar='SECONDS')
 
 def parse_ynm(s):
 	if s == 'yes': return True
@@ -61,6 +69,7 @@ def parse_ynm(s):
 
 @tasks.async
 def do_confirm_distro_install(config, ticket, options, impls):
+	from zeroinstall.injector import download
 	if gui_driver is not None: config = gui_driver.config
 	try:
 		manual_impls = [impl['id'] for impl in impls if not impl['needs-confirmation']]
@@ -76,7 +85,7 @@ def do_confirm_distro_install(config, ticket, options, impls):
 			tasks.check(confirm)
 
 		if manual_impls:
-			raise model.SafeException(_("This program depends on '%s', which is a package that is available through your distribution. "
+			raise SafeException(_("This program depends on '%s', which is a package that is available through your distribution. "
 					"Please install it manually using your distribution's tools and try again. Or, install 'packagekit' and I can "
 					"use that to install it.") % manual_impls[0])
 
@@ -150,7 +159,25 @@ def to_json(impl):
 
 def do_get_package_impls(config, options, args, xml):
 	master_feed_url, = args
-
+	return _get_package_impls(master_feed_url, xml.childNodes)
+
+def do_get_package_impls_many(config, options, xml):
+	"""Like get-package-impls, but for many master feeds at once.
+	Each child of xml has a 'url' attribute and contains that feed's <package-implementation> elements.
+	The package manager is queried for all the packages together (see L{distro.Distribution.prefetch}).
+	@return: the response for each URL, as ['ok', impls] or ['error', message]
+	@rtype: {str: [str, object]}"""
+	feeds = [(elem.getAttribute('url'), elem.childNodes) for elem in xml.childNodes]
+	packages = set()
+	for url, elems in feeds:
+		for elem in elems:
+			package = elem.getAttribute('package')
+			if package is not None:
+				packages.add(package)
+	get_distro().prefetch(sorted(packages))
+	return dict((url, call_handler(_get_package_impls, url, elems)) for url, elems in feeds)
+
+def _get_package_impls(master_feed_url, elems):
 	seen = set()
 	results = []
 
@@ -158,7 +185,7 @@ def do_get_package_impls(config, options, args, xml):
 
 	# We need the results grouped by <package-implementation> so the OCaml can
 	# get the correct attributes and dependencies.
-	for elem in xml.childNodes:
+	for elem in elems:
 		package_impls = [(elem, elem.attrs, [])]
 		feed = get_distro().get_feed(master_feed_url, package_impls)
 
@@ -179,11 +206,26 @@ def take_ticket():
 	last_ticket += 1
 	return str(last_ticket)
 
+_send_lock = threading.Lock()		# Background workers also send replies
+
+# Name -> (encode, decode) for the message bodies.
+# JSON is used until the master asks for something else with negotiate-encoding.
+# With msgpack, the master can send a pre-parsed document as the final argument
+# of a request instead of as a separate XML chunk (see take_xml).
+encodings = {
+	'json': (lambda j: json.dumps(j).encode('utf-8'), lambda data: json.loads(data.decode('utf-8'))),
+	'msgpack': (msgpack_lite.packb, msgpack_lite.unpackb),
+}
+encoding = 'json'
+
 def send_json(j):
-	data = json.dumps(j).encode('utf-8')
-	stdout.write(('%d\n' % len(data)).encode('utf-8'))
-	stdout.write(data)
+	with _send_lock:
+		_send(j)
+
+def _send(j):
+	data = encodings[encoding][0](j)
 	stdout.flush()
+	support.write_all(stdout.fileno(), [('%d\n' % len(data)).encode('utf-8'), data])
 
 def recv_json():
 	logger.debug("Waiting for length...")
@@ -191,24 +233,47 @@ def recv_json():
 	if not data:
 		sys.stdout = sys.stderr
 		return None
-	data = data.decode('utf-8')
-	logger.debug("Read '%s' from master", data)
-	return json.loads(data)
+	logger.debug("Read %r from master", data)
+	return encodings[encoding][1](data)
+
+def take_xml(request):
+	"""Split off the XML document that goes with request. This is either the
+	last argument (if the master sent it pre-parsed) or the next chunk on stdin.
+	@return: the remaining request, and the document
+	@rtype: ([object], L{qdom.Element})"""
+	from zeroinstall.injector import qdom
+	if request and isinstance(request[-1], qdom.Element):
+		return request[:-1], request[-1]
+	return request, qdom.parse(BytesIO(read_chunk()))
+
+def do_negotiate_encoding(ticket, offered):
+	"""Reply with the first of the master's encodings that we support, and use it
+	for all messages after that. The reply itself uses the old encoding. The master
+	must not send anything else until it gets the reply.
+	@type offered: [str]"""
+	global encoding
+	chosen = [name for name in offered if name in encodings][:1] or ['json']
+	with _send_lock:
+		_send(["return", ticket, ["ok", chosen[0]]])
+		encoding = chosen[0]
+	logger.info("Using %s encoding for messages", encoding)
 
 pending_replies = {}		# Ticket -> callback function
 
 def handle_message(config, options, message):
-	if message[0] == 'invoke':
-		ticket, payload = message[1:]
-		handle_invoke(config, options, ticket, payload)
-	elif message[0] == 'return':
-		ticket = message[1]
-		value = message[2]
-		cb = pending_replies[ticket]
-		del pending_replies[ticket]
-		cb(value)
-	else:
-		assert 0, message
+	# (the master may change things between messages, so only cache listings while handling one)
+	with basedir.cached_listings():
+		if message[0] == 'invoke':
+			ticket, payload = message[1:]
+			handle_invoke(config, options, ticket, payload)
+		elif message[0] == 'return':
+			ticket = message[1]
+			value = message[2]
+			cb = pending_replies[ticket]
+			del pending_replies[ticket]
+			cb(value)
+		else:
+			assert 0, message
 
 def do_get_distro_candidates(config, args, xml):
 	master_feed_url, = args
@@ -228,6 +293,7 @@ pending_key_info = {}		# Fingerprint -> OCamlKeyInfo
 
 @tasks.async
 def do_update_key_info(config, ticket, fingerprint, xml):
+	from zeroinstall.injector import qdom
 	try:
 		ki = pending_key_info.get(fingerprint, None)
 		if ki:
@@ -244,6 +310,7 @@ def do_update_key_info(config, ticket, fingerprint, xml):
 
 @tasks.async
 def do_confirm_keys(config, ticket, url, xml):
+	from zeroinstall.injector import qdom, gpg
 	try:
 		if gui_driver is not None: config = gui_driver.config
 		fingerprints = []
@@ -305,7 +372,7 @@ class OCamlDownload:
 	hint = None
 	expected_size = None
 	tempfile = None
-	status = download.download_fetching
+	status = None
 	downloaded = None
 	_final_total_size = None
 
@@ -325,6 +392,7 @@ class OCamlDownload:
 	def get_bytes_downloaded_so_far(self):
 		"""Get the download progress. Will be zero if the download has not yet started.
 		@rtype: int"""
+		from zeroinstall.injector import download
 		if self.status is download.download_fetching:
 			return os.stat(self.tempfile).st_size
 		else:
@@ -339,7 +407,9 @@ def do_start_monitoring(config, details):
 	size = details["size"]
 	if size is not None:
 		size = int(size)
+	from zeroinstall.injector import download
 	dl = OCamlDownload()
+	dl.status = download.download_fetching
 	dl.url = details["url"]
 	dl.hint = details["hint"]
 	dl.expected_size = size
@@ -349,6 +419,7 @@ def do_start_monitoring(config, details):
 	config.handler.monitor_download(dl)
 
 def do_stop_monitoring(config, tmpfile):
+	from zeroinstall.injector import download
 	dl = downloads[tmpfile]
 	dl.status = download.download_complete
 	dl._final_total_size = dl.get_bytes_downloaded_so_far()
@@ -480,8 +551,17 @@ def do_wait_for_network(config):
 		logger.info(_("NetworkManager says we're on-line. Good!"))
 		return "online"
 
-def do_gui_update_selections(args, xml):
+def _tree_interfaces(details):
+	"""Yield the interface URIs in a selections tree (as sent with gui-update-selections)."""
+	yield details['interface']
+	for child in details.get('children', []):
+		for uri in _tree_interfaces(child):
+			yield uri
+
+def do_gui_update_selections(config, args, xml):
 	ready, tree = args
+	# Keep the feeds we're showing in memory, however many others get loaded
+	config.iface_cache.pin(_tree_interfaces(tree))
 	gui_driver.set_selections(ready, tree, xml)
 
 class DummyPackageKit:
@@ -495,12 +575,71 @@ def do_test_distro(config, name, args):
 	_distro = cons(*args)
 	_distro._packagekit = DummyPackageKit()
 
+class Worker(object):
+	"""Runs jobs one at a time, in order, in a background thread.
+	This lets us keep handling requests while slow ones (e.g. waiting for the network) run.
+	Replies are sent when each job finishes, possibly out of order (the master matches them up by ticket)."""
+	def __init__(self, name):
+		"""@type name: str"""
+		self.name = name
+		self.thread = None
+		try:
+			import queue
+		except ImportError:
+			import Queue as queue	# Python 2
+		self.queue = queue.Queue()
+
+	def put(self, ticket, fn, *args):
+		"""Call fn(*args) in the background thread and send the result as the reply for ticket."""
+		if self.thread is None:
+			self.thread = threading.Thread(target = self._run, name = self.name)
+			self.thread.daemon = True
+			self.thread.start()
+		self.queue.put((ticket, fn, args))
+
+	def wait(self):
+		"""Block until all queued jobs have finished."""
+		self.queue.join()
+
+	def _run(self):
+		while True:
+			ticket, fn, args = self.queue.get()
+			try:
+				send_json(["return", ticket, call_handler(fn, *args)])
+			except Exception:
+				logger.warning("Failed to reply to %s", ticket, exc_info = True)
+			finally:
+				self.queue.task_done()
+
+# Most commands are either quick or need the GUI (which must only be used from the main thread),
+# so we handle them immediately. Commands that use the distribution object also stay on the main
+# thread: it isn't thread-safe, and get-distro-candidates and confirm-distro-install need it from
+# the main loop. The master can still send several at once and match up the replies by ticket.
+# Commands which just wait are queued on a worker instead.
+network_worker = Worker('network')		# wait-for-network (may sleep for minutes)
+
+def call_handler(fn, *args):
+	"""Call fn(*args) and return the response to send to the master.
+	@rtype: [str, object]"""
+	try:
+		return ['ok', fn(*args)]
+	except SafeException as ex:
+		logger.info("Replying with error: %s", ex)
+		return ['error', str(ex)]
+	except Exception as ex:
+		import traceback
+		logger.info("Replying with error: %s", ex)
+		return ['error', traceback.format_exc().strip()]
+
 def handle_invoke(config, options, ticket, request):
 	try:
 		command = request[0]
 		logger.debug("Got request '%s'", command)
 		if command == 'open-gui':
 			response = do_open_gui(request[1:])
+		elif command == 'negotiate-encoding':
+			do_negotiate_encoding(ticket, request[1])
+			return
 		elif command == 'ping':
 			response = None
 		elif command == 'open-cache-explorer':
@@ -518,31 +657,35 @@ def handle_invoke(config, options, ticket, request):
 			do_open_add_box(ticket, request[1])
 			return #async
 		elif command == 'wait-for-network':
-			response = do_wait_for_network(config)
+			network_worker.put(ticket, do_wait_for_network, config)
+			return	# async
 		elif command == 'check-gui':
 			response = do_check_gui(request[1])
 		elif command == 'report-error':
 			response = do_report_error(config, request[1])
 		elif command == 'gui-update-selections':
-			xml = qdom.parse(BytesIO(read_chunk()))
-			response = do_gui_update_selections(request[1:], xml)
+			request, xml = take_xml(request)
+			response = do_gui_update_selections(config, request[1:], xml)
 		elif command == 'confirm-distro-install':
 			blocker = do_confirm_distro_install(config, ticket, options, request[1])
 			return
 		elif command == 'get-package-impls':
-			xml = qdom.parse(BytesIO(read_chunk()))
+			request, xml = take_xml(request)
 			response = do_get_package_impls(config, options, request[1:], xml)
+		elif command == 'get-package-impls-many':
+			request, xml = take_xml(request)
+			response = do_get_package_impls_many(config, options, xml)
 		elif command == 'get-distro-candidates':
-			xml = qdom.parse(BytesIO(read_chunk()))
+			request, xml = take_xml(request)
 			blocker = do_get_distro_candidates(config, request[1:], xml)
 			reply_when_done(ticket, blocker)
 			return	# async
 		elif command == 'confirm-keys':
-			xml = qdom.parse(BytesIO(read_chunk()))
+			request, xml = take_xml(request)
 			do_confirm_keys(config, ticket, request[1], xml)
 			return	# async
 		elif command == 'update-key-info':
-			xml = qdom.parse(BytesIO(read_chunk()))
+			request, xml = take_xml(request)
 			do_update_key_info(config, ticket, request[1], xml)
 			return	# async
 		elif command == 'notify-user':
@@ -618,11 +761,19 @@ def handle(config, options, args):
 		raise UsageError()
 
 	if options.offline:
+		from zeroinstall.injector import model
 		config.network_use = model.network_offline
 
 	if options.dry_run:
 		config.handler.dry_run = True
 
+	if options.serve:
+		serve(config, options, options.socket or get_socket_path(), options.idle_timeout)
+	else:
+		run(config, options)
+
+def run(config, options):
+	"""Handle requests from the master on stdin until it closes the connection."""
 	def slave_raw_input(prompt = ""):
 		ticket = take_ticket()
 		send_json(["invoke", ticket, ["input", prompt]])
@@ -649,3 +800,121 @@ def handle(config, options, args):
 			handle_message(config, options, message)
 
 	tasks.wait_for_blocker(handle_events())
+
+def get_socket_path():
+	"""The default socket for C{0install slave --serve}. This is in C{$XDG_RUNTIME_DIR},
+	or in a private directory under /tmp if that isn't set.
+	@rtype: str
+	@since: 2.6"""
+	from zeroinstall.injector import namespaces
+	runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+	if runtime_dir:
+		return os.path.join(runtime_dir, namespaces.config_site, 'slave.sock')
+	import tempfile
+	return os.path.join(tempfile.gettempdir(), '0install-%d' % os.getuid(), 'slave.sock')
+
+def _listen(path):
+	"""Create a Unix socket at path, readable only by us. If a server is already
+	listening there, raise SafeException; if the socket is stale, replace it.
+	@type path: str
+	@rtype: socket.socket"""
+	import socket, stat
+	parent = os.path.dirname(path)
+	if not os.path.isdir(parent):
+		os.makedirs(parent, 0o700)
+	info = os.stat(parent)
+	if info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) & 0o077:
+		raise SafeException(_("Directory '%s' must be private to the current user") % parent)
+
+	if os.path.exists(path):
+		test = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			test.connect(path)
+		except socket.error:
+			os.unlink(path)		# Left over from a server that didn't exit cleanly
+		else:
+			raise SafeException(_("A slave is already serving on '%s'") % path)
+		finally:
+			test.close()
+
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	old_umask = os.umask(0o077)
+	try:
+		sock.bind(path)
+	finally:
+		os.umask(old_umask)
+	sock.listen(5)
+	return sock
+
+def serve(config, options, path, idle_timeout):
+	"""Accept connections from masters on a Unix socket. Each connection is handled
+	by a child process, forked from this one, which talks to the master using the
+	usual protocol (as L{run} does over stdin and stdout). The children start with
+	everything already imported and set up here, so they can reply at once.
+	Return when there have been no connections for idle_timeout seconds.
+	@type path: str
+	@type idle_timeout: int
+	@since: 2.6"""
+	global _distro
+	import select, time
+
+	if not hasattr(os, 'fork'):
+		raise SafeException(_("--serve is not supported on this platform"))
+
+	sock = _listen(path)
+	logger.info("Serving on %s", path)
+	children = set()
+	last_active = time.time()
+	try:
+		# Load everything the children might need
+		from zeroinstall.injector import model, qdom, download, gpg
+		get_distro()
+		config.trust_db.ensure_uptodate()
+		while True:
+			while children:
+				pid, status = os.waitpid(-1, os.WNOHANG)
+				if pid == 0: break
+				children.discard(pid)
+			if children:
+				timeout = 1		# Poll until they finish
+				last_active = time.time()
+			else:
+				timeout = last_active + idle_timeout - time.time()
+				if timeout <= 0:
+					logger.info("No connections for %d seconds; exiting", idle_timeout)
+					break
+
+			if not select.select([sock], [], [], timeout)[0]:
+				continue
+			conn, addr = sock.accept()
+			last_active = time.time()
+
+			# Let each child start with an up-to-date copy of our caches
+			if _distro is not None and not _distro.is_uptodate():
+				from zeroinstall.injector import distro
+				if distro._host_distribution is _distro:
+					distro._host_distribution = None	# (or we'd just get the old one back)
+				_distro = None
+			get_distro()
+
+			pid = os.fork()
+			if pid == 0:
+				status = 1
+				try:
+					sock.close()
+					os.dup2(conn.fileno(), 0)
+					os.dup2(conn.fileno(), 1)
+					conn.close()
+					run(config, options)
+					status = 0
+				except:
+					import traceback
+					traceback.print_exc()
+				finally:
+					os._exit(status)
+			conn.close()
+			children.add(pid)
+			logger.debug("Started child %d for new connection", pid)
+	finally:
+		sock.close()
+		os.unlink(path)
@@ -155,7 +155,13 @@ class AppListBox(object):
 		m = self.model
 		m.clear()
 
-		for uri in self.app_list.get_apps():
+		apps = self.app_list.get_apps()
+		try:
+			self.iface_cache.get_feeds(apps)	# (load them all at once first)
+		except model.InvalidInterface:
+			pass				# (reported for each app below)
+
+		for uri in apps:
 			itr = m.append()
 			m[itr][AppListBox.URI] = uri
 
@@ -8,7 +8,7 @@ from zeroinstall import _
 import os, sys
 import gtk
 
-from zeroinstall.injector import namespaces, model
+from zeroinstall.injector import namespaces, model, reader
 from zeroinstall import support
 from zeroinstall.support import basedir, tasks
 from zeroinstall.gtkui import help_box, gtkutils
@@ -216,6 +216,8 @@ class CachedFeed(object):
 					print("Delete", cached_iface)
 				else:
 					os.unlink(cached_iface)
+					basedir.invalidate(cached_iface)
+					reader.forget_feed(cached_iface)
 		user_overrides = basedir.load_first_config(namespaces.config_site,
 					namespaces.config_prog,
 					'interfaces', model._pretty_escape(self.uri))
@@ -224,6 +226,7 @@ class CachedFeed(object):
 				print("Delete", user_overrides)
 			else:
 				os.unlink(user_overrides)
+				basedir.invalidate(user_overrides)
 	
 	def __cmp__(self, other):
 		return self.uri.__cmp__(other.uri)
@@ -140,7 +140,7 @@ class TrustBox(gtk.Dialog):
 
 		currently_trusted_keys = trust.trust_db.get_keys_for_domain(domain)
 		if currently_trusted_keys:
-			keys = [gpg.load_key(fingerprint) for fingerprint in currently_trusted_keys]
+			keys = gpg.load_keys(list(currently_trusted_keys)).values()
 			descriptions = [_("%(key_name)s\n(fingerprint: %(key_fingerprint)s)") % {'key_name': key.name, 'key_fingerprint': pretty_fp(key.fingerprint)}
 					for key in keys]
 		else:
@@ -168,6 +168,8 @@ class TrustBox(gtk.Dialog):
 					break
 			self.set_response_sensitive(gtk.RESPONSE_OK, trust_any)
 
+		gpg.load_keys([sig.fingerprint for sig in valid_sigs if hasattr(sig, 'get_details')])	# (fetch details in one go)
+
 		first = True
 		for sig in valid_sigs:
 			if hasattr(sig, 'get_details'):
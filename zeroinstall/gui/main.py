@@ -8,13 +8,14 @@ import logging
 import warnings
 import locale
 
-from zeroinstall import localedir
+import zeroinstall
 
-if localedir:
+zeroinstall.get_translation()		# (sets localedir)
+if zeroinstall.localedir:
 	# Tell GTK where to find the translations, if they're not in
 	# the default system location.
 	if hasattr(locale, 'bindtextdomain'):
-		locale.bindtextdomain('zero-install', localedir)
+		locale.bindtextdomain('zero-install', zeroinstall.localedir)
 
 from optparse import OptionParser
 
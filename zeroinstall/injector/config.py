@@ -63,6 +63,7 @@ class Config(object):
 	def trust_db(self):
 		from zeroinstall.injector import trust
 		self._trust_db = trust.trust_db
+		return self._trust_db
 
 	@property
 	def handler(self):
@@ -91,6 +92,7 @@ class Config(object):
 		with open(path + '.new', 'wt') as stream:
 			parser.write(stream)
 		support.portable_rename(path + '.new', path)
+		basedir.invalidate(path)
 
 def load_config(handler = None):
 	"""@type handler: L{zeroinstall.injector.handler.Handler} | None
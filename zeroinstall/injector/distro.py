@@ -7,9 +7,9 @@ Integration with native distribution package managers.
 # See the README file for details, or visit http://0install.net.
 
 from zeroinstall import _, logger
-import os, platform, re, subprocess, sys
+import os, platform, re, struct, subprocess, sys, time, json
 from zeroinstall.injector import namespaces, model
-from zeroinstall.support import basedir, portable_rename, intern
+from zeroinstall.support import basedir, portable_rename, intern, memoize, tasks
 from zeroinstall.support.tasks import get_loop
 
 _dotted_ints = '[0-9]+(?:\.[0-9]+)*'
@@ -20,27 +20,41 @@ _zeroinstall_regexp = '(?:%s)(?:-(?:pre|rc|post|)(?:%s))*' % (_dotted_ints, _dot
 # This matches the interesting bits of distribution version numbers
 # (first matching group is for Java-style 6b17 or 7u9 syntax, or "major")
 _version_regexp = '(?:[a-z])?({ints}\.?[bu])?({zero})(-r{ints})?'.format(zero = _zeroinstall_regexp, ints = _dotted_ints)
+_version_match = re.compile(_version_regexp).match
 
 _PYTHON_URI = 'http://repo.roscidus.com/python/python'
 
+# How many packages to pass to a single apt-cache command
+MAX_APT_CACHE_BATCH_SIZE = 100
+
+# If we've been asked about more packages than this, just list them all with "rpm -qa"
+MAX_RPM_INCREMENTAL_PACKAGES = 500
+
 def _set_quick_test(impl, path):
 	"""Set impl.quick_test_file and impl.quick_test_mtime from path."""
 	impl.quick_test_file = path
 	impl.quick_test_mtime = int(os.stat(path).st_mtime)
 
+# How long to remember candidates from apt-cache or PackageKit (in seconds)
+CANDIDATE_CACHE_MAX_AGE = 60 * 60 * 24
+
 # We try to do updates atomically without locking, but we don't worry too much about
 # duplicate entries or being a little out of sync with the on-disk copy.
 class Cache(object):
-	def __init__(self, cache_leaf, source, format):
+	def __init__(self, cache_leaf, source, format, max_age = None):
 		"""Maintain a cache file (e.g. ~/.cache/0install.net/injector/$name).
 		If the size or mtime of $source has changed
 		format version if different, reset the cache first.
 		@type cache_leaf: str
-		@type source: str
-		@type format: int"""
+		@param source: the file to watch, or None to rely on max_age alone
+		@type source: str | None
+		@type format: int
+		@param max_age: also reset the cache if it is older than this many seconds (since 2.6)
+		@type max_age: int | None"""
 		self.cache_leaf = cache_leaf
 		self.source = source
 		self.format = format
+		self.max_age = max_age
 		self.cache_dir = basedir.save_cache_path(namespaces.config_site,
 							 namespaces.config_prog)
 		self.cached_for = {}		# Attributes of source when cache was created
@@ -52,22 +66,36 @@ class Cache(object):
 
 	def flush(self):
 		# Wipe the cache
-		try:
-			info = os.stat(self.source)
-			mtime = int(info.st_mtime)
-			size = info.st_size
-		except Exception as ex:
-			logger.warning("Failed to stat %s: %s", self.source, ex)
-			mtime = size = 0
+		mtime = size = 0
+		if self.source is not None:
+			try:
+				info = os.stat(self.source)
+				mtime = int(info.st_mtime)
+				size = info.st_size
+			except Exception as ex:
+				logger.warning("Failed to stat %s: %s", self.source, ex)
 		self.cache = {}
 		import tempfile
 		tmp = tempfile.NamedTemporaryFile(mode = 'wt', dir = self.cache_dir, delete = False)
-		tmp.write("mtime=%d\nsize=%d\nformat=%d\n\n" % (mtime, size, self.format))
-		tmp.close()
+		try:
+			tmp.write("mtime=%d\nsize=%d\nformat=%d\ncreated=%d\n\n" % (mtime, size, self.format, int(time.time())))
+			for key, value in self._generate():
+				tmp.write('%s=%s\n' % (key, value))
+			tmp.close()
+		except:
+			tmp.close()
+			os.unlink(tmp.name)
+			raise
 		portable_rename(tmp.name, os.path.join(self.cache_dir, self.cache_leaf))
 
 		self._load_cache()
 
+	def _generate(self):
+		"""Return the initial entries for a newly-flushed cache.
+		The default is to start empty and let callers L{put} entries as they find them.
+		@rtype: iterable((str, str))"""
+		return ()
+
 	# Populate self.cache from our saved cache file.
 	# Throws an exception if the cache doesn't exist or has the wrong format.
 	def _load_cache(self):
@@ -78,7 +106,7 @@ class Cache(object):
 				if not line:
 					break
 				key, value = line.split('=', 1)
-				if key in ('mtime', 'size', 'format'):
+				if key in ('mtime', 'size', 'format', 'created'):
 					self.cached_for[key] = int(value)
 
 			self._check_valid()
@@ -89,13 +117,16 @@ class Cache(object):
 
 	# Check the source file hasn't changed since we created the cache
 	def _check_valid(self):
-		info = os.stat(self.source)
-		if self.cached_for['mtime'] != int(info.st_mtime):
-			raise Exception("Modification time of %s has changed" % self.source)
-		if self.cached_for['size'] != info.st_size:
-			raise Exception("Size of %s has changed" % self.source)
+		if self.source is not None:
+			info = os.stat(self.source)
+			if self.cached_for['mtime'] != int(info.st_mtime):
+				raise Exception("Modification time of %s has changed" % self.source)
+			if self.cached_for['size'] != info.st_size:
+				raise Exception("Size of %s has changed" % self.source)
 		if self.cached_for.get('format', None) != self.format:
 			raise Exception("Format of cache has changed")
+		if self.max_age is not None and time.time() - self.cached_for.get('created', 0) > self.max_age:
+			raise Exception("Cache is more than %d seconds old" % self.max_age)
 
 	def get(self, key):
 		"""@type key: str
@@ -120,9 +151,100 @@ class Cache(object):
 		except Exception as ex:
 			logger.warning("Failed to write to cache %s: %s=%s: %s", cache_path, key, value, ex)
 
+class DpkgStatusIndex(Cache):
+	"""An index of every package recorded in a dpkg status file.
+	Whenever the status file changes, the whole index is rebuilt with a single streaming pass
+	over the file, rather than running C{dpkg-query} once for each package we're asked about.
+	Values have the same format as the entries in C{dpkg-status.cache} ("VERSION<tab>ARCH",
+	or '-' if the package isn't installed).
+	@since: 2.6"""
+
+	def __init__(self, dpkg_status):
+		"""@type dpkg_status: str"""
+		Cache.__init__(self, 'dpkg-status-index.cache', dpkg_status, 1)
+
+	def get(self, key):
+		"""@type key: str
+		@rtype: str"""
+		value = Cache.get(self, key)		# (rebuilds the index if the status file has changed)
+		if value is None:
+			value = self.cache.get(key, '-')
+		return value
+
+	def _generate(self):
+		seen = set()
+		for package, version, debarch, status in _parse_dpkg_status(self.source):
+			if not status.endswith(' installed'): continue
+			clean_version = try_cleanup_distro_version(version)
+			if not clean_version:
+				logger.info(_("Can't parse distribution version '%(version)s' for package '%(package)s'"), {'version': version, 'package': package})
+				continue
+			if debarch.find("-") != -1:
+				debarch = debarch.split("-")[-1]
+			value = '%s\t%s' % (clean_version, canonical_machine(debarch))
+			# Like dpkg-query, allow both "name" and "name:arch". For multi-arch packages,
+			# the unqualified name refers to the first installed instance.
+			for key in (package, package + ':' + debarch):
+				if key not in seen:
+					seen.add(key)
+					yield key, value
+
+class CandidateCache(Cache):
+	"""Remembers the candidates found by apt-cache or PackageKit, so that new processes can
+	use them without asking again. Values can be anything that can be stored as JSON.
+	@since: 2.6"""
+
+	def __init__(self, cache_leaf, source, max_age = CANDIDATE_CACHE_MAX_AGE):
+		"""@param source: e.g. the apt lists directory (the cache is reset when it changes)
+		@type source: str | None
+		@type max_age: int | None"""
+		Cache.__init__(self, cache_leaf, source, 1, max_age)
+
+	def get_candidates(self, package, default = None):
+		"""Get the saved candidates for package, if any.
+		@type package: str
+		@return: the candidates, or default if we don't know"""
+		value = self.get(package)
+		if value is None:
+			return default
+		try:
+			return json.loads(value)
+		except ValueError as ex:
+			logger.info("Corrupted entry for %s in %s: %s", package, self.cache_leaf, ex)
+			return default
+
+	def put_candidates(self, package, candidates):
+		"""@type package: str"""
+		self.put(package, json.dumps(candidates))
+
+def _parse_dpkg_status(path):
+	"""Read the Package, Version, Architecture and Status fields of each stanza in a dpkg status file.
+	@type path: str
+	@rtype: iterable((str, str, str, str))"""
+	wanted = (b'Package', b'Version', b'Architecture', b'Status')
+	fields = {}
+	# (read in binary mode to avoid unicode errors from descriptions in the C locale)
+	with open(path, 'rb') as stream:
+		for line in stream:
+			if line[:1] in (b' ', b'\t'):
+				continue		# Continuation of a multi-line field
+			line = line.strip()
+			if line:
+				name, sep, value = line.partition(b':')
+				if sep and name in wanted:
+					fields[name] = value.strip().decode('utf-8')
+				continue
+			if b'Package' in fields:
+				yield fields[b'Package'], fields.get(b'Version', ''), fields.get(b'Architecture', ''), fields.get(b'Status', '')
+			fields = {}
+	if b'Package' in fields:
+		yield fields[b'Package'], fields.get(b'Version', ''), fields.get(b'Architecture', ''), fields.get(b'Status', '')
+
+@memoize(8192)
 def try_cleanup_distro_version(version):
 	"""Try to turn a distribution version string into one readable by Zero Install.
 	We do this by stripping off anything we can't parse.
+	Results are memoized, as the same version strings tend to come up again and again.
 	@type version: str
 	@return: the part we understood, or None if we couldn't parse anything
 	@rtype: str"""
@@ -136,7 +258,7 @@ def try_cleanup_distro_version(version):
 		suffix = '-pre' + (try_cleanup_distro_version(suffix) or '')
 	else:
 		suffix = ''
-	match = re.match(_version_regexp, version)
+	match = _version_match(version)
 	if match:
 		major, version, revision = match.groups()
 		if major is not None:
@@ -146,6 +268,16 @@ def try_cleanup_distro_version(version):
 		return version + suffix
 	return None
 
+def cleanup_many(versions):
+	"""Apply L{try_cleanup_distro_version} to each version in turn.
+	Use this when processing a whole package listing, e.g. in C{generate_cache}.
+	@type versions: iterable(str)
+	@rtype: iterable(str | None)
+	@since: 2.6"""
+	cleanup = try_cleanup_distro_version
+	for version in versions:
+		yield cleanup(version)
+
 class Distribution(object):
 	"""Represents a distribution with which we can integrate.
 	Sub-classes should specialise this to integrate with the package managers of
@@ -163,6 +295,12 @@ class Distribution(object):
 
 	system_paths = ['/usr/bin', '/bin', '/usr/sbin', '/sbin']
 
+	# Remembered candidates are discarded when this file changes (e.g. after updating the package lists)
+	candidates_source = None
+
+	# ... or when they are older than this (in seconds)
+	candidate_cache_max_age = CANDIDATE_CACHE_MAX_AGE
+
 	def get_package_info(self, package, factory):
 		"""Get information about the given package.
 		Add zero or more implementations using the factory (typically at most two
@@ -173,6 +311,22 @@ class Distribution(object):
 		@type factory: str -> L{model.DistributionImplementation}"""
 		return
 
+	def prefetch(self, packages):
+		"""Prepare to call L{get_package_info} for all of these packages.
+		Subclasses which need to query the package manager for each package should
+		override this to query them all at once. The default does nothing.
+		@type packages: [str]
+		@since: 2.6"""
+		pass
+
+	def is_uptodate(self):
+		"""Check whether this object still reflects the package database. Long-running
+		processes (e.g. C{0install slave --serve}) create a new one if not. Caches which check
+		their source files on each lookup don't need to override this.
+		@rtype: bool
+		@since: 2.6"""
+		return True
+
 	def get_score(self, distribution):
 		"""Indicate how closely the host distribution matches this one.
 		The <package-implementation> with the highest score is passed
@@ -282,7 +436,12 @@ class Distribution(object):
 		@rtype: L{packagekit.PackageKit}"""
 		if not self._packagekit:
 			from zeroinstall.injector import packagekit
-			self._packagekit = packagekit.PackageKit()
+			try:
+				cache = CandidateCache('packagekit-candidates.cache', self.candidates_source, self.candidate_cache_max_age)
+			except Exception as ex:
+				logger.warning("Failed to open PackageKit candidates cache: %s", ex)
+				cache = None
+			self._packagekit = packagekit.PackageKit(cache)
 		return self._packagekit
 
 	def fixup(self, package, impl):
@@ -485,6 +644,116 @@ class DarwinDistribution(Distribution):
 		elif package == 'gnupg2':
 			find_program("/usr/local/bin/gpg2")
 
+class MappedVersionIndex(object):
+	"""A read-only view of a binary CachedDistribution cache file, opened with mmap.
+	Lookups binary-search the sorted table of package names, so only the records for the
+	packages we actually ask about are decoded.
+
+	The file starts with a header (magic, format, mtime, size, number of packages), followed by
+	a table of count + 1 little-endian offsets (the last one marks the end of the data) and then
+	one record per package, in sorted order: NAME NUL VERSION TAB ARCH [NUL VERSION TAB ARCH ...]
+	@since: 2.6"""
+
+	magic = b'0INSTIDX'
+	format = 1
+	_header = struct.Struct('<8sIqqI')
+	_offset = struct.Struct('<I')
+
+	def __init__(self, path, status_details):
+		"""Open path, checking that it matches the package database described by status_details.
+		@type path: str
+		@raise Exception: if the file is missing, invalid or out-of-date"""
+		import mmap
+		with open(path, 'rb') as stream:
+			self._map = mmap.mmap(stream.fileno(), 0, access = mmap.ACCESS_READ)
+		try:
+			magic, format, mtime, size, self._count = self._header.unpack_from(self._map, 0)
+			if magic != self.magic or format != self.format:
+				raise Exception(_('Invalid cache format (bad header)'))
+			if mtime != int(status_details.st_mtime):
+				raise Exception(_("Modification time of package database file has changed"))
+			if size != status_details.st_size:
+				raise Exception(_("Size of package database file has changed"))
+			if len(self._map) < self._header.size + (self._count + 1) * self._offset.size:
+				raise Exception(_('Invalid cache format (truncated)'))
+		except:
+			self._map.close()
+			raise
+		self._decoded = {}
+
+	def close(self):
+		"""Unmap the file, keeping a private copy of its contents so that lookups still work.
+		Call this before replacing or deleting the file (Windows won't do that while it is mapped)."""
+		mapped = self._map
+		if not isinstance(mapped, bytes):
+			self._map = mapped[:]
+			mapped.close()
+
+	@classmethod
+	def write(cls, stream, versions, status_details):
+		"""Write versions to stream in the binary format.
+		@param versions: package name -> [(version, arch)]
+		@type versions: {str: [(str, str)]}"""
+		records = []
+		for package in sorted(versions):
+			fields = [package] + ['%s\t%s' % versionarch for versionarch in versions[package]]
+			records.append('\0'.join(fields).encode('utf-8'))
+
+		pos = cls._header.size + (len(records) + 1) * cls._offset.size
+		stream.write(cls._header.pack(cls.magic, cls.format, int(status_details.st_mtime), status_details.st_size, len(records)))
+		for record in records:
+			stream.write(cls._offset.pack(pos))
+			pos += len(record)
+		stream.write(cls._offset.pack(pos))
+		for record in records:
+			stream.write(record)
+
+	def _record(self, i):
+		start, = self._offset.unpack_from(self._map, self._header.size + i * self._offset.size)
+		end, = self._offset.unpack_from(self._map, self._header.size + (i + 1) * self._offset.size)
+		return start, end
+
+	def _name(self, start, end):
+		name_end = self._map.find(b'\0', start, end)
+		return self._map[start:end if name_end == -1 else name_end]
+
+	def get(self, package, default = None):
+		"""@type package: str
+		@return: the installed (version, arch) pairs for package
+		@rtype: [(str, str)]"""
+		if package in self._decoded:
+			return self._decoded[package]
+
+		key = package if isinstance(package, bytes) else package.encode('utf-8')
+		lo, hi = 0, self._count
+		while lo < hi:
+			mid = (lo + hi) // 2
+			start, end = self._record(mid)
+			name = self._name(start, end)
+			if name < key:
+				lo = mid + 1
+			elif name > key:
+				hi = mid
+			else:
+				result = []
+				for field in self._map[start:end].split(b'\0')[1:]:
+					version, zi_arch = field.split(b'\t')
+					if not isinstance(version, str):
+						version, zi_arch = version.decode('utf-8'), zi_arch.decode('utf-8')
+					result.append((version, intern(zi_arch)))
+				self._decoded[package] = result
+				return result
+		return default
+
+	def __getitem__(self, package):
+		result = self.get(package)
+		if result is None:
+			raise KeyError(package)
+		return result
+
+	def __contains__(self, package):
+		return self.get(package) is not None
+
 class CachedDistribution(Distribution):
 	"""For distributions where querying the package database is slow (e.g. requires running
 	an external command), we cache the results.
@@ -492,9 +761,13 @@ class CachedDistribution(Distribution):
 	@deprecated: use Cache instead
 	"""
 
+	# Also keep a binary copy of the cache, which can be searched without loading it (since 2.6)
+	use_binary_cache = True
+
 	def __init__(self, db_status_file):
 		"""@param db_status_file: update the cache when the timestamp of this file changes
 		@type db_status_file: str"""
+		self._db_status_file = db_status_file
 		self._status_details = os.stat(db_status_file)
 
 		self.versions = {}
@@ -511,9 +784,29 @@ class CachedDistribution(Distribution):
 			except Exception as ex:
 				logger.warning(_("Failed to regenerate distribution database cache: %s"), ex)
 
+	def is_uptodate(self):
+		try:
+			info = os.stat(self._db_status_file)
+		except OSError:
+			return False
+		return (int(info.st_mtime), info.st_size) == (int(self._status_details.st_mtime), self._status_details.st_size)
+
 	def _load_cache(self):
 		"""Load {cache_leaf} cache file into self.versions if it is available and up-to-date.
+		If we have an up-to-date binary cache, self.versions is a L{MappedVersionIndex} instead of a dict.
 		Throws an exception if the cache should be (re)created."""
+		if self.use_binary_cache:
+			try:
+				bin_cache = os.path.join(self.cache_dir, self.cache_leaf + '.bin')
+				# (if we couldn't replace or delete it after updating the text cache, it's out-of-date)
+				if os.stat(bin_cache).st_mtime < os.stat(os.path.join(self.cache_dir, self.cache_leaf)).st_mtime:
+					raise Exception(_("Older than the text cache"))
+				self.versions = MappedVersionIndex(bin_cache, self._status_details)
+				return
+			except Exception as ex:
+				logger.info(_("Can't use binary distribution database cache (%s); trying text version"), ex)
+
+		self.versions = {}
 		with open(os.path.join(self.cache_dir, self.cache_leaf), 'rt') as stream:
 			cache_version = None
 			for line in stream:
@@ -541,6 +834,10 @@ class CachedDistribution(Distribution):
 				else:
 					versions[package].append(versionarch)
 
+		if self.use_binary_cache:
+			# The text cache is valid, so save a binary copy for next time
+			self._write_binary_cache(self.versions)
+
 	def _write_cache(self, cache):
 		#cache.sort() 	# Might be useful later; currently we don't care
 		"""@type cache: [str]"""
@@ -564,6 +861,34 @@ class CachedDistribution(Distribution):
 			os.unlink(tmpname)
 			raise
 
+		if self.use_binary_cache:
+			versions = {}
+			for line in cache:
+				package, version, zi_arch = line.split('\t')
+				versions.setdefault(package, []).append((version, zi_arch))
+			self._write_binary_cache(versions)
+
+	def _close_binary_cache(self):
+		"""Stop using the binary cache file, so that it can be replaced or deleted."""
+		if isinstance(self.versions, MappedVersionIndex):
+			self.versions.close()
+
+	def _write_binary_cache(self, versions):
+		"""Save versions as {cache_leaf}.bin, for L{MappedVersionIndex}.
+		Failure isn't fatal, as we can always use the text cache.
+		@type versions: {str: [(str, str)]}"""
+		import tempfile
+		fd, tmpname = tempfile.mkstemp(prefix = 'zeroinstall-cache-tmp',
+					       dir = self.cache_dir)
+		try:
+			with os.fdopen(fd, 'wb') as stream:
+				MappedVersionIndex.write(stream, versions, self._status_details)
+			self._close_binary_cache()
+			portable_rename(tmpname, os.path.join(self.cache_dir, self.cache_leaf + '.bin'))
+		except Exception as ex:
+			logger.warning(_("Failed to write binary distribution database cache: %s"), ex)
+			os.unlink(tmpname)
+
 # Maps machine type names used in packages to their Zero Install versions
 # (updates to this might require changing the reverse Java mapping)
 _canonical_machine = {
@@ -612,11 +937,28 @@ class DebianDistribution(Distribution):
 
 	cache_leaf = 'dpkg-status.cache'
 
+	# Set to False to query each package with dpkg-query instead of indexing the status file
+	use_status_index = True
+
 	def __init__(self, dpkg_status):
 		"""@type dpkg_status: str"""
 		self.dpkg_cache = Cache('dpkg-status.cache', dpkg_status, 2)
 		self.apt_cache = {}
 
+		# "apt-get update" replaces files here (e.g. /var/lib/apt/lists for /var/lib/dpkg/status)
+		apt_lists = os.path.join(os.path.dirname(os.path.dirname(dpkg_status)), 'apt', 'lists')
+		if os.path.isdir(apt_lists):
+			self.candidates_source = apt_lists
+		self.apt_candidates = CandidateCache('apt-candidates.cache', self.candidates_source, self.candidate_cache_max_age)
+
+		# Read the whole status file at once if we can, rather than running dpkg-query for each package
+		self.dpkg_index = None
+		if self.use_status_index:
+			try:
+				self.dpkg_index = DpkgStatusIndex(dpkg_status)
+			except Exception as ex:
+				logger.warning(_("Failed to index %(status)s (%(exception)s); falling back to dpkg-query"), {'status': dpkg_status, 'exception': ex})
+
 	def _query_installed_package(self, package):
 		"""@type package: str
 		@rtype: str"""
@@ -661,6 +1003,11 @@ class DebianDistribution(Distribution):
 		self.packagekit.get_candidates(package, factory, 'package:deb')
 
 		# From apt-cache...
+		if package not in self.apt_cache:
+			# (from a previous run, if possible)
+			cached = self.apt_candidates.get_candidates(package, default = False)
+			if cached is not False:
+				self.apt_cache[package] = cached
 		cached = self.apt_cache.get(package, None)
 		if cached:
 			candidate_version = cached['version']
@@ -711,6 +1058,13 @@ class DebianDistribution(Distribution):
 	def _get_dpkg_info(self, package):
 		"""@type package: str
 		@rtype: str"""
+		if self.dpkg_index is not None:
+			try:
+				return self.dpkg_index.get(package)
+			except Exception as ex:
+				logger.warning(_("Failed to read dpkg status index (%s); falling back to dpkg-query"), ex)
+				self.dpkg_index = None
+
 		installed_cached_info = self.dpkg_cache.get(package)
 		if installed_cached_info == None:
 			installed_cached_info = self._query_installed_package(package)
@@ -727,66 +1081,257 @@ class DebianDistribution(Distribution):
 			return self.packagekit.fetch_candidates(package_names)
 
 		# No PackageKit. Use apt-cache directly.
+		return self._fetch_apt_candidates(package_names)
+
+	@tasks.async
+	def _fetch_apt_candidates(self, package_names):
+		"""Check to see whether we could get a newer version of each package using apt-get.
+		We ask apt-cache about many packages at once, and read its output without blocking
+		the main loop.
+		@type package_names: [str]"""
+		missing = []
 		for package in package_names:
-			# Check to see whether we could get a newer version using apt-get
+			cached = self.apt_candidates.get_candidates(package, default = False)
+			if cached is False:
+				missing.append(package)
+			else:
+				self.apt_cache[package] = cached
+		package_names = missing
+
+		while package_names:
+			batch = package_names[:MAX_APT_CACHE_BATCH_SIZE]
+			package_names = package_names[MAX_APT_CACHE_BATCH_SIZE:]
+
+			start = time.time()
+			results = None
 			try:
 				null = os.open(os.devnull, os.O_WRONLY)
-				child = subprocess.Popen(['apt-cache', 'show', '--no-all-versions', '--', package], stdout = subprocess.PIPE, stderr = null, universal_newlines = True)
+				child = subprocess.Popen(['apt-cache', 'show', '--no-all-versions', '--'] + batch, stdout = subprocess.PIPE, stderr = null)
 				os.close(null)
 
-				arch = version = size = None
-				for line in child.stdout:
-					line = line.strip()
-					if line.startswith('Version: '):
-						version = line[9:]
-						version = try_cleanup_distro_version(version)
-					elif line.startswith('Architecture: '):
-						arch = canonical_machine(line[14:].strip())
-					elif line.startswith('Size: '):
-						size = int(line[6:].strip())
-				if version and arch:
-					cached = {'version': version, 'arch': arch, 'size': size}
-				else:
-					cached = None
+				fd = child.stdout.fileno()
+				chunks = []
+				while True:
+					yield tasks.InputBlocker(fd, 'apt-cache show')
+					data = os.read(fd, 0x10000)
+					if not data: break
+					chunks.append(data)
 				child.stdout.close()
-				child.wait()
+				child.wait()		# (a non-zero exit status just means some packages weren't found)
+
+				results = _parse_apt_cache_show(b''.join(chunks).decode('utf-8', 'replace'))
 			except Exception as ex:
-				logger.warning("'apt-cache show %s' failed: %s", package, ex)
-				cached = None
-			# (multi-arch support? can there be multiple candidates?)
-			self.apt_cache[package] = cached
+				logger.warning("'apt-cache show %s' failed: %s", ' '.join(batch), ex)
+
+			if results is None:
+				for package in batch:
+					self.apt_cache[package] = None
+				continue
+
+			logger.debug("apt-cache show: got %d of %d packages in %.2f s", len(results), len(batch), time.time() - start)
+
+			for package in batch:
+				# (multi-arch support? can there be multiple candidates?)
+				cached = results.get(package, None)
+				self.apt_cache[package] = cached
+				self.apt_candidates.put_candidates(package, cached)
+
+def _parse_apt_cache_show(output):
+	"""Parse the output of C{apt-cache show --no-all-versions PACKAGE...}.
+	If there are several stanzas for a package, the last one wins.
+	@type output: str
+	@return: the candidate for each package, indexed by both "name" and "name:arch"
+	@rtype: {str: {str: str}}"""
+	results = {}
+	for stanza in output.split('\n\n'):
+		package = debarch = version = size = None
+		for line in stanza.split('\n'):
+			line = line.strip()
+			if line.startswith('Package: '):
+				package = line[9:].strip()
+			elif line.startswith('Version: '):
+				version = try_cleanup_distro_version(line[9:])
+			elif line.startswith('Architecture: '):
+				debarch = line[14:].strip()
+			elif line.startswith('Size: '):
+				size = int(line[6:].strip())
+		if package and version and debarch:
+			cached = {'version': version, 'arch': canonical_machine(debarch), 'size': size}
+			results[package] = cached
+			results[package + ':' + debarch] = cached
+	return results
 
 class RPMDistribution(CachedDistribution):
-	"""An RPM-based distribution."""
+	"""An RPM-based distribution.
+	In incremental mode (the default), we remember which packages we've been asked about. When the
+	RPM database changes, we re-query just those packages rather than listing every installed package,
+	and we query any other package the first time we're asked about it.
+	@ivar incremental: only query the packages we need, where possible (since 2.6)"""
 
 	name = 'RPM'
 
 	cache_leaf = 'rpm-status.cache'
 
+	incremental = True
+
+	_query_format = "--qf=%{NAME}\t%{VERSION}-%{RELEASE}\t%{ARCH}\n"
+
+	def __init__(self, db_status_file):
+		"""@type db_status_file: str"""
+		self._asked = None		# Packages the cache is known to cover (loaded on demand)
+		self._queried = {}		# Packages queried since the cache was loaded
+		super(RPMDistribution, self).__init__(db_status_file)
+
 	def generate_cache(self):
+		cache = None
+
+		asked = self._get_asked() if self.incremental else ()
+		if asked and len(asked) <= MAX_RPM_INCREMENTAL_PACKAGES:
+			try:
+				cache = self._query_rpm(sorted(asked))
+				logger.info("Updated RPM cache for %d packages", len(asked))
+			except Exception as ex:
+				logger.info("Incremental update of RPM cache failed (%s); doing a full rescan", ex)
+
+		if cache is None:
+			cache = self._query_rpm(None)
+
+		self._write_cache(cache)
+
+		if asked:
+			self._write_asked(asked)
+
+	def _query_rpm(self, packages):
+		"""Run rpm to get the installed versions of packages (or of all packages if None).
+		@type packages: [str] | None
+		@return: the cache lines
+		@rtype: [str]"""
 		cache = []
 
-		child = subprocess.Popen(["rpm", "-qa", "--qf=%{NAME}\t%{VERSION}-%{RELEASE}\t%{ARCH}\n"],
-					stdout = subprocess.PIPE, universal_newlines = True)
+		if packages is None:
+			args = ["rpm", "-qa", self._query_format]
+		else:
+			args = ["rpm", "-q", self._query_format, "--"] + packages
+			missing = set(packages)
+
+		rows = []
+		# (we need the untranslated "not installed" messages)
+		env = dict(os.environ, LC_ALL = 'C', LANG = 'C')
+		child = subprocess.Popen(args, stdout = subprocess.PIPE, universal_newlines = True, env = env)
 		for line in child.stdout:
+			if packages is not None and line.startswith('package ') and line.endswith(' is not installed\n'):
+				missing.discard(line[len('package '):-len(' is not installed\n')])
+				continue
 			package, version, rpmarch = line.split('\t', 2)
 			if package == 'gpg-pubkey':
 				continue
-			zi_arch = canonical_machine(rpmarch.strip())
-			clean_version = try_cleanup_distro_version(version)
+			if packages is not None:
+				missing.discard(package)
+			rows.append((package, version, rpmarch))
+		child.stdout.close()
+		child.wait()
+
+		for (package, version, rpmarch), clean_version in zip(rows, cleanup_many(row[1] for row in rows)):
 			if clean_version:
-				cache.append('%s\t%s\t%s' % (package, clean_version, zi_arch))
+				cache.append('%s\t%s\t%s' % (package, clean_version, canonical_machine(rpmarch.strip())))
 			else:
 				logger.warning(_("Can't parse distribution version '%(version)s' for package '%(package)s'"), {'version': version, 'package': package})
 
-		self._write_cache(cache)
-		child.stdout.close()
-		child.wait()
+		if packages is not None and missing:
+			raise Exception("No information from rpm about %s" % ', '.join(sorted(missing)))
+
+		return cache
+
+	def _get_asked(self):
+		"""The set of packages we've been asked about before (and for which the cache is therefore complete).
+		@rtype: set(str)"""
+		if self._asked is None:
+			self._asked = set()
+			try:
+				with open(os.path.join(self.cache_dir, self.cache_leaf + '.asked'), 'rt') as stream:
+					for line in stream:
+						self._asked.add(line.strip())
+			except IOError:
+				pass
+		return self._asked
+
+	def _write_asked(self, asked):
+		"""Replace the .asked file with asked. Other processes only ever append to it,
+		so we rewrite it whenever we regenerate the main cache to remove any duplicates.
+		@type asked: set(str)"""
+		import tempfile
+		fd, tmpname = tempfile.mkstemp(prefix = 'zeroinstall-cache-tmp',
+					       dir = self.cache_dir)
+		try:
+			with os.fdopen(fd, 'wt') as stream:
+				for package in sorted(asked):
+					stream.write(package + '\n')
+			portable_rename(tmpname, os.path.join(self.cache_dir, self.cache_leaf + '.asked'))
+		except Exception as ex:
+			logger.warning(_("Failed to write RPM cache: %s"), ex)
+			os.unlink(tmpname)
+
+	def _get_versions(self, package):
+		"""Look up package in the cache, querying rpm if the cache doesn't cover it yet.
+		@type package: str
+		@rtype: [(str, str)]"""
+		if self.incremental and package not in self._get_asked():
+			self._query_new([package])
+		versions = self._queried.get(package, None)
+		if versions is None:
+			versions = self.versions.get(package, None)
+		return versions or []
+
+	def prefetch(self, packages):
+		if self.incremental:
+			self._query_new(packages)
+
+	def _query_new(self, packages):
+		"""Query rpm (once) for any of these packages which aren't in the cache yet,
+		and remember that we've asked about all of them.
+		@type packages: [str]"""
+		asked = self._get_asked()
+		new = sorted(set(package for package in packages if package not in asked))
+		if not new:
+			return
+
+		unknown = [package for package in new if self._queried.get(package, None) is None and self.versions.get(package, None) is None]
+		cache = []
+		if unknown:
+			try:
+				cache = self._query_rpm(unknown)
+			except Exception as ex:
+				logger.warning(_("Failed to query rpm for %(package)s: %(error)s"), {'package': ', '.join(unknown), 'error': ex})
+				return
+
+			for package in unknown:
+				self._queried[package] = []
+			for line in cache:
+				name, version, zi_arch = line.split('\t')
+				self._queried.setdefault(name, []).append((version, intern(zi_arch)))
+
+		# Remember that we need these packages, so that other processes don't need to ask again
+		# and so we know to check them when the database changes.
+		asked.update(new)
+		try:
+			with open(os.path.join(self.cache_dir, self.cache_leaf + '.asked'), 'at') as stream:
+				for package in new:
+					stream.write(package + '\n')
+			if cache:
+				with open(os.path.join(self.cache_dir, self.cache_leaf), 'at') as stream:
+					for line in cache:
+						stream.write(line + '\n')
+				bin_cache = os.path.join(self.cache_dir, self.cache_leaf + '.bin')
+				if os.path.exists(bin_cache):
+					self._close_binary_cache()
+					os.unlink(bin_cache)		# Will be regenerated from the text cache
+		except Exception as ex:
+			logger.warning(_("Failed to update RPM cache: %s"), ex)
 
 	def get_package_info(self, package, factory):
 		# Add installed versions...
 		"""@type package: str"""
-		versions = self.versions.get(package, [])
+		versions = self._get_versions(package)
 
 		for version, machine in versions:
 			impl = factory('package:rpm:%s:%s:%s' % (package, version, machine))
@@ -838,139 +1383,216 @@ class RPMDistribution(CachedDistribution):
 				# OpenSUSE uses 1.6 to mean 6
 				del impl.version[0][0]
 
-class SlackDistribution(Distribution):
+class SlackDistribution(CachedDistribution):
 	"""A Slack-based distribution."""
 
 	name = 'Slack'
 
+	cache_leaf = 'slack-status.cache'
+
 	def __init__(self, packages_dir):
 		"""@type packages_dir: str"""
 		self._packages_dir = packages_dir
+		super(SlackDistribution, self).__init__(packages_dir)
+
+	def generate_cache(self):
+		cache = []
+
+		for entry in os.listdir(self._packages_dir):
+			try:
+				name, version, arch, build = entry.rsplit('-', 3)
+			except ValueError:
+				logger.info("Ignoring unexpected entry '%s' in %s", entry, self._packages_dir)
+				continue
+			zi_arch = canonical_machine(arch)
+			clean_version = try_cleanup_distro_version("%s-%s" % (version, build))
+			if clean_version:
+				cache.append('%s\t%s\t%s' % (name, clean_version, zi_arch))
+			else:
+				logger.warning(_("Can't parse distribution version '%(version)s' for package '%(package)s'"), {'version': version, 'package': name})
+
+		self._write_cache(cache)
 
 	def get_package_info(self, package, factory):
 		# Add installed versions...
 		"""@type package: str"""
-		for entry in os.listdir(self._packages_dir):
-			name, version, arch, build = entry.rsplit('-', 3)
-			if name == package:
-				zi_arch = canonical_machine(arch)
-				clean_version = try_cleanup_distro_version("%s-%s" % (version, build))
-				if not clean_version:
-					logger.warning(_("Can't parse distribution version '%(version)s' for package '%(package)s'"), {'version': version, 'package': name})
-					continue
-	
-				impl = factory('package:slack:%s:%s:%s' % \
-						(package, clean_version, zi_arch))
-				impl.version = model.parse_version(clean_version)
-				if zi_arch != '*':
-					impl.machine = zi_arch
+		for version, machine in self.versions.get(package, []):
+			impl = factory('package:slack:%s:%s:%s' % \
+					(package, version, machine))
+			impl.version = model.parse_version(version)
+			if machine != '*':
+				impl.machine = machine
 
 		# Add any uninstalled candidates found by PackageKit
 		self.packagekit.get_candidates(package, factory, 'package:slack')
 
-class ArchDistribution(Distribution):
+class ArchDistribution(CachedDistribution):
 	"""An Arch Linux distribution."""
 
 	name = 'Arch'
 
+	cache_leaf = 'arch-status.cache'
+
 	def __init__(self, packages_dir):
 		"""@type packages_dir: str"""
 		self._packages_dir = os.path.join(packages_dir, "local")
+		super(ArchDistribution, self).__init__(self._packages_dir)
+
+	def generate_cache(self):
+		# We store the raw "version-build" string, since we need it to find the desc file again.
+		cache = []
+
+		for entry in os.listdir(self._packages_dir):
+			try:
+				name, version, build = entry.rsplit('-', 2)
+			except ValueError:
+				logger.info("Ignoring unexpected entry '%s' in %s", entry, self._packages_dir)
+				continue
+			raw_version = "%s-%s" % (version, build)
+			if not try_cleanup_distro_version(raw_version):
+				logger.warning(_("Can't parse distribution version '%(version)s' for package '%(package)s'"), {'version': version, 'package': name})
+				continue
+			arch = ''
+			# (read in binary mode to avoid unicode errors in C locale)
+			with open(os.path.join(self._packages_dir, entry, "desc"), 'rb') as stream:
+				gotarch = False
+				for line in stream:
+					if line == b"%ARCH%\n":
+						gotarch = True
+						continue
+					if gotarch:
+						arch = line.strip().decode('utf-8')
+						break
+			cache.append('%s\t%s\t%s' % (name, raw_version, canonical_machine(arch)))
+
+		self._write_cache(cache)
 
 	def get_package_info(self, package, factory):
 		# Add installed versions...
 		"""@type package: str"""
-		for entry in os.listdir(self._packages_dir):
-			name, version, build = entry.rsplit('-', 2)
-			if name == package:
-				gotarch = False
-				# (read in binary mode to avoid unicode errors in C locale)
-				with open(os.path.join(self._packages_dir, entry, "desc"), 'rb') as stream:
-					for line in stream:
-						if line == b"%ARCH%\n":
-							gotarch = True
-							continue
-						if gotarch:
-							arch = line.strip().decode('utf-8')
-							break
-				zi_arch = canonical_machine(arch)
-				clean_version = try_cleanup_distro_version("%s-%s" % (version, build))
-				if not clean_version:
-					logger.warning(_("Can't parse distribution version '%(version)s' for package '%(package)s'"), {'version': version, 'package': name})
-					continue
-	
-				impl = factory('package:arch:%s:%s:%s' % \
-						(package, clean_version, zi_arch))
-				impl.version = model.parse_version(clean_version)
-				if zi_arch != '*':
-					impl.machine = zi_arch
-
-				impl.quick_test_file = os.path.join(self._packages_dir, entry, 'desc')
+		for raw_version, machine in self.versions.get(package, []):
+			clean_version = try_cleanup_distro_version(raw_version)
+
+			impl = factory('package:arch:%s:%s:%s' % \
+					(package, clean_version, machine))
+			impl.version = model.parse_version(clean_version)
+			if machine != '*':
+				impl.machine = machine
+
+			impl.quick_test_file = os.path.join(self._packages_dir, '%s-%s' % (package, raw_version), 'desc')
 
 		# Add any uninstalled candidates found by PackageKit
 		self.packagekit.get_candidates(package, factory, 'package:arch')
 
+class GentooCategoryIndex(Cache):
+	"""An index of the packages installed in one Gentoo category directory (e.g. /var/db/pkg/sys-apps),
+	rebuilt whenever the directory changes.
+	Keys are package leafnames and values are ';'-separated lists of "VERSION<tab>MACHINE" entries.
+	@since: 2.6"""
+
+	_version_start_regexp = re.compile('-[0-9]')
+
+	def __init__(self, category_dir):
+		"""@type category_dir: str"""
+		self.category = os.path.basename(category_dir)
+		Cache.__init__(self, 'gentoo-%s.cache' % self.category, category_dir, 1)
+
+	def get_versions(self, leafname):
+		"""@type leafname: str
+		@rtype: [(str, str)]"""
+		value = self.get(leafname)		# (rebuilds the index if the directory has changed)
+		if value is None:
+			value = self.cache.get(leafname, None)
+		if not value:
+			return []
+		return [tuple(entry.split('\t')) for entry in value.split(';')]
+
+	def _generate(self):
+		entries = {}
+		for filename in os.listdir(self.source):
+			# An entry such as "font-adobe-100dpi-1.0.3" is a match for both "font-adobe"
+			# and "font-adobe-100dpi", so index it under each possible leafname.
+			leafnames = [filename[:m.start()] for m in self._version_start_regexp.finditer(filename)]
+			if not leafnames: continue
+
+			try:
+				entry = self._read_entry(os.path.join(self.source, filename))
+			except (IOError, OSError, ValueError) as ex:
+				logger.warning(_("Failed to read Gentoo package %(filename)s: %(error)s"), {'filename': filename, 'error': ex})
+				continue
+			if entry is None: continue
+
+			for leafname in leafnames:
+				entries.setdefault(leafname, []).append(entry)
+
+		for leafname, versions in entries.items():
+			yield leafname, ';'.join(versions)
+
+	def _read_entry(self, pkg_dir):
+		"""@return: "VERSION<tab>MACHINE", or None if the version can't be parsed
+		@rtype: str | None"""
+		with open(os.path.join(pkg_dir, 'PF'), 'rt') as stream:
+			name = stream.readline().strip()
+
+		match = self._version_start_regexp.search(name)
+		version = match and try_cleanup_distro_version(name[match.start() + 1:])
+		if not version:
+			logger.warning(_('Cannot parse version from Gentoo package named "%(name)s"'), {'name': name})
+			return None
+
+		if self.category == 'app-emulation' and name.startswith('emul-'):
+			__, __, machine, __ = name.split('-', 3)
+		else:
+			with open(os.path.join(pkg_dir, 'CHOST'), 'rt') as stream:
+				machine, __ = stream.readline().split('-', 1)
+		return '%s\t%s' % (version, arch_canonicalize_machine(machine))
+
 class GentooDistribution(Distribution):
 	name = 'Gentoo'
 
 	def __init__(self, pkgdir):
 		"""@type pkgdir: str"""
 		self._pkgdir = pkgdir
+		self._category_indexes = {}	# Category -> GentooCategoryIndex
 
 	def get_package_info(self, package, factory):
 		# Add installed versions...
 		"""@type package: str"""
-		_version_start_reqexp = '-[0-9]'
-
 		if package.count('/') != 1: return
 
 		category, leafname = package.split('/')
-		category_dir = os.path.join(self._pkgdir, category)
-		match_prefix = leafname + '-'
-
-		if not os.path.isdir(category_dir): return
-
-		for filename in os.listdir(category_dir):
-			if filename.startswith(match_prefix) and filename[len(match_prefix)].isdigit():
-				with open(os.path.join(category_dir, filename, 'PF'), 'rt') as stream:
-					name = stream.readline().strip()
-
-				match = re.search(_version_start_reqexp, name)
-				if match is None:
-					logger.warning(_('Cannot parse version from Gentoo package named "%(name)s"'), {'name': name})
-					continue
-				else:
-					version = try_cleanup_distro_version(name[match.start() + 1:])
 
-				if category == 'app-emulation' and name.startswith('emul-'):
-					__, __, machine, __ = name.split('-', 3)
-				else:
-					with open(os.path.join(category_dir, filename, 'CHOST'), 'rt') as stream:
-						machine, __ = stream.readline().split('-', 1)
-				machine = arch_canonicalize_machine(machine)
+		index = self._category_indexes.get(category, None)
+		if index is None:
+			category_dir = os.path.join(self._pkgdir, category)
+			if not os.path.isdir(category_dir): return
+			index = self._category_indexes[category] = GentooCategoryIndex(category_dir)
 
-				impl = factory('package:gentoo:%s:%s:%s' % \
-						(package, version, machine))
-				impl.version = model.parse_version(version)
-				impl.machine = machine
+		for version, machine in index.get_versions(leafname):
+			impl = factory('package:gentoo:%s:%s:%s' % \
+					(package, version, machine))
+			impl.version = model.parse_version(version)
+			impl.machine = machine
 
 		# Add any uninstalled candidates found by PackageKit
 		self.packagekit.get_candidates(package, factory, 'package:gentoo')
 
-class PortsDistribution(Distribution):
+class PortsDistribution(CachedDistribution):
 	name = 'Ports'
 
 	system_paths = ['/usr/local/bin']
 
+	cache_leaf = 'ports-status.cache'
+
 	def __init__(self, pkgdir):
 		"""@type pkgdir: str"""
 		self._pkgdir = pkgdir
+		super(PortsDistribution, self).__init__(pkgdir)
 
-	def get_package_info(self, package, factory):
-		"""@type package: str"""
-		_name_version_regexp = '^(.+)-([^-]+)$'
+	def generate_cache(self):
+		cache = []
 
-		nameversion = re.compile(_name_version_regexp)
+		nameversion = re.compile('^(.+)-([^-]+)$')
 		for pkgname in os.listdir(self._pkgdir):
 			pkgdir = os.path.join(self._pkgdir, pkgname)
 			if not os.path.isdir(pkgdir): continue
@@ -981,14 +1603,18 @@ class PortsDistribution(Distribution):
 			if match is None:
 				logger.warning(_('Cannot parse version from Ports package named "%(pkgname)s"'), {'pkgname': pkgname})
 				continue
+			name, version = match.groups()
+			clean_version = try_cleanup_distro_version(version)
+			if clean_version:
+				cache.append('%s\t%s\t%s' % (name, clean_version, host_machine))
 			else:
-				name = match.group(1)
-				if name != package:
-					continue
-				version = try_cleanup_distro_version(match.group(2))
+				logger.warning(_("Can't parse distribution version '%(version)s' for package '%(package)s'"), {'version': version, 'package': name})
 
-			machine = host_machine
+		self._write_cache(cache)
 
+	def get_package_info(self, package, factory):
+		"""@type package: str"""
+		for version, machine in self.versions.get(package, []):
 			impl = factory('package:ports:%s:%s:%s' % \
 						(package, version, machine))
 			impl.version = model.parse_version(version)
@@ -1071,6 +1697,7 @@ class CygwinDistribution(CachedDistribution):
 		cache = []
 
 		zi_arch = '*'
+		rows = []
 		for line in os.popen("cygcheck -c -d"):
 			if line == "Cygwin Package Information\r\n":
 				continue
@@ -1079,7 +1706,9 @@ class CygwinDistribution(CachedDistribution):
 			package, version = line.split()
 			if package == "Package" and version == "Version":
 				continue
-			clean_version = try_cleanup_distro_version(version)
+			rows.append((package, version))
+
+		for (package, version), clean_version in zip(rows, cleanup_many(row[1] for row in rows)):
 			if clean_version:
 				cache.append('%s\t%s\t%s' % (package, clean_version, zi_arch))
 			else:
@@ -12,26 +12,95 @@ This module is used to invoke GnuPG to check the digital signatures on interface
 from zeroinstall import _, logger
 import subprocess
 import os
-import tempfile
 
 from zeroinstall.support import find_in_path, basedir
 from zeroinstall.injector.trust import trust_db
 from zeroinstall.injector.model import SafeException
 
 _gnupg_options = None
-def _run_gpg(args, **kwargs):
-	"""@type args: [str]
-	@rtype: subprocess.Popen"""
+def _get_gpg_options():
+	"""@rtype: [str]"""
 	global _gnupg_options
 	if _gnupg_options is None:
 		gpg_path = os.environ.get('ZEROINSTALL_GPG') or find_in_path('gpg') or find_in_path('gpg2') or 'gpg'
-		_gnupg_options = [gpg_path, '--no-secmem-warning']
+		# We never prompt, and we use our own trust database rather than GnuPG's,
+		# so skip the (slow) automatic trustdb check too.
+		_gnupg_options = [gpg_path, '--no-secmem-warning', '--batch', '--no-tty', '--no-auto-check-trustdb']
 
 		if hasattr(os, 'geteuid') and os.geteuid() == 0 and 'GNUPGHOME' not in os.environ:
 			_gnupg_options += ['--homedir', os.path.join(basedir.home, '.gnupg')]
 			logger.info(_("Running as root, so setting GnuPG home to %s"), _gnupg_options[-1])
+	return _gnupg_options
 
-	return subprocess.Popen(_gnupg_options + args, universal_newlines = True, **kwargs)
+def _run_gpg(args, **kwargs):
+	"""@type args: [str]
+	@rtype: subprocess.Popen"""
+	return subprocess.Popen(_get_gpg_options() + args, universal_newlines = True, **kwargs)
+
+# Output of "gpg --list-keys" for each known key we've asked about (as lists of lines),
+# indexed by upper-case fingerprint. This is only valid while _key_info_stamp matches the
+# keyring files. Unknown keys aren't cached, since they may be imported at any time (e.g. by
+# the master process, or via keyboxd, which doesn't change any of the files we check).
+_key_info = {}
+_key_info_stamp = None
+
+def _keyring_stamp():
+	"""Get the modification times and sizes of the keyring files, to detect changes.
+	@rtype: tuple"""
+	options = _get_gpg_options()
+	if '--homedir' in options:
+		home = options[options.index('--homedir') + 1]
+	else:
+		home = os.environ.get('GNUPGHOME') or os.path.join(basedir.home, '.gnupg')
+	stamp = [home]
+	for leaf in ['pubring.gpg', 'pubring.kbx', 'trustdb.gpg', os.path.join('public-keys.d', 'pubring.db')]:
+		try:
+			info = os.stat(os.path.join(home, leaf))
+			stamp.append((info.st_mtime, info.st_size))
+		except OSError:
+			stamp.append(None)
+	return tuple(stamp)
+
+def _list_keys(fingerprints):
+	"""Get the 'gpg --list-keys' output for each of these keys. Results are cached until the
+	keyring changes, and any keys not in the cache are looked up with a single call to gpg.
+	Keys that gpg doesn't know are looked up again each time.
+	@type fingerprints: [str]
+	@return: the lines of output for each key (empty if gpg doesn't know it)
+	@rtype: {str: [str]}"""
+	global _key_info_stamp
+	stamp = _keyring_stamp()
+	if stamp != _key_info_stamp:
+		_key_info.clear()
+		_key_info_stamp = stamp
+
+	missing = [fp for fp in fingerprints if fp.upper() not in _key_info]
+	if missing:
+		# Note: GnuPG 2 always uses --fixed-list-mode
+		child = _run_gpg(['--fixed-list-mode', '--with-colons', '--list-keys',
+					'--with-fingerprint', '--with-fingerprint'] + missing, stdout = subprocess.PIPE)
+		cout, unused = child.communicate()
+		if child.returncode:
+			logger.info(_("GPG exited with code %d") % child.returncode)
+
+		# Split into one record per key, and index each record by all of its fingerprints
+		# (including those of subkeys)
+		records = {}
+		record = None
+		for line in cout.split('\n'):
+			if line.startswith('pub:'):
+				record = []
+			if record is None: continue
+			record.append(line)
+			if line.startswith('fpr:'):
+				records[line.split(':')[9].upper()] = record
+
+		for fp in missing:
+			record = records.get(fp.upper(), None)
+			if record is not None:
+				_key_info[fp.upper()] = record
+
+	return dict((fp, _key_info.get(fp.upper(), [])) for fp in fingerprints)
 
 class Signature(object):
 	"""Abstract base class for signature check results.
@@ -78,16 +147,9 @@ class ValidSig(Signature):
 
 	def get_details(self):
 		"""Call 'gpg --list-keys' and return the results split into lines and columns.
+		The results are cached until the keyring changes (see L{load_keys}).
 		@rtype: [[str]]"""
-		# Note: GnuPG 2 always uses --fixed-list-mode
-		child = _run_gpg(['--fixed-list-mode', '--with-colons', '--list-keys', self.fingerprint], stdout = subprocess.PIPE)
-		cout, unused = child.communicate()
-		if child.returncode:
-			logger.info(_("GPG exited with code %d") % child.returncode)
-		details = []
-		for line in cout.split('\n'):
-			details.append(line.split(':'))
-		return details
+		return [line.split(':') for line in _list_keys([self.fingerprint])[self.fingerprint]]
 
 class Key(object):
 	"""A GPG key.
@@ -108,6 +170,7 @@ class Key(object):
 def load_keys(fingerprints):
 	"""Load a set of keys at once.
 	This is much more efficient than making individual calls to L{load_key}.
+	Keys we've already loaded are remembered until the keyring files change (since 2.6).
 	@type fingerprints: [str]
 	@return: a list of loaded keys, indexed by fingerprint
 	@rtype: {str: L{Key}}
@@ -119,43 +182,45 @@ def load_keys(fingerprints):
 	# Otherwise GnuPG returns everything...
 	if not fingerprints: return keys
 
+	by_fpr = {}		# Upper-case fingerprint -> keys to update
 	for fp in fingerprints:
 		keys[fp] = Key(fp)
+		by_fpr.setdefault(fp.upper(), []).append(keys[fp])
 
 	current_fpr = None
 	current_uid = None
 
-	child = _run_gpg(['--fixed-list-mode', '--with-colons', '--list-keys',
-				'--with-fingerprint', '--with-fingerprint'] + fingerprints, stdout = subprocess.PIPE)
-	try:
-		for line in child.stdout:
-			if line.startswith('pub:'):
-				current_fpr = None
-				current_uid = None
-			if line.startswith('fpr:'):
-				current_fpr = line.split(':')[9]
-				if current_fpr in keys and current_uid:
-					# This is probably a subordinate key, where the fingerprint
-					# comes after the uid, not before. Note: we assume the subkey is
-					# cross-certified, as recent always ones are.
+	lines = []
+	seen = set()
+	for record in _list_keys(fingerprints).values():
+		if id(record) not in seen:
+			seen.add(id(record))
+			lines += record
+
+	for line in lines:
+		if line.startswith('pub:'):
+			current_fpr = None
+			current_uid = None
+		if line.startswith('fpr:'):
+			current_fpr = line.split(':')[9].upper()
+			if current_uid:
+				# This is probably a subordinate key, where the fingerprint
+				# comes after the uid, not before. Note: we assume the subkey is
+				# cross-certified, as recent always ones are.
+				for key in by_fpr.get(current_fpr, []):
 					try:
-						keys[current_fpr].name = codecs.decode(current_uid, 'utf-8')
+						key.name = codecs.decode(current_uid, 'utf-8')
 					except:
 						logger.warning("Not UTF-8: %s", current_uid)
-						keys[current_fpr].name = current_uid
-			if line.startswith('uid:'):
-				assert current_fpr is not None
-				# Only take primary UID
-				if current_uid: continue
-				parts = line.split(':')
-				current_uid = parts[9]
-				if current_fpr in keys:
-					keys[current_fpr].name = current_uid
-	finally:
-		child.stdout.close()
-
-		if child.wait():
-			logger.warning(_("gpg --list-keys failed with exit code %d") % child.returncode)
+						key.name = current_uid
+		if line.startswith('uid:'):
+			assert current_fpr is not None
+			# Only take primary UID
+			if current_uid: continue
+			parts = line.split(':')
+			current_uid = parts[9]
+			for key in by_fpr.get(current_fpr, []):
+				key.name = current_uid
 
 	return keys
 
@@ -169,14 +234,12 @@ def load_key(fingerprint):
 def import_key(stream):
 	"""Run C{gpg --import} with this stream as stdin.
 	@type stream: file"""
-	with tempfile.TemporaryFile(mode = 'w+t') as errors:
-		child = _run_gpg(['--quiet', '--import', '--batch'],
-					stdin = stream, stderr = errors)
-
-		status = child.wait()
+	child = _run_gpg(['--quiet', '--import'], stdin = stream, stderr = subprocess.PIPE)
+	unused, error_messages = child.communicate()
+	status = child.returncode
+	error_messages = error_messages.strip()
 
-		errors.seek(0)
-		error_messages = errors.read().strip()
+	_key_info.clear()
 
 	if status != 0:
 		if error_messages:
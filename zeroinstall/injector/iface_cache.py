@@ -30,6 +30,8 @@ creating new cache objects.
 
 from __future__ import print_function
 
+from collections import OrderedDict
+
 from zeroinstall import _, logger
 from zeroinstall.support import basedir, unicode
 from zeroinstall.injector import reader
@@ -49,14 +51,41 @@ class IfaceCache(object):
 	cache of L{model.Interface} objects, and an on-disk cache of L{model.ZeroInstallFeed}s.
 	It will probably be split into two in future.
 
+	Both caches are bounded. When there are more than max_entries feeds (or interfaces), or the
+	estimated size of the cached feeds exceeds max_bytes, the least-recently-used ones are dropped
+	(except for pinned ones; see L{pin}). The hits, misses and evictions counters can be used
+	to tune these limits.
+
+	@ivar max_entries: the maximum number of feeds or interfaces to keep
+	@type max_entries: int
+	@ivar max_bytes: the memory budget for feeds (see L{estimate_size})
+	@type max_bytes: int
+	@ivar hits: number of get_feed and get_interface calls answered from memory
+	@type hits: int
+	@ivar misses: number of get_feed and get_interface calls that needed a new object
+	@type misses: int
+	@ivar evictions: number of feeds and interfaces dropped to stay within the limits
+	@type evictions: int
+	@ivar total_bytes: the estimated size of the cached feeds
+	@type total_bytes: int
+
 	@see: L{iface_cache} - the singleton IfaceCache instance.
 	"""
 
-	__slots__ = ['_interfaces', '_feeds']
+	__slots__ = ['_interfaces', '_feeds', '_sizes', '_pinned', 'max_entries', 'max_bytes',
+		     'hits', 'misses', 'evictions', 'total_bytes']
 
-	def __init__(self):
-		self._interfaces = {}
-		self._feeds = {}
+	def __init__(self, max_entries = 1000, max_bytes = 64 * 1024 * 1024):
+		"""@type max_entries: int
+		@type max_bytes: int"""
+		self._interfaces = OrderedDict()
+		self._feeds = OrderedDict()
+		self._sizes = {}
+		self._pinned = frozenset()
+		self.max_entries = max_entries
+		self.max_bytes = max_bytes
+		self.hits = self.misses = self.evictions = 0
+		self.total_bytes = 0
 
 	def get_feed(self, url, force = False):
 		"""Get a feed from the cache.
@@ -64,19 +93,122 @@ class IfaceCache(object):
 		@type url: str
 		@param force: load the file from disk again
 		@type force: bool
-		@return: the feed, or None if it isn't cached
+		@return: the feed, or None if it isn't cached. The feed is loaded lazily (see L{reader.LazyZeroInstallFeed}).
 		@rtype: L{model.ZeroInstallFeed}"""
 		if not force:
-			feed = self._feeds.get(url, False)
+			feed = self._feeds.pop(url, False)
 			if feed != False:
+				self.hits += 1
+				self._add_feed(url, feed)	# (move to the end, and update the size in case it's been loaded since)
 				return feed
 
 		assert not url.startswith('distribution:'), url
 
-		feed = reader.load_feed_from_cache(url)
-		self._feeds[url] = feed
+		self.misses += 1
+		feed = reader.load_feed_from_cache(url, lazy = True)
+		self._feeds.pop(url, None)
+		self._add_feed(url, feed)
+		self._evict()
 		return feed
 
+	def get_feeds(self, urls, force = False):
+		"""Get several feeds from the cache, as for L{get_feed}.
+		The cached copies are found with a single scan of each cache directory
+		(see L{reader.find_cached_feeds}), rather than by probing for each feed.
+		If any feed can't be loaded, the others are still added to the cache and
+		then the first error (in the order of urls) is raised.
+		@type urls: [str]
+		@param force: load the files from disk again
+		@type force: bool
+		@return: the feed (or None) for each URL, in order
+		@rtype: [L{model.ZeroInstallFeed} | None]
+		@since: 2.6"""
+		results = {}
+		missing = []		# (in order)
+		missing_set = set()
+		for url in urls:
+			if url in results or url in missing_set:
+				continue
+			feed = False if force else self._feeds.get(url, False)
+			if feed == False:
+				assert not url.startswith('distribution:'), url
+				missing.append(url)
+				missing_set.add(url)
+			else:
+				results[url] = feed
+
+		errors = {}
+		if missing:
+			paths = reader.find_cached_feeds(missing)
+
+			def load(url):
+				try:
+					return reader.load_feed_from_cache(url, lazy = True, cached = paths[url]), None
+				except Exception as ex:
+					return None, ex
+
+			with basedir.cached_listings():
+				loaded = dict((url, load(url)) for url in missing if paths[url] is not None)
+
+			for url in missing:
+				feed, ex = loaded.get(url, (None, None))
+				self.misses += 1
+				if ex is None:
+					self._feeds.pop(url, None)
+					self._add_feed(url, feed)
+					results[url] = feed
+				else:
+					errors[url] = ex
+
+		for url in urls:
+			if url not in missing_set and url in self._feeds:
+				self.hits += 1
+				self._add_feed(url, self._feeds.pop(url))	# (move to the end)
+		self._evict()
+
+		for url in urls:
+			if url in errors:
+				raise errors[url]
+		return [results[url] for url in urls]
+
+	def _add_feed(self, url, feed):
+		size = estimate_size(feed)
+		self.total_bytes += size - self._sizes.get(url, 0)
+		self._sizes[url] = size
+		self._feeds[url] = feed
+
+	def _evict(self):
+		"""Drop least-recently-used entries until we're within our limits.
+		The most-recently-used entry is always kept. Called after adding a new entry."""
+		for cache in (self._feeds, self._interfaces):
+			sizes = self._sizes if cache is self._feeds else {}
+			count = len(cache)
+			total = self.total_bytes if cache is self._feeds else 0
+			if count <= self.max_entries and total <= self.max_bytes:
+				continue
+			newest = next(reversed(cache))
+			victims = []
+			for url in cache:
+				if (count <= self.max_entries and total <= self.max_bytes) or url == newest:
+					break
+				if url in self._pinned:
+					continue
+				victims.append(url)
+				count -= 1
+				total -= sizes.get(url, 0)
+			for url in victims:
+				del cache[url]
+				if cache is self._feeds:
+					self.total_bytes -= self._sizes.pop(url, 0)
+			self.evictions += len(victims)
+
+	def pin(self, urls):
+		"""Never evict the feeds and interfaces with these URLs (e.g. those in the current selections).
+		This replaces any previously-pinned set.
+		@type urls: [str]
+		@since: 2.6"""
+		self._pinned = frozenset(urls)
+
 	def get_interface(self, uri):
 		"""Get the interface for uri, creating a new one if required.
 		New interfaces are initialised from the disk cache, but not from
@@ -88,12 +220,17 @@ class IfaceCache(object):
 			uri = unicode(uri)
 		assert isinstance(uri, unicode)
 
-		if uri in self._interfaces:
-			return self._interfaces[uri]
+		iface = self._interfaces.pop(uri, None)
+		if iface is not None:
+			self.hits += 1
+			self._interfaces[uri] = iface
+			return iface
 
 		logger.debug(_("Initialising new interface object for %s"), uri)
-		self._interfaces[uri] = Interface(uri)
-		return self._interfaces[uri]
+		self.misses += 1
+		iface = self._interfaces[uri] = Interface(uri)
+		self._evict()
+		return iface
 
 	def get_icon_path(self, iface):
 		"""Get the path of a cached icon for an interface.
@@ -104,4 +241,22 @@ class IfaceCache(object):
 		return basedir.load_first_cache(config_site, 'interface_icons',
 						 escape(iface.uri))
 
+def estimate_size(feed):
+	"""Roughly estimate the memory used by a cached feed, in bytes.
+	Lazy feeds which haven't been fully loaded yet are not loaded by this.
+	@type feed: L{model.ZeroInstallFeed} | None
+	@rtype: int
+	@since: 2.6"""
+	if feed is None:
+		return 100
+	if not getattr(feed, '_loaded', True):
+		return 1000		# Just the header
+	size = 2000
+	size += 1000 * len(getattr(feed, 'implementations', ()))
+	size += 500 * (len(getattr(feed, 'metadata', ())) + len(getattr(feed, 'feeds', ())))
+	for texts in (getattr(feed, 'summaries', None), getattr(feed, 'descriptions', None)):
+		if texts:
+			size += sum(len(text) for text in texts.values())
+	return size
+
 iface_cache = IfaceCache()
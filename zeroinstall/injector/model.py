@@ -322,6 +322,9 @@ class Interface(object):
 		"""@rtype: str"""
 		return _("<Interface %s>") % self.uri
 
+# Elements which only matter when selecting implementations (see L{ZeroInstallFeed.from_stream})
+_implementation_elements = ('group', 'implementation', 'package-implementation')
+
 class ZeroInstallFeed(object):
 	"""A feed lists available implementations of an interface.
 	@ivar url: the URL for this feed
@@ -351,6 +354,26 @@ class ZeroInstallFeed(object):
 		@type feed_element: L{qdom.Element}
 		@param local_path: the pathname of this local feed, or None for remote feeds
 		@type local_path: str | None"""
+		self._load(feed_element, feed_element.childNodes if feed_element is not None else None, local_path)
+
+	@classmethod
+	def from_stream(cls, elements, local_path = None):
+		"""Create a feed object from a stream of elements, as returned by L{qdom.iterparse}.
+		Each child element is processed and then discarded, so the whole document is never in
+		memory at once. For the same reason, the implementation elements (<group>, <implementation> and
+		<package-implementation>) are not kept in L{metadata}, and L{feed_element} has no children.
+		@param elements: the root element, followed by each of its children
+		@type elements: iterable(L{qdom.Element})
+		@param local_path: the pathname of this local feed, or None for remote feeds
+		@type local_path: str | None
+		@rtype: L{ZeroInstallFeed}
+		@since: 2.6"""
+		elements = iter(elements)
+		feed = cls.__new__(cls)
+		feed._load(next(elements), elements, local_path, keep_implementations = False)
+		return feed
+
+	def _load(self, feed_element, children, local_path, keep_implementations = True):
 		self.local_path = local_path
 		self.implementations = {}
 		self.name = None
@@ -384,7 +407,7 @@ class ZeroInstallFeed(object):
 							"You can get a newer version from http://0install.net") %
 							{'min_version': min_injector_version, 'version': version})
 
-		for x in feed_element.childNodes:
+		for x in children:
 			if x.uri != XMLNS_IFACE:
 				self.metadata.append(x)
 				continue
@@ -400,6 +423,8 @@ class ZeroInstallFeed(object):
 				pass
 			elif x.name == 'feed':
 				pass
+			elif x.name in _implementation_elements and not keep_implementations:
+				pass
 			else:
 				self.metadata.append(x)
 
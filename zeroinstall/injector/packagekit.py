@@ -27,10 +27,13 @@ except Exception as ex:
 MAX_PACKAGE_KIT_TRANSACTION_SIZE = 100
 
 class PackageKit(object):
-	def __init__(self):
+	def __init__(self, cache = None):
+		"""@param cache: where to remember candidates between runs (since 2.6)
+		@type cache: L{distro.CandidateCache} | None"""
 		self._pk = False
 
 		self._candidates = {}	# { package_name : [ (version, arch, size) ] | Blocker }
+		self._cache = cache
 
 		# PackageKit is really slow at handling separate queries, so we use this to
 		# batch them up.
@@ -67,7 +70,9 @@ class PackageKit(object):
 		@type prefix: str"""
 		candidates = self._candidates.get(package_name, None)
 		if candidates is None:
-			return
+			candidates = self._load_cached(package_name)
+			if candidates is None:
+				return
 
 		if isinstance(candidates, tasks.Blocker):
 			return		# Fetch still in progress
@@ -112,13 +117,35 @@ class PackageKit(object):
 			yield in_progress
 			in_progress = [b for b in in_progress if not b.happened]
 
+	def _load_cached(self, package_name):
+		"""Add the candidates for package_name saved by a previous process (if any) to self._candidates.
+		@type package_name: str
+		@return: the candidates, or None if we don't know"""
+		if self._cache is None:
+			return None
+		candidates = self._cache.get_candidates(package_name)
+		if candidates is not None:
+			self._candidates[package_name] = candidates
+		return candidates
+
+	def _save_cached(self, package_names):
+		"""Remember the results of a completed query for the next process.
+		@type package_names: [str]"""
+		if self._cache is None:
+			return
+		for package_name in package_names:
+			candidates = self._candidates.get(package_name, None)
+			if not isinstance(candidates, list):
+				candidates = []		# Not found
+			self._cache.put_candidates(package_name, candidates)
+
 	def _fetch_batch(self, package_names):
 		"""Ensure that each of these packages is in self._candidates.
 		Start a new fetch if necessary. Ignore packages that are already downloaded or
 		in the process of being downloaded."""
 		# (do we need a 'force' argument here?)
 
-		package_names = [n for n in package_names if n not in self._candidates]
+		package_names = [n for n in package_names if n not in self._candidates and self._load_cached(n) is None]
 
 		def do_batch(package_names):
 			#_logger_pk.info("sending %d packages in batch", len(package_names))
@@ -153,6 +180,7 @@ class PackageKit(object):
 							self._candidates[info['name']].append(info)
 					else:
 						_logger_pk.info(_('Empty details for %s'), packagekit_id)
+				self._save_cached(package_names)
 				blocker.trigger()
 
 			def resolve_cb(sender):
@@ -169,6 +197,7 @@ class PackageKit(object):
 					tran.proxy.GetDetails(list(versions.keys()))
 				else:
 					_logger_pk.info(_('Empty resolve for %s'), package_names)
+					self._save_cached(package_names)
 					blocker.trigger()
 
 			# Send queries
@@ -11,9 +11,18 @@ from xml.parsers import expat
 
 import zeroinstall
 from zeroinstall.injector import versions
+from zeroinstall.support import memoize
 
 _parsed_version = versions.parse_version(zeroinstall.version)
 
+@memoize(256)
+def _matches_our_version(expr):
+	"""Check whether our version is in the if-0install-version range expr.
+	Feeds tend to use the same few expressions over and over, so we remember the answers.
+	@type expr: str
+	@rtype: bool"""
+	return versions.parse_version_expression(expr)(_parsed_version)
+
 class Element(object):
 	"""An XML element.
 	@ivar uri: the element's namespace
@@ -79,40 +88,69 @@ class QSAXhandler(object):
 		@type filter_for_version: bool
 		@rtype: bool"""
 		self.stack = []
+		self.contents = []
+		self._names = {}		# fullname -> (uri, localName), so each name is only split (and stored) once
 		if filter_for_version:
-			self.filter_range = lambda expr: versions.parse_version_expression(expr)(_parsed_version)
+			self.filter_range = _matches_our_version
 		else:
 			self.filter_range = lambda x: True
 	
 	def startElementNS(self, fullname, attrs):
 		"""@type fullname: str
+		@param attrs: the attributes (we keep this dict, rather than copying it)
 		@type attrs: {str: str}"""
-		split = fullname.split(' ', 1)
-		if len(split) == 2:
-			self.stack.append(Element(split[0], split[1], attrs))
-		else:
-			self.stack.append(Element(None, fullname, attrs))
-		self.contents = ''
+		names = self._names.get(fullname, None)
+		if names is None:
+			split = fullname.split(' ', 1)
+			if len(split) == 2:
+				names = self._names[fullname] = (split[0], split[1])
+			else:
+				names = self._names[fullname] = (None, fullname)
+
+		new = Element.__new__(Element)
+		new.uri, new.name = names
+		new.attrs = attrs
+		new.content = None
+		new.childNodes = []
+		self.stack.append(new)
+		del self.contents[:]
 	
 	def characters(self, data):
 		"""@type data: str"""
-		self.contents += data
+		self.contents.append(data)
 	
 	def endElementNS(self, name):
 		"""@type name: str"""
-		contents = self.contents.strip()
-		self.stack[-1].content = contents
-		self.contents = ''
 		new = self.stack.pop()
+		new.content = ''.join(self.contents).strip()
+		del self.contents[:]
 		if self.stack:
 			target_versions = new.attrs.get('if-0install-version')
 			if target_versions and not self.filter_range(target_versions):
 				return
 
-			self.stack[-1].childNodes.append(new)
+			self.add_child(new)
 		else:
 			self.doc = new
 
+	def add_child(self, new):
+		"""Called when an element (other than the root) is complete.
+		@type new: L{Element}
+		@since: 2.6"""
+		self.stack[-1].childNodes.append(new)
+
+class _StreamingHandler(QSAXhandler):
+	"""Collects the root's children in self.completed, instead of adding them to the root."""
+	def __init__(self, filter_for_version):
+		QSAXhandler.__init__(self, filter_for_version)
+		self.completed = []
+
+	def add_child(self, new):
+		if len(self.stack) == 1:
+			self.completed.append(new)
+		else:
+			self.stack[-1].childNodes.append(new)
+
 def parse(source, filter_for_version = False):
 	"""Parse an XML stream into a tree of L{Element}s.
 	@param source: data to parse
@@ -123,6 +161,7 @@ def parse(source, filter_for_version = False):
 	@rtype: L{Element}"""
 	handler = QSAXhandler(filter_for_version)
 	parser = expat.ParserCreate(namespace_separator = ' ')
+	parser.buffer_text = True
 
 	parser.StartElementHandler = handler.startElementNS
 	parser.EndElementHandler = handler.endElementNS
@@ -131,6 +170,66 @@ def parse(source, filter_for_version = False):
 	parser.ParseFile(source)
 	return handler.doc
 
+def iterparse(source, filter_for_version = False, chunk_size = 64 * 1024):
+	"""Parse an XML stream incrementally.
+	The first item is the root element, which will not have any children. Each child of the root
+	is then returned as soon as it is complete. Children are not added to the root, so each one can be
+	freed once the caller has finished with it, and parsing a large document doesn't need memory
+	for the whole tree.
+	@param source: data to parse
+	@type source: file
+	@param filter_for_version: skip elements if their if-0install-version attribute doesn't match L{zeroinstall.version}
+	@type filter_for_version: bool
+	@rtype: iterable(L{Element})
+	@since: 2.6"""
+	handler = _StreamingHandler(filter_for_version)
+	parser = expat.ParserCreate(namespace_separator = ' ')
+	parser.buffer_text = True
+
+	parser.StartElementHandler = handler.startElementNS
+	parser.EndElementHandler = handler.endElementNS
+	parser.CharacterDataHandler = handler.characters
+
+	root = None
+	while True:
+		data = source.read(chunk_size)
+		parser.Parse(data, not data)
+
+		if root is None:
+			if handler.stack:
+				root = handler.stack[0]
+			elif not data:
+				root = handler.doc
+			else:
+				continue
+			yield root
+
+		completed = handler.completed
+		handler.completed = []
+		for child in completed:
+			yield child
+		del completed
+
+		if not data:
+			break
+
+def freeze(element):
+	"""Convert an element to nested tuples of strings, dicts and tuples, suitable for marshal.
+	@type element: L{Element}
+	@see: L{thaw}
+	@since: 2.6"""
+	return (element.uri, element.name, element.attrs, element.content,
+		tuple(freeze(child) for child in element.childNodes))
+
+def thaw(data):
+	"""Recreate an element from the output of L{freeze}.
+	@rtype: L{Element}
+	@since: 2.6"""
+	element = Element.__new__(Element)
+	element.uri, element.name, element.attrs, element.content, children = data
+	element.childNodes = [thaw(child) for child in children]
+	return element
+
 class Prefixes(object):
 	"""Keep track of namespace prefixes. Used when serialising a document.
 	@since: 0.54
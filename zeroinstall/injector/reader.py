@@ -5,64 +5,318 @@ Parses an XML feed into a Python representation. You should probably use L{iface
 # Copyright (C) 2009, Thomas Leonard
 # See the README file for details, or visit http://0install.net.
 
+import zeroinstall
 from zeroinstall import _, logger
 import os
 import errno
+import hashlib
+import json
+import marshal
+import sys
 
-from zeroinstall.support import basedir
+from zeroinstall.support import basedir, portable_rename
 from zeroinstall.injector import qdom
-from zeroinstall.injector.namespaces import config_site
+from zeroinstall.injector.namespaces import config_site, config_prog
 from zeroinstall.injector.model import InvalidInterface, ZeroInstallFeed, escape
 
+# Change this if the contents of the parse cache change
+_PARSE_CACHE_FORMAT = 2
+
+# How often to remove cached information about deleted feeds (in seconds)
+PRUNE_INTERVAL = 60 * 60 * 24
+
 class MissingLocalFeed(InvalidInterface):
 	pass
 
-def load_feed_from_cache(url):
+def find_cached_feeds(urls):
+	"""Find the cached copies of several feeds at once. This gives the same results as
+	L{load_feed_from_cache}'s search, but lists each cache directory just once rather than
+	checking for each feed separately.
+	@type urls: [str]
+	@return: the path to load each feed from (the URL itself for local feeds), or None if it isn't cached
+	@rtype: {str: str | None}
+	@since: 2.6"""
+	results = {}
+	remote = {}
+	for url in urls:
+		if os.path.isabs(url):
+			results[url] = url
+		else:
+			remote[escape(url)] = url
+	for cache_dir in basedir.load_cache_paths(config_site, 'interfaces'):
+		if not remote:
+			break
+		try:
+			leaves = os.listdir(cache_dir)
+		except OSError as ex:
+			logger.warning("Failed to list %s: %s", cache_dir, ex)
+			continue
+		for leaf in leaves:
+			url = remote.pop(leaf, None)
+			if url is not None:
+				results[url] = os.path.join(cache_dir, leaf)
+	for url in remote.values():
+		results[url] = None
+	return results
+
+def load_feed_from_cache(url, lazy = False, cached = None):
 	"""Load a feed. If the feed is remote, load from the cache. If local, load it directly.
 	@type url: str
+	@param lazy: return a L{LazyZeroInstallFeed} (since 2.6)
+	@type lazy: bool
+	@param cached: the cached copy of a remote feed, if already known (e.g. from L{find_cached_feeds}) (since 2.6)
+	@type cached: str | None
 	@return: the feed, or None if it's remote and not cached.
 	@rtype: L{ZeroInstallFeed} | None"""
 	try:
 		if os.path.isabs(url):
 			logger.debug(_("Loading local feed file '%s'"), url)
-			return load_feed(url, local = True)
+			return load_feed(url, local = True, lazy = lazy)
 		else:
-			cached = basedir.load_first_cache(config_site, 'interfaces', escape(url))
+			if cached is None:
+				cached = basedir.load_first_cache(config_site, 'interfaces', escape(url))
 			if cached:
 				logger.debug(_("Loading cached information for %(interface)s from %(cached)s"), {'interface': url, 'cached': cached})
-				return load_feed(cached, local = False)
+				return load_feed(cached, local = False, lazy = lazy)
 			else:
 				return None
 	except InvalidInterface as ex:
 		ex.feed_url = url
 		raise
 
-def load_feed(source, local = False):
+def load_feed(source, local = False, lazy = False, streaming = False):
 	"""Load a feed from a local file.
 	@param source: the name of the file to read
 	@type source: str
 	@param local: this is a local feed
 	@type local: bool
+	@param lazy: return a L{LazyZeroInstallFeed} (since 2.6)
+	@type lazy: bool
+	@param streaming: use L{ZeroInstallFeed.from_stream}, which uses less memory but doesn't keep the
+	implementations or the children of L{ZeroInstallFeed.feed_element} (since 2.6)
+	@type streaming: bool
 	@return: the new feed
 	@rtype: L{ZeroInstallFeed}
 	@raise InvalidInterface: if the source's syntax is incorrect
 	@since: 0.48
 	@see: L{iface_cache.iface_cache}, which uses this to load the feeds"""
+	if local:
+		assert os.path.isabs(source), source
+		local_path = source
+	else:
+		local_path = None
+
+	if lazy:
+		return LazyZeroInstallFeed(source, local_path)
+
+	if streaming:
+		with _open_feed(source, local) as stream:
+			feed = ZeroInstallFeed.from_stream(_parse_stream(stream), local_path)
+	else:
+		feed = ZeroInstallFeed(_parse_cached(source, local), local_path)
+	feed.last_modified = int(os.stat(source).st_mtime)
+	return feed
+
+def _open_feed(source, local):
 	try:
-		with open(source, 'rb') as stream:
-			root = qdom.parse(stream, filter_for_version = True)
+		return open(source, 'rb')
 	except IOError as ex:
 		if ex.errno == errno.ENOENT and local:
 			raise MissingLocalFeed(_("Feed not found. Perhaps this is a local feed that no longer exists? You can remove it from the list of feeds in that case."))
 		raise InvalidInterface(_("Can't read file"), ex)
+
+def _parse(stream):
+	"""Parse the whole of stream with L{qdom.parse}, reporting errors as L{InvalidInterface}.
+	@rtype: L{qdom.Element}"""
+	try:
+		return qdom.parse(stream, filter_for_version = True)
+	except IOError as ex:
+		raise InvalidInterface(_("Can't read file"), ex)
 	except Exception as ex:
 		raise InvalidInterface(_("Invalid XML"), ex)
 
-	if local:
-		assert os.path.isabs(source), source
-		local_path = source
-	else:
-		local_path = None
-	feed = ZeroInstallFeed(root, local_path)
-	feed.last_modified = int(os.stat(source).st_mtime)
-	return feed
+def _parse_stream(stream):
+	"""Parse stream with L{qdom.iterparse}, reporting errors as L{InvalidInterface}."""
+	try:
+		for elem in qdom.iterparse(stream, filter_for_version = True):
+			yield elem
+	except IOError as ex:
+		raise InvalidInterface(_("Can't read file"), ex)
+	except Exception as ex:
+		raise InvalidInterface(_("Invalid XML"), ex)
+
+def _cache_name(source):
+	"""The name to use for cached information about source.
+	@rtype: str"""
+	return hashlib.sha1(os.path.abspath(source).encode('utf-8')).hexdigest()
+
+def _parse_cached(source, local):
+	"""Parse source with L{_parse}, using the parse cache if possible.
+	The parse cache (in ~/.cache/0install.net/injector/parsed-feeds) holds the whole tree, as a
+	marshalled L{qdom.freeze} tuple, which loads about twice as fast as parsing the XML.
+	Entries are only used if the feed's path, mtime and size, and our version, haven't changed.
+	@rtype: L{qdom.Element}"""
+	cache_dir = basedir.save_cache_path(config_site, config_prog, 'parsed-feeds')
+	cache_path = os.path.join(cache_dir, _cache_name(source))
+	key = None
+	try:
+		info = os.stat(source)
+		key = (_PARSE_CACHE_FORMAT, os.path.abspath(source), int(info.st_mtime), info.st_size,
+		       zeroinstall.version, tuple(sys.version_info[:2]))
+		with open(cache_path, 'rb') as stream:
+			if marshal.load(stream) != key:
+				raise Exception("out-of-date")
+			return qdom.thaw(marshal.load(stream))
+	except Exception as ex:
+		logger.debug("Not using parse cache for %s (%s)", source, ex)
+
+	with _open_feed(source, local) as stream:
+		root = _parse(stream)
+
+	if key is not None:
+		try:
+			import tempfile
+			with tempfile.NamedTemporaryFile(mode = 'wb', dir = cache_dir, delete = False) as tmp:
+				tmp.write(marshal.dumps(key))		# (separately, so that prune_feed_caches can read just this)
+				tmp.write(marshal.dumps(qdom.freeze(root)))
+			portable_rename(tmp.name, cache_path)
+		except Exception as ex:
+			logger.warning("Failed to write parse cache for %s: %s", source, ex)
+		else:
+			_maybe_prune()
+	return root
+
+def forget_feed(source):
+	"""Remove anything we cached about the feed file source (see L{load_feed}).
+	Call this after deleting a feed.
+	@type source: str
+	@since: 2.6"""
+	name = _cache_name(source)
+	for leaf in ('parsed-feeds', 'feed-headers'):
+		for cache_dir in basedir.load_cache_paths(config_site, config_prog, leaf):
+			try:
+				os.unlink(os.path.join(cache_dir, name))
+			except OSError as ex:
+				if ex.errno != errno.ENOENT:
+					logger.warning("Failed to remove cached copy of %s: %s", source, ex)
+
+def _get_parse_cache_source(path):
+	"""@return: the feed file for a parse cache entry, and its mtime and size"""
+	with open(path, 'rb') as stream:
+		key = marshal.load(stream)
+	return key[1], key[2], key[3]
+
+def _get_header_source(path):
+	"""@return: the feed file for a header sidecar, and its mtime and size"""
+	with open(path, 'rt') as stream:
+		header = json.load(stream)
+	return header['path'], header['key']['mtime'], header['key']['size']
+
+def prune_feed_caches():
+	"""Remove cached information about feed files which have since been changed or deleted.
+	Entries for changed feeds would be replaced on the next load anyway, but nothing else removes
+	the entries for deleted feeds. This is done automatically every L{PRUNE_INTERVAL} seconds.
+	@since: 2.6"""
+	for leaf, get_source in [('parsed-feeds', _get_parse_cache_source), ('feed-headers', _get_header_source)]:
+		for cache_dir in basedir.load_cache_paths(config_site, config_prog, leaf):
+			for name in os.listdir(cache_dir):
+				if len(name) != 40:
+					continue		# (not an entry; e.g. a temporary file being written)
+				path = os.path.join(cache_dir, name)
+				try:
+					source, mtime, size = get_source(path)
+					info = os.stat(source)
+					if (int(info.st_mtime), info.st_size) == (mtime, size):
+						continue
+				except Exception as ex:
+					logger.debug("Removing %s (%s)", path, ex)
+				try:
+					os.unlink(path)
+				except OSError as ex:
+					logger.warning("Failed to remove %s: %s", path, ex)
+
+def _maybe_prune():
+	"""Call L{prune_feed_caches} if we haven't done so for L{PRUNE_INTERVAL} seconds."""
+	import time
+	stamp = os.path.join(basedir.save_cache_path(config_site, config_prog, 'parsed-feeds'), '.last-pruned')
+	try:
+		if os.stat(stamp).st_mtime > time.time() - PRUNE_INTERVAL:
+			return
+	except OSError:
+		pass
+	try:
+		open(stamp, 'wb').close()
+		os.utime(stamp, None)
+		prune_feed_caches()
+	except Exception as ex:
+		logger.warning("Failed to prune feed caches: %s", ex)
+
+class LazyZeroInstallFeed(ZeroInstallFeed):
+	"""A feed which only loads its header (url, name and summaries) at first.
+	The rest of the feed is parsed the first time any other attribute is needed.
+	The header is saved in a small sidecar file in the cache, so next time we don't need to
+	parse the XML at all unless the rest of the feed is used. Even then, we can usually load the
+	elements from the parse cache instead.
+	@since: 2.6"""
+	__slots__ = ['_source', '_loaded']
+
+	_header_fields = ['url', 'name', 'summaries', 'first_summary']
+
+	def __init__(self, source, local_path):
+		"""@param source: the file to load
+		@type source: str
+		@type local_path: str | None
+		@raise InvalidInterface: if the header can't be loaded"""
+		self._source = source
+		self._loaded = False
+		self.local_path = local_path
+
+		try:
+			info = os.stat(source)
+		except OSError as ex:
+			_open_feed(source, local_path is not None)		# (raises a suitable exception)
+			raise InvalidInterface(_("Can't read file"), ex)
+		self.last_modified = int(info.st_mtime)
+
+		sidecar = os.path.join(basedir.save_cache_path(config_site, config_prog, 'feed-headers'), _cache_name(source))
+		key = {'mtime': int(info.st_mtime), 'size': info.st_size, 'version': zeroinstall.version}
+		try:
+			with open(sidecar, 'rt') as stream:
+				header = json.load(stream)
+			if header.get('key') != key:
+				raise Exception("out-of-date")
+			for field in self._header_fields:
+				setattr(self, field, header[field])
+			return
+		except Exception as ex:
+			logger.debug("No header cache for %s (%s)", source, ex)
+
+		# Do a full parse, which also checks that the feed is valid
+		self._load_full()
+
+		header = {'key': key, 'path': os.path.abspath(source)}
+		for field in self._header_fields:
+			header[field] = getattr(self, field)
+		try:
+			import tempfile
+			with tempfile.NamedTemporaryFile(mode = 'wt', dir = os.path.dirname(sidecar), delete = False) as tmp:
+				json.dump(header, tmp)
+			portable_rename(tmp.name, sidecar)
+		except Exception as ex:
+			logger.warning("Failed to write feed header cache %s: %s", sidecar, ex)
+
+	def _load_full(self):
+		# Load into a separate object, so that we're unchanged if it fails
+		feed = ZeroInstallFeed(_parse_cached(self._source, self.local_path is not None), self.local_path)
+		for name in ZeroInstallFeed.__slots__:
+			if name != 'last_modified' and hasattr(feed, name):
+				setattr(self, name, getattr(feed, name))
+		self._loaded = True
+
+	def __getattr__(self, name):
+		# Only called for attributes which haven't been set yet
+		if name not in ZeroInstallFeed.__slots__ or self._loaded:
+			raise AttributeError(name)
+		logger.debug("Loading the rest of %s to get %s", self._source, name)
+		self._load_full()
+		return getattr(self, name)
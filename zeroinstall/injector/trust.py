@@ -22,12 +22,14 @@ class TrustDB(object):
 	@type keys: {str: set(str)}
 	@ivar watchers: callbacks invoked by L{notify}
 	@see: L{trust_db} - the singleton instance of this class"""
-	__slots__ = ['keys', 'watchers', '_dry_run']
+	__slots__ = ['keys', 'watchers', '_dry_run', '_domains', '_stamp']
 
 	def __init__(self):
 		self.keys = None
 		self.watchers = []
 		self._dry_run = False
+		self._domains = {}	# Domain -> set of fingerprints (inverse of keys)
+		self._stamp = False	# Path, inode, mtime and size of the file we loaded keys from
 	
 	def is_trusted(self, fingerprint, domain = None):
 		"""@type fingerprint: str
@@ -58,35 +60,50 @@ class TrustDB(object):
 		@rtype: {str}
 		@since: 0.27"""
 		self.ensure_uptodate()
-		return set([fp for fp in self.keys
-				 if domain in self.keys[fp]])
+		return set(self._domains.get(domain, ()))
 
 	def ensure_uptodate(self):
+		"""Load the database, unless the file hasn't changed since last time."""
 		if self._dry_run:
 			if self.keys is None: self.keys = {}
 			return
-		from xml.dom import minidom
-
-		# This is a bit inefficient... (could cache things)
-		self.keys = {}
 
 		trust = basedir.load_first_config(config_site, config_prog, 'trustdb.xml')
-		if trust:
-			keys = minidom.parse(trust).documentElement
-			for key in keys.getElementsByTagNameNS(XMLNS_TRUST, 'key'):
-				domains = set()
-				self.keys[key.getAttribute('fingerprint')] = domains
-				for domain in key.getElementsByTagNameNS(XMLNS_TRUST, 'domain'):
-					domains.add(domain.getAttribute('value'))
-		else:
+		old_format = False
+		if not trust:
 			# Convert old database to XML format
 			trust = basedir.load_first_config(config_site, config_prog, 'trust')
-			if trust:
-				#print "Loading trust from", trust_db
-				with open(trust, 'rt') as stream:
-					for key in stream:
-						if key:
-							self.keys[key] = set(['*'])
+			old_format = True
+
+		stamp = None
+		if trust:
+			info = os.stat(trust)
+			stamp = (trust, info.st_ino, info.st_mtime, info.st_size)
+		if stamp == self._stamp and self.keys is not None:
+			return
+
+		keys = {}
+		if trust and not old_format:
+			from zeroinstall.injector import qdom
+			with open(trust, 'rb') as stream:
+				root = qdom.parse(stream)
+			for key in root.childNodes:
+				if key.uri != XMLNS_TRUST or key.name != 'key': continue
+				keys[key.getAttribute('fingerprint')] = set(domain.getAttribute('value') for domain in key.childNodes
+									 if domain.uri == XMLNS_TRUST and domain.name == 'domain')
+		elif trust:
+			#print "Loading trust from", trust_db
+			with open(trust, 'rt') as stream:
+				for key in stream:
+					if key:
+						keys[key] = set(['*'])
+
+		self._domains = {}
+		for fingerprint, domains in keys.items():
+			for domain in domains:
+				self._domains.setdefault(domain, set()).add(fingerprint)
+		self.keys = keys
+		self._stamp = stamp
 
 def domain_from_url(url):
 	"""Extract the trust domain for a URL.
@@ -8,6 +8,7 @@
 import re
 
 from zeroinstall import SafeException, _
+from zeroinstall.support import memoize
 
 _version_mod_to_value = {
 	'pre': -2,
@@ -57,11 +58,12 @@ def parse_version(version_string):
 		raise SafeException(_("Invalid version modifier in '%(version_string)s': %(exception)s") % {'version_string': version_string, 'exception': str(ex).strip("u")})
 
 def format_version(version):
-	"""Format a parsed version for display. Undoes the effect of L{parse_version}.
+	"""Format a parsed version for display. Undoes the effect of L{parse_version}
+	(or L{parse_compact_version}).
 	@rtype: str
 	@see: L{model.Implementation.get_version}
 	@since: 0.24"""
-	version = version[:]
+	version = list(version)
 	l = len(version)
 	for x in range(0, l, 2):
 		version[x] = '.'.join(map(str, version[x]))
@@ -70,48 +72,102 @@ def format_version(version):
 	if version[-1] == '-': del version[-1]
 	return ''.join(version)
 
+def compact_version(parsed):
+	"""Convert a version from L{parse_version} to the compact form returned by L{parse_compact_version}.
+	@rtype: tuple"""
+	if parsed is None: return None
+	return tuple(tuple(part) if type(part) is list else part for part in parsed)
 
-def parse_version_range(r):
-	"""Parse a range expression.
-	@param r: the range expression
-	@type r: str
-	@return: a function which returns whether a parsed version is in the range
-	@rtype: parsed_version -> bool
-	@since: 1.13"""
+@memoize(4096)
+def parse_compact_version(version_string):
+	"""Like L{parse_version}, but returns an immutable (and hashable) nested tuple,
+	such as ((1, 0), -2, (5,), 0) for "1.0-pre5". These sort in the same order as the lists
+	from L{parse_version}, but the two forms can't be compared with each other.
+	Results are memoized, so parsing the same string again returns the same object.
+	@type version_string: str
+	@rtype: tuple
+	@raise SafeException: if the string isn't a valid version
+	@since: 2.6"""
+	return compact_version(parse_version(version_string))
+
+@memoize(256)
+def _compile_range(r):
+	"""Lower a range expression to precomputed bounds.
+	@return: ('=', version, None), ('!', version, None) or ('..', start, end), using compact versions
+	@rtype: (str, tuple, tuple)"""
 	parts = r.split('..', 1)
 	if len(parts) == 1:
 		if r.startswith('!'):
-			v = parse_version(r[1:])
-			return lambda x: x != v
+			return ('!', parse_compact_version(r[1:]), None)
 		else:
-			v = parse_version(r)
-			return lambda x: x == v
+			return ('=', parse_compact_version(r), None)
 
 	start, end = parts
 	if start:
-		start = parse_version(start)
+		start = parse_compact_version(start)
 	else:
 		start = None
 	if end:
 		if not end.startswith('!'):
 			raise SafeException("End of range must be exclusive (use '..!{end}', not '..{end}')".format(end = end))
-		end = parse_version(end[1:])
+		end = parse_compact_version(end[1:])
 	else:
 		end = None
+	return ('..', start, end)
+
+@memoize(256)
+def _compile_expression(expr):
+	"""@rtype: ((str, tuple, tuple))"""
+	return tuple(_compile_range(r.strip()) for r in expr.split('|'))
 
-	def test(v):
-		if start is not None and v < start: return False
-		if end is not None and v >= end: return False
-		return True
+def _list_version(compact):
+	"""@rtype: list | None"""
+	if compact is None:
+		return None
+	return [list(part) if type(part) is tuple else part for part in compact]
 
-	return test
+@memoize(256)
+def _list_ranges(ranges):
+	"""The same bounds, but in the list form from L{parse_version}. Versions can then be
+	tested in whichever form they come, without converting each one.
+	@param ranges: bounds from L{_compile_range}"""
+	return tuple((kind, _list_version(start), _list_version(end)) for kind, start, end in ranges)
+
+def _make_test(ranges):
+	"""@param ranges: bounds from L{_compile_range}
+	@rtype: parsed_version -> bool"""
+	list_ranges = _list_ranges(ranges)
+	return lambda v: _in_ranges(ranges if type(v) is tuple else list_ranges, v)
+
+def _in_ranges(ranges, v):
+	"""@param ranges: bounds from L{_compile_range}
+	@param v: a version, in the same form as the bounds"""
+	for kind, start, end in ranges:
+		if kind == '..':
+			if (start is None or v >= start) and (end is None or v < end):
+				return True
+		elif kind == '=':
+			if v == start: return True
+		elif v != start:
+			return True
+	return False
+
+def parse_version_range(r):
+	"""Parse a range expression.
+	Compiled ranges are cached, so parsing the same expression again is cheap.
+	@param r: the range expression
+	@type r: str
+	@return: a function which returns whether a parsed (or compact) version is in the range
+	@rtype: parsed_version -> bool
+	@since: 1.13"""
+	return _make_test((_compile_range(r),))
 
 def parse_version_expression(expr):
 	"""Parse an expression of the form "RANGE | RANGE | ...".
+	Compiled expressions are cached, so parsing the same expression again is cheap.
 	@param expr: the expression to parse
 	@type expr: str
-	@return: a function which tests whether a parsed version is in the range
+	@return: a function which tests whether a parsed (or compact) version is in the range
 	@rtype: parsed_version -> bool
 	@since: 1.13"""
-	tests = [parse_version_range(r.strip()) for r in expr.split('|')]
-	return lambda v: any(test(v) for test in tests)
+	return _make_test(_compile_expression(expr))
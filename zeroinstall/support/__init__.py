@@ -13,6 +13,10 @@ wish were in the standard library.
 from zeroinstall import _, logger
 import sys, os
 
+# (Python 3.3+, not on Windows)
+_readv = getattr(os, 'readv', None)
+_writev = getattr(os, 'writev', None)
+
 def find_in_path(prog):
 	"""Search $PATH for prog.
 	If prog is an absolute path, return it unmodified.
@@ -32,6 +36,8 @@ def find_in_path(prog):
 
 def read_bytes(fd, nbytes, null_ok = False):
 	"""Read exactly nbytes from fd.
+	If the data doesn't arrive all at once, the rest is read directly into a single
+	preallocated buffer (using readv where available).
 	@param fd: file descriptor to read from
 	@type fd: int
 	@param nbytes: number of bytes to read
@@ -41,19 +47,57 @@ def read_bytes(fd, nbytes, null_ok = False):
 	@return: the bytes read
 	@rtype: bytes
 	@raise Exception: if we received less than nbytes of data"""
-	data = b''
-	while nbytes:
-		got = os.read(fd, nbytes)
-		if not got:
-			if null_ok and not data:
-				return None
-			raise Exception(_("Unexpected end-of-stream. Data so far %(data)s; expecting %(bytes)d bytes more.")
-					% {'data': repr(data), 'bytes': nbytes})
-		data += got
-		nbytes -= len(got)
+	data = os.read(fd, nbytes) if nbytes else b''
+	pos = len(data)
+	if pos < nbytes:
+		if not data and null_ok:
+			return None
+		buf = bytearray(nbytes)
+		view = memoryview(buf)
+		view[:pos] = data
+		while pos < nbytes:
+			if _readv:
+				got = _readv(fd, [view[pos:]])
+			else:
+				chunk = os.read(fd, nbytes - pos)
+				got = len(chunk)
+				view[pos:pos + got] = chunk
+			if not got:
+				if null_ok and not pos:
+					return None
+				raise Exception(_("Unexpected end-of-stream. Data so far %(data)s; expecting %(bytes)d bytes more.")
+						% {'data': repr(bytes(buf[:pos])), 'bytes': nbytes - pos})
+			pos += got
+		data = bytes(buf)
 	logger.debug(_("Message received: %r"), data)
 	return data
 
+def write_all(fd, chunks):
+	"""Write all of these byte strings to fd, in order.
+	Small messages are joined and sent with one write. Large ones are sent with writev
+	where possible, to avoid copying them.
+	@param fd: file descriptor to write to
+	@type fd: int
+	@type chunks: [bytes]
+	@since: 2.6"""
+	if not _writev or sum(len(chunk) for chunk in chunks) < 0x10000:
+		chunks = [b''.join(chunks)]
+		sent = os.write(fd, chunks[0])
+		if sent == len(chunks[0]):
+			return
+		chunks[0] = memoryview(chunks[0])[sent:]
+	views = [memoryview(chunk) for chunk in chunks if len(chunk)]
+	while views:
+		if _writev:
+			sent = _writev(fd, views)
+		else:
+			sent = os.write(fd, views[0])
+		while views and sent >= len(views[0]):
+			sent -= len(views[0])
+			del views[0]
+		if sent:
+			views[0] = views[0][sent:]
+
 def pretty_size(size):
 	"""Format a size for printing.
 	@param size: the size in bytes
@@ -116,6 +160,45 @@ def portable_rename(src, dst):
 		os.unlink(dst)
 	os.rename(src, dst)
 
+def memoize(maxsize):
+	"""Decorator for a function of one (hashable) argument, which remembers the results
+	of about the last maxsize calls. Uses functools.lru_cache when available. Otherwise, we keep
+	two generations of results, discarding the older one when the newer one fills up, which
+	approximates LRU without the cost of tracking the order of every access.
+	@type maxsize: int
+	@since: 2.6"""
+	try:
+		from functools import lru_cache
+	except ImportError:
+		lru_cache = None
+	if lru_cache is not None:
+		return lru_cache(maxsize = maxsize)
+
+	def decorator(fn):
+		generations = [{}, {}]		# Recent results, older results
+		def wrapper(arg):
+			recent = generations[0]
+			try:
+				return recent[arg]
+			except KeyError:
+				pass
+			try:
+				result = generations[1][arg]
+			except KeyError:
+				result = fn(arg)
+			if len(recent) >= maxsize // 2:
+				generations[1] = recent
+				generations[0] = recent = {}
+			recent[arg] = result
+			return result
+		def cache_clear():
+			generations[:] = [{}, {}]
+		wrapper.cache_clear = cache_clear
+		wrapper.__name__ = fn.__name__
+		wrapper.__doc__ = fn.__doc__
+		return wrapper
+	return decorator
+
 if sys.version_info[0] > 2:
 	# Python 3
 	unicode = str
@@ -14,7 +14,7 @@ instead.
 # See the README file for details, or visit http://0install.net.
 
 from zeroinstall import _, logger
-import os
+import os, threading
 
 home = os.environ.get('HOME', '/')
 
@@ -86,6 +86,90 @@ xdg_data_home = xdg_data_dirs[0]
 xdg_cache_home = xdg_cache_dirs[0]
 xdg_config_home = xdg_config_dirs[0]
 
+# To avoid checking for each file separately, the load_* functions can use a cached listing of
+# each file's directory, and save_*_path can remember which directories exist. This is only
+# done inside a L{cached_listings} block, which should be short (e.g. handling one request),
+# as other processes may change things at any time. Within a block, call invalidate after
+# creating or deleting files, so that we notice our own changes.
+_lock = threading.Lock()
+_listings = {}		# Directory -> frozenset of leafnames
+_known_dirs = set()	# Directories known to exist
+_scope = threading.local()
+
+def cached_listings():
+	"""Cache directory listings until the end of the with block, in this thread. Blocks may be nested.
+	@since: 2.6"""
+	return _CachedListings()
+
+class _CachedListings(object):
+	def __enter__(self):
+		_scope.depth = getattr(_scope, 'depth', 0) + 1
+
+	def __exit__(self, exc_type, exc_value, tb):
+		_scope.depth -= 1
+		if not _scope.depth:
+			invalidate()
+
+def _exists(path):
+	"""Like os.path.exists, but using the cached listing of path's directory in a L{cached_listings} block.
+	@type path: str
+	@rtype: bool"""
+	if not getattr(_scope, 'depth', 0):
+		return os.path.exists(path)
+	parent, leaf = os.path.split(path)
+	with _lock:
+		listing = _listings.get(parent, None)
+	if listing is None:
+		try:
+			listing = frozenset(os.listdir(parent))
+		except OSError:
+			return False		# (not cached; it may be created at any time)
+		with _lock:
+			_listings[parent] = listing
+	return leaf in listing
+
+def _ensure_dir(path):
+	"""@type path: str"""
+	cached = getattr(_scope, 'depth', 0)
+	if cached:
+		with _lock:
+			if path in _known_dirs:
+				return
+	if not os.path.isdir(path):
+		try:
+			os.makedirs(path, 0o700)
+		except OSError:
+			if not os.path.isdir(path):	# (another thread may have just created it)
+				raise
+		invalidate(path)
+	if cached:
+		with _lock:
+			_known_dirs.add(path)
+
+def invalidate(path = None):
+	"""Forget any cached information about path (and its parents) after creating or
+	deleting it, so that the load_* functions will notice the change.
+	If path is None, forget everything.
+	@type path: str | None
+	@since: 2.6"""
+	with _lock:
+		if path is None:
+			_listings.clear()
+			_known_dirs.clear()
+			return
+		path = path.rstrip(os.sep) or os.sep
+		prefix = path + os.sep
+		for d in [d for d in _known_dirs if d == path or d.startswith(prefix)]:
+			_known_dirs.discard(d)
+		for d in [d for d in _listings if d.startswith(prefix)]:
+			_listings.pop(d, None)
+		while True:
+			_listings.pop(path, None)
+			parent = os.path.dirname(path)
+			if parent == path:
+				break
+			path = parent
+
 def save_config_path(*resource):
 	"""Ensure $XDG_CONFIG_HOME/<resource>/ exists, and return its path.
 	'resource' should normally be the name of your application. Use this
@@ -95,8 +179,7 @@ def save_config_path(*resource):
 	resource = os.path.join(*resource)
 	assert not os.path.isabs(resource)
 	path = os.path.join(xdg_config_home, resource)
-	if not os.path.isdir(path):
-		os.makedirs(path, 0o700)
+	_ensure_dir(path)
 	return path
 
 def load_config_paths(*resource):
@@ -106,7 +189,7 @@ def load_config_paths(*resource):
 	resource = os.path.join(*resource)
 	for config_dir in xdg_config_dirs:
 		path = os.path.join(config_dir, resource)
-		if os.path.exists(path): yield path
+		if _exists(path): yield path
 
 def load_first_config(*resource):
 	"""Returns the first result from load_config_paths, or None if there is nothing
@@ -123,8 +206,7 @@ def save_cache_path(*resource):
 	resource = os.path.join(*resource)
 	assert not os.path.isabs(resource)
 	path = os.path.join(xdg_cache_home, resource)
-	if not os.path.isdir(path):
-		os.makedirs(path, 0o700)
+	_ensure_dir(path)
 	return path
 
 def load_cache_paths(*resource):
@@ -134,7 +216,7 @@ def load_cache_paths(*resource):
 	resource = os.path.join(*resource)
 	for cache_dir in xdg_cache_dirs:
 		path = os.path.join(cache_dir, resource)
-		if os.path.exists(path): yield path
+		if _exists(path): yield path
 
 def load_first_cache(*resource):
 	"""Returns the first result from load_cache_paths, or None if there is nothing
@@ -152,7 +234,7 @@ def load_data_paths(*resource):
 	resource = os.path.join(*resource)
 	for data_dir in xdg_data_dirs:
 		path = os.path.join(data_dir, resource)
-		if os.path.exists(path): yield path
+		if _exists(path): yield path
 
 def load_first_data(*resource):
 	"""Returns the first result from load_data_paths, or None if there is nothing
@@ -170,6 +252,5 @@ def save_data_path(*resource):
 	resource = os.path.join(*resource)
 	assert not os.path.isabs(resource)
 	path = os.path.join(xdg_data_home, resource)
-	if not os.path.isdir(path):
-		os.makedirs(path, 0o700)
+	_ensure_dir(path)
 	return path
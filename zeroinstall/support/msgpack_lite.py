@@ -0,0 +1,211 @@
+"""
+A small MessagePack encoder and decoder, for talking to the master process.
+
+Only the types used in slave messages are supported: None, booleans, integers,
+floats, text, bytes, lists (tuples are sent as lists) and dicts. L{qdom.Element}s
+are sent as extension type L{ELEMENT_EXT}, holding the array
+[uri, name, attrs, content, children], so the receiver doesn't need to parse any
+XML. A child's uri is nil if it is the same as its parent's.
+
+@see: U{http://msgpack.org/}
+@since: 2.6
+"""
+
+# Copyright (C) 2013, Thomas Leonard
+# See the README file for details, or visit http://0install.net.
+
+import struct, sys
+
+ELEMENT_EXT = 1
+
+if sys.version_info[0] > 2:
+	text_type = str
+	binary_type = bytes
+	int_types = (int,)
+else:
+	text_type = unicode
+	binary_type = bytearray		# (str is treated as text, as in our JSON messages)
+	int_types = (int, long)
+
+class DecodeError(Exception):
+	"""The data wasn't a valid message."""
+
+def packb(value):
+	"""Encode value.
+	@rtype: bytes"""
+	out = []
+	_pack(value, out.append)
+	return b''.join(out)
+
+def _pack_header(n, fix_base, fix_max, codes, write):
+	"""Write the header for a string, array or map with n items."""
+	if n <= fix_max:
+		write(struct.pack('B', fix_base | n))
+	elif n < 0x100 and codes[0] is not None:
+		write(struct.pack('>BB', codes[0], n))
+	elif n < 0x10000:
+		write(struct.pack('>BH', codes[1], n))
+	else:
+		write(struct.pack('>BI', codes[2], n))
+
+def _pack(value, write):
+	if value is None:
+		write(b'\xc0')
+	elif value is True:
+		write(b'\xc3')
+	elif value is False:
+		write(b'\xc2')
+	elif isinstance(value, int_types):
+		if 0 <= value < 0x80:
+			write(struct.pack('B', value))
+		elif -0x20 <= value < 0:
+			write(struct.pack('b', value))
+		elif 0 <= value < 0x10000000000000000:
+			write(struct.pack('>BQ', 0xcf, value))
+		elif -0x8000000000000000 <= value < 0:
+			write(struct.pack('>Bq', 0xd3, value))
+		else:
+			raise OverflowError("Integer too large to encode: %d" % value)
+	elif isinstance(value, float):
+		write(struct.pack('>Bd', 0xcb, value))
+	elif isinstance(value, (text_type, str)):
+		data = value.encode('utf-8') if isinstance(value, text_type) else value
+		_pack_header(len(data), 0xa0, 31, (0xd9, 0xda, 0xdb), write)
+		write(data)
+	elif isinstance(value, binary_type):
+		_pack_bin(bytes(value), write)
+	elif isinstance(value, (list, tuple)):
+		_pack_header(len(value), 0x90, 15, (None, 0xdc, 0xdd), write)
+		for item in value:
+			_pack(item, write)
+	elif isinstance(value, dict):
+		_pack_header(len(value), 0x80, 15, (None, 0xde, 0xdf), write)
+		for k, v in value.items():
+			_pack(k, write)
+			_pack(v, write)
+	else:
+		from zeroinstall.injector import qdom
+		if not isinstance(value, qdom.Element):
+			raise TypeError("Can't encode %r" % value)
+		data = packb(_element_fields(value, None))
+		write(struct.pack('>BIb', 0xc9, len(data), ELEMENT_EXT))
+		write(data)
+
+def _element_fields(element, parent_uri):
+	uri = element.uri
+	return [None if uri == parent_uri else uri, element.name, element.attrs, element.content,
+		[_element_fields(child, uri) for child in element.childNodes]]
+
+def _make_element(fields, parent_uri):
+	from zeroinstall.injector import qdom
+	element = qdom.Element.__new__(qdom.Element)
+	uri, element.name, element.attrs, element.content, children = fields
+	element.uri = parent_uri if uri is None else uri
+	element.childNodes = [_make_element(child, element.uri) for child in children]
+	return element
+
+def _pack_bin(data, write):
+	if len(data) < 0x100:
+		write(struct.pack('>BB', 0xc4, len(data)))
+	elif len(data) < 0x10000:
+		write(struct.pack('>BH', 0xc5, len(data)))
+	else:
+		write(struct.pack('>BI', 0xc6, len(data)))
+	write(data)
+
+# Code -> (struct format, size) for fixed-size values
+_fixed = {
+	0xca: ('>f', 4), 0xcb: ('>d', 8),
+	0xcc: ('>B', 1), 0xcd: ('>H', 2), 0xce: ('>I', 4), 0xcf: ('>Q', 8),
+	0xd0: ('>b', 1), 0xd1: ('>h', 2), 0xd2: ('>i', 4), 0xd3: ('>q', 8),
+}
+
+# Code -> (kind, size of the length field)
+_sized = {
+	0xd9: ('str', 1), 0xda: ('str', 2), 0xdb: ('str', 4),
+	0xc4: ('bin', 1), 0xc5: ('bin', 2), 0xc6: ('bin', 4),
+	0xdc: ('array', 2), 0xdd: ('array', 4),
+	0xde: ('map', 2), 0xdf: ('map', 4),
+	0xc7: ('ext', 1), 0xc8: ('ext', 2), 0xc9: ('ext', 4),
+}
+
+_length_formats = {1: '>B', 2: '>H', 4: '>I'}
+
+def unpackb(data):
+	"""Decode a value encoded by L{packb}.
+	@type data: bytes
+	@raise DecodeError: if data isn't a single valid value"""
+	data = bytearray(data)		# (indexing gives ints on Python 2 too)
+	try:
+		value, pos = _unpack(data, 0)
+	except (struct.error, IndexError, UnicodeDecodeError, TypeError, ValueError) as ex:
+		raise DecodeError("Invalid message: %s" % ex)
+	if pos != len(data):
+		raise DecodeError("Unexpected data at end of message (at %d of %d bytes)" % (pos, len(data)))
+	return value
+
+def _unpack(data, pos):
+	"""@return: the value at pos, and the position of the next one"""
+	code = data[pos]
+	pos += 1
+	# The common cases first
+	if code < 0x80:
+		return code, pos
+	if 0xa0 <= code <= 0xbf:
+		end = pos + (code & 0x1f)
+		if end > len(data):
+			raise DecodeError("Truncated message")
+		return data[pos:end].decode('utf-8'), end
+	if code >= 0xe0:
+		return code - 0x100, pos
+	if code == 0xc0:
+		return None, pos
+	if code == 0xc2:
+		return False, pos
+	if code == 0xc3:
+		return True, pos
+	if code in _fixed:
+		fmt, size = _fixed[code]
+		return struct.unpack_from(fmt, data, pos)[0], pos + size
+
+	if 0x90 <= code <= 0x9f:
+		kind, n = 'array', code & 0x0f
+	elif 0x80 <= code <= 0x8f:
+		kind, n = 'map', code & 0x0f
+	elif code in _sized:
+		kind, size = _sized[code]
+		n = struct.unpack_from(_length_formats[size], data, pos)[0]
+		pos += size
+	else:
+		raise DecodeError("Unsupported type code 0x%x" % code)
+
+	if kind == 'array':
+		items = []
+		for i in range(n):
+			item, pos = _unpack(data, pos)
+			items.append(item)
+		return items, pos
+	if kind == 'map':
+		items = {}
+		for i in range(n):
+			k, pos = _unpack(data, pos)
+			if isinstance(k, (list, dict)):
+				raise DecodeError("Invalid map key type %s" % type(k).__name__)
+			items[k], pos = _unpack(data, pos)
+		return items, pos
+	if kind == 'ext':
+		ext_type = struct.unpack_from('b', data, pos)[0]
+		pos += 1
+	end = pos + n
+	if end > len(data):
+		raise DecodeError("Truncated message")
+	if kind == 'str':
+		return data[pos:end].decode('utf-8'), end
+	if kind == 'bin':
+		return bytes(data[pos:end]), end
+	if ext_type == ELEMENT_EXT:
+		fields, ext_end = _unpack(data, pos)
+		if ext_end != end:
+			raise DecodeError("Bad element length")
+		return _make_element(fields, None), end
+	raise DecodeError("Unsupported extension type %d" % ext_type)